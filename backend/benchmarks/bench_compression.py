@@ -0,0 +1,96 @@
+"""
+Disk footprint and read latency of cached pages stored as plain files,
+zlib compressed, and zlib compressed with a trained dictionary.
+
+    PYTHONPATH=. python benchmarks/bench_compression.py [glob ...]
+
+By default the page texts in data/webpage_cache/*/playwright.txt are used,
+falling back to the HTML bodies in ~/.cache/LessonLens/web_page_cache when
+those are Git LFS pointers that have not been pulled.
+"""
+import argparse
+import glob
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from ll.compression import Codec, Dictionaries, train_dictionary
+
+DEFAULT_GLOBS = ['data/webpage_cache/*/playwright.txt',
+                 str(Path.home() / '.cache/LessonLens/web_page_cache/*/content.html')]
+
+
+def load_samples(patterns, limit):
+    for pattern in patterns:
+        samples = []
+        for path in sorted(glob.glob(pattern))[:limit]:
+            data = Path(path).read_bytes()
+            if not data.startswith(b'version https://git-lfs'):
+                samples.append(data)
+        if samples:
+            print(f"{len(samples)} samples from {pattern}")
+            return samples
+    raise SystemExit(f"No samples found in {patterns}")
+
+
+def disk_usage(directory):
+    files = list(Path(directory).iterdir())
+    return (sum(f.stat().st_size for f in files),
+            sum(f.stat().st_blocks * 512 for f in files))
+
+
+def write(directory, samples, encode):
+    os.makedirs(directory)
+    for i, sample in enumerate(samples):
+        Path(directory, f'{i}').write_bytes(encode(sample))
+
+
+def read_latencies(directory, read):
+    latencies = []
+    for path in sorted(Path(directory).iterdir()):
+        start = time.perf_counter()
+        read(path)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('globs', nargs='*', default=DEFAULT_GLOBS)
+    parser.add_argument('--limit', type=int, default=5000)
+    parser.add_argument('--train-fraction', type=float, default=0.2)
+    args = parser.parse_args()
+
+    samples = load_samples(args.globs, args.limit)
+    # The dictionary is trained on some of the pages and measured on the others
+    n_train = max(1, int(len(samples) * args.train_fraction))
+    train, test = samples[:n_train], samples[n_train:] or samples
+
+    with tempfile.TemporaryDirectory() as root:
+        dictionaries = Dictionaries(Path(root) / 'dictionaries')
+        start = time.perf_counter()
+        trained = dictionaries.save('bench', train_dictionary(train))
+        print(f"Trained a {len(trained.zdict)} byte dictionary on {len(train)} samples "
+              f"in {time.perf_counter() - start:.1f}s\n")
+
+        variants = {
+            'plain': (lambda data: data, lambda path: path.read_bytes()),
+            'zlib': (Codec().compress, lambda path: dictionaries.open(path).read()),
+            'zlib+dictionary': (trained.compress, lambda path: dictionaries.open(path).read()),
+        }
+        raw = sum(len(sample) for sample in test)
+        print(f"{'storage':<16} {'bytes':>12} {'on disk':>12} {'ratio':>7} {'read p50':>10} {'read p95':>10}")
+        for name, (encode, read) in variants.items():
+            directory = Path(root) / name
+            write(directory, test, encode)
+            size, blocks = disk_usage(directory)
+            latencies = sorted(read_latencies(directory, read))
+            print(f"{name:<16} {size:>12} {blocks:>12} {raw / size:>7.2f} "
+                  f"{statistics.median(latencies) * 1e6:>8.0f}us "
+                  f"{latencies[int(len(latencies) * 0.95)] * 1e6:>8.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Throughput and latency of the LLM client under concurrent load, against
+the fake provider, so that rate limits, concurrency caps and retries can
+be tuned offline.
+
+    PYTHONPATH=. python benchmarks/bench_llm.py --requests 200 --threads 32 --rpm 600 --concurrency 8
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ll.llm import FakeProvider, LLMClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds per fake completion")
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--rpm', type=float, default=0, help="Requests per minute, 0 is unlimited")
+    parser.add_argument('--tpm', type=float, default=0, help="Tokens per minute, 0 is unlimited")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--prompt-chars', type=int, default=5000)
+    args = parser.parse_args()
+
+    provider = FakeProvider(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    client = LLMClient(provider, 'fake', requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                       concurrency=args.concurrency, backoff=0.1)
+
+    def request(i):
+        start = time.perf_counter()
+        try:
+            client.complete(f'{i} ' + 'x' * args.prompt_chars)
+            return time.perf_counter() - start
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as executor:
+        results = list(executor.map(request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r for r in results if r is not None)
+    stats = client.stats()
+    print(f"{len(latencies)}/{args.requests} completed in {elapsed:.1f}s, "
+          f"{len(latencies) / elapsed:.1f} requests/s")
+    if latencies:
+        print(f"latency p50 {statistics.median(latencies):.2f}s, "
+              f"p95 {latencies[int(len(latencies) * 0.95)]:.2f}s, max {latencies[-1]:.2f}s")
+    print(f"retries {stats['retries']}, errors {stats['errors']}, "
+          f"waiting for limits {stats['waited_seconds']:.1f}s in total")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Throughput, latency, threads and memory of the threaded Flask app and of
+the ASGI app serving /api/metadata to the same number of concurrent
+clients. Pages come from memory after a simulated fetch latency and the
+LLM is the fake provider, so only the serving model differs. With
+--memory-mb it reports the most concurrent clients each mode served
+within that much Python memory (tracemalloc peak).
+
+    PYTHONPATH=. python benchmarks/bench_serving.py --concurrency 8 32 128 --requests 256 --memory-mb 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# Before ll is imported: caches in a scratch directory, the fake LLM without batching
+os.environ['HOME'] = tempfile.mkdtemp()
+os.environ.setdefault('LL_LLM_PROVIDER', 'fake')
+os.environ.setdefault('LL_LLM_BATCH_TOKENS', '0')
+
+import httpx
+
+from ll import init_webapp, llm
+from ll.api import pages
+from ll.asgi import ASGIApp
+from ll.classifiers import METADATA_FIELDS
+
+TEXT = "Das Ohmsche Gesetz beschreibt den Zusammenhang zwischen Spannung und Strom. " * 60
+
+
+def metadata_response(model, prompt):
+    return json.dumps({field: model for field in METADATA_FIELDS})
+
+
+class ThreadPeak:
+    """Most threads alive at once while sampling."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def payload(mode, concurrency, i):
+    return {'results': [{'url': f'https://example.org/{mode}/{concurrency}/{i}/{k}', 'title': f'Page {k}',
+                         'description': ''} for k in range(2)]}
+
+
+def run_threads(app, concurrency, requests):
+    def request(i):
+        start = time.perf_counter()
+        response = app.test_client().post('/api/metadata', json=payload('threads', concurrency, i))
+        return time.perf_counter() - start if response.status_code == 200 and len(response.json) == 2 else None
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(request, range(requests)))
+
+
+def run_asgi(app, concurrency, requests):
+    asgi = ASGIApp(app)
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=asgi)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+            async def request(i):
+                async with slots:
+                    start = time.perf_counter()
+                    response = await client.post('/api/metadata', json=payload('asgi', concurrency, i))
+                    ok = response.status_code == 200 and len(response.json()) == 2
+                    return time.perf_counter() - start if ok else None
+            return await asyncio.gather(*[request(i) for i in range(requests)])
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--fetch-latency', type=float, default=0.2, help="Seconds per page fetch")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds per fake completion")
+    parser.add_argument('--memory-mb', type=float, default=0)
+    args = parser.parse_args()
+
+    app = init_webapp(test=True)
+    llm._providers['fake'] = llm.FakeProvider(latency=args.llm_latency, respond=metadata_response)
+    os.environ.setdefault('LL_LLM_FAKE_CONCURRENCY', str(max(args.concurrency) * 2))
+
+    def fetch_text(url):
+        time.sleep(args.fetch_latency)
+        return TEXT
+
+    async def fetch_text_async(url):
+        await asyncio.sleep(args.fetch_latency)
+        return TEXT
+
+    pages.fetch_text = fetch_text
+    pages.fetch_text_async = fetch_text_async
+
+    within_budget = {}
+    print(f"{'mode':8} {'clients':>7} {'req/s':>8} {'p50':>6} {'p95':>6} {'failed':>6} {'threads':>7} {'peak MB':>8}")
+    for concurrency in args.concurrency:
+        for mode, run in [('threads', run_threads), ('asgi', run_asgi)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            with ThreadPeak() as threads:
+                results = run(app, concurrency, args.requests)
+            elapsed = time.perf_counter() - start
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+
+            latencies = sorted(r for r in results if r is not None)
+            p50 = statistics.median(latencies) if latencies else float('nan')
+            p95 = latencies[int(len(latencies) * 0.95)] if latencies else float('nan')
+            print(f"{mode:8} {concurrency:7} {len(latencies) / elapsed:8.1f} {p50:6.2f} {p95:6.2f} "
+                  f"{len(results) - len(latencies):6} {threads.peak:7} {peak_mb:8.1f}")
+            if args.memory_mb and peak_mb <= args.memory_mb:
+                within_budget[mode] = max(within_budget.get(mode, 0), concurrency)
+
+    if args.memory_mb:
+        for mode in ['threads', 'asgi']:
+            print(f"{mode}: up to {within_budget.get(mode, 0)} concurrent clients within {args.memory_mb:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+# gunicorn -c gunicorn.conf.py ll.run:app, or with -k uvicorn.workers.UvicornWorker 'll.asgi:create_app()'
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('LL_THREADS', 8))
+timeout = int(os.getenv('LL_WORKER_TIMEOUT', 120))
+
+# The app is imported, and the models loaded (ll.init_webapp), once in the
+# master. Workers are forked from it and share those pages copy-on-write
+# instead of each loading everything again.
+preload_app = True
+
+
+def when_ready(server):
+    # Everything allocated so far is left alone by the garbage collector, whose
+    # reference count updates would otherwise copy the shared pages into each worker
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
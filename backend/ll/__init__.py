@@ -1,17 +1,19 @@
 import logging
-from flask import Flask
-from flask_cors import CORS
-from ll.api import api
-from ll.model import db
 import os
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 log = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
 def init_webapp(test=False):
+    # Imported here rather than with the package, so that processes using
+    # only parts of ll (e.g. the text extraction workers) don't load the app
+    from flask import Flask
+    from flask_cors import CORS
+    from ll.api import api
+    from ll.model import db
+
+    app = Flask(__name__)
     app.register_blueprint(api, url_prefix='/api')
     
     if test:
@@ -26,4 +28,15 @@ def init_webapp(test=False):
          resources={r"/api/*": {"origins": "*"}})
     db.app = app
     db.init_app(app)
-    return app
\ No newline at end of file
+
+    # LL_LAZY_STARTUP=1 answers requests right away and loads models on first use
+    if not test and os.environ.get('LL_LAZY_STARTUP') != '1':
+        warm()
+    return app
+
+def warm():
+    """Load the models and the modules imported lazily, so that first requests don't wait for them."""
+    from ll.classifiers import warm_models
+    from ll.lazy import preload
+    warm_models()
+    preload()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from functools import partial
+from operator import itemgetter
+from typing import Dict, List, Optional
+
+from ll.classifiers import content_based_adaptive_snippet, content_based_adaptive_snippet_async, \
+    content_based_analysis, content_based_analysis_async, content_based_gpt_metadata_inference, \
+    content_based_gpt_metadata_inference_async, page_content, result_errors
+from ll.deadline import Deadline, gather_until_deadline, map_until_deadline
+from ll.metadata import metadata_part
+from ll.snippets import snippet_part, summary_part
+
+log = logging.getLogger("analyze")
+
+PAGE_CHARS = 5000
+
+
+class Analyzer:
+    """
+    Summary, metadata and enhanced snippets for a SERP in one pass: each
+    page is fetched and truncated once, the snippet questions are derived
+    once per query, and with `merge` metadata and snippet of a page come
+    from a single LLM call.
+    """
+
+    def __init__(self, web_page_cache, summarizer, snippet_enhancer):
+        self.web_page_cache = web_page_cache
+        self.summarizer = summarizer
+        self.snippet_enhancer = snippet_enhancer
+
+    def analyze(self, serp_data: List[Dict], query: str, deadline: Optional[Deadline] = None,
+                merge: bool = True) -> Dict:
+        questions = self.snippet_enhancer.questions(query)
+        pages = map_until_deadline(partial(self._analyze_page, questions=questions, merge=merge),
+                                   serp_data[:2], itemgetter('url'), deadline)
+        return self._response(self.summarizer.summarize_fast(serp_data), pages)
+
+    async def analyze_async(self, serp_data: List[Dict], query: str, deadline: Optional[Deadline] = None,
+                            merge: bool = True) -> Dict:
+        """analyze on the event loop of the ASGI app, summarizing while the pages are analyzed."""
+        questions = await asyncio.to_thread(self.snippet_enhancer.questions, query)
+        summary = asyncio.ensure_future(asyncio.to_thread(self.summarizer.summarize_fast, serp_data))
+        pages = await gather_until_deadline(partial(self._analyze_page_async, questions=questions, merge=merge),
+                                            serp_data[:2], itemgetter('url'), deadline)
+        return self._response(await summary, pages)
+
+    @staticmethod
+    def _response(summary: Dict, pages) -> Dict:
+        return {
+            'summary': summary,
+            'metadata': [page['metadata'] for page in pages if page['metadata']],
+            'snippets': [page['snippet'] for page in pages if page['snippet']],
+            'pending': pages.pending,
+        }
+
+    def _analyze_page(self, result: Dict, questions: List[str], merge: bool) -> Optional[Dict]:
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, self.web_page_cache.fetch_text(url), PAGE_CHARS)
+            if merge:
+                metadata, snippet = content_based_analysis(url, content, questions)
+            else:
+                metadata = content_based_gpt_metadata_inference(url, content)
+                snippet = content_based_adaptive_snippet(url, content, questions)
+            return self._page(result, metadata, snippet)
+        return None
+
+    async def _analyze_page_async(self, result: Dict, questions: List[str], merge: bool) -> Optional[Dict]:
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, await self.web_page_cache.fetch_text_async(url), PAGE_CHARS)
+            if merge:
+                metadata, snippet = await content_based_analysis_async(url, content, questions)
+            else:
+                metadata, snippet = await asyncio.gather(content_based_gpt_metadata_inference_async(url, content),
+                                                         content_based_adaptive_snippet_async(url, content, questions))
+            return self._page(result, metadata, snippet)
+        return None
+
+    @staticmethod
+    def _page(result: Dict, metadata: Optional[Dict], snippet) -> Dict:
+        return {
+            'metadata': metadata_part(result['url'], metadata),
+            'snippet': snippet_part(summary_part(result), snippet),
+        }
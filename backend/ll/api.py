@@ -1,11 +1,19 @@
 import json
+import os
 from pathlib import Path
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, g, request, jsonify, Response, url_for
+
+from ll import llm, timing
 
 from ll.summary import Summarizer
 from ll.metadata import MetadataEnricher
 from ll.snippets import SnippetEnhancer
 from ll.cache import WebPageCache
+from ll.extract import extractor
+from ll.analyze import Analyzer
+from ll.classifiers import models, snippet_cache, url_cache
+from ll.deadline import Deadline
+from ll.jobs import JobQueue, QueueFull
 import logging
 
 log = logging.getLogger(__name__)
@@ -14,21 +22,169 @@ pages = WebPageCache()
 summarizer = Summarizer()
 metadata = MetadataEnricher(pages)
 snippets = SnippetEnhancer(pages)
+analyzer = Analyzer(pages, summarizer, snippets)
+jobs = JobQueue({
+    'metadata': lambda result, query: metadata.enrich_result(result),
+    'snippets': lambda result, query: snippets.enhance_result(result, query),
+})
 
 class Config:
     TEXT_LIMIT = 1000
+    # Seconds /metadata and /enhanced-snippets take at most, clients can ask
+    # for less (or more, up to MAX_DEADLINE) with deadline_ms or X-Deadline-Ms
+    DEADLINE = float(os.getenv('LL_DEADLINE', 10))
+    MAX_DEADLINE = 60
+
+def parse_deadline(value) -> Deadline:
+    """Deadline of deadline_ms or X-Deadline-Ms milliseconds, Config.DEADLINE when not given."""
+    try:
+        seconds = float(value) / 1000
+    except (TypeError, ValueError):
+        seconds = Config.DEADLINE
+    return Deadline(min(max(seconds, 0), Config.MAX_DEADLINE))
+
+def request_deadline() -> Deadline:
+    return parse_deadline(request.headers.get('X-Deadline-Ms',
+                                              (request.get_json(silent=True) or {}).get('deadline_ms')))
+
+STREAM_TYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+def choose_stream_format(requested, accept):
+    """'ndjson' or 'sse' when asked for with ?stream= or the Accept header, else None."""
+    if requested in STREAM_TYPES:
+        return requested
+    for name, mimetype in STREAM_TYPES.items():
+        if mimetype in (accept or ''):
+            return name
+    return None
+
+def stream_format():
+    return choose_stream_format(request.args.get('stream'), request.headers.get('Accept', ''))
+
+def encode_event(format, event, data):
+    """One streamed message: a JSON line, or an SSE event."""
+    if format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps(data) + "\n"
+
+def stream_response(results, format):
+    """
+    One message per result as it completes, then a final one listing the
+    URLs still pending: JSON lines, or 'result' and 'done' events for SSE.
+    """
+    def messages():
+        for result in results:
+            yield encode_event(format, 'result', result)
+        yield encode_event(format, 'done', {'done': True, 'pending': results.pending})
+
+    response = Response(messages(), mimetype=STREAM_TYPES[format])
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keeps proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+def partial_response(results):
+    """JSON list of the finished results, the URLs still pending in X-Pending-Results."""
+    response = jsonify(results)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Expose-Headers', 'X-Pending-Results')
+    if results.pending:
+        response.headers['X-Pending-Results'] = json.dumps(results.pending)
+    return response
 
 def handle_options_request():
     response = jsonify({'status': 'ok'})
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Accept')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Accept,X-Deadline-Ms')
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     return response
 
+@api.before_request
+def start_timings():
+    g.timings = timing.begin()
+
+@api.after_request
+def add_server_timing(response):
+    """
+    Time per stage in Server-Timing. Streamed responses only include the
+    stages before their first message, the histograms get all of them.
+    """
+    timings = timing.current()
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.header()
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@api.teardown_request
+def end_timings(exc):
+    token = g.pop('timings', None)
+    if token is not None:
+        timing.end(token, request.endpoint or 'unknown')
+
+def stats_metrics():
+    """Counters and gauges of the caches, LLM clients, extraction and HTTP clients, read when scraped."""
+    page_stats = pages.stats()
+    hits, misses = [], []
+    for layer, stats in [('memory', page_stats['memory']), ('total', page_stats['overall'])]:
+        hits.append(({'cache': 'pages', 'layer': layer}, stats['hits']))
+        misses.append(({'cache': 'pages', 'layer': layer}, stats['misses']))
+    hits.append(({'cache': 'pages', 'layer': 'pack'}, page_stats['pack']['hits']))
+    hits.append(({'cache': 'pages', 'layer': 'negative'}, page_stats['negative']['hits']))
+    for name, cache in [('metadata', url_cache), ('snippets', snippet_cache)]:
+        stats = cache.stats()
+        for layer in ['memory', 'store']:
+            if stats[layer] is not None:
+                hits.append(({'cache': name, 'layer': layer}, stats[layer]['hits']))
+                misses.append(({'cache': name, 'layer': layer}, stats[layer]['misses']))
+
+    clients = llm.stats()
+    def per_client(key):
+        return [({'provider': c['provider'], 'model': c['model']}, c[key]) for c in clients]
+
+    extract_stats = extractor.stats()
+    return [
+        ('ll_cache_hits_total', 'counter', 'Lookups answered by a cache layer.', hits),
+        ('ll_cache_misses_total', 'counter', 'Lookups a cache layer could not answer.', misses),
+        ('ll_llm_requests_total', 'counter', 'Requests sent to an LLM, retries included.', per_client('requests')),
+        ('ll_llm_retries_total', 'counter', 'LLM requests retried.', per_client('retries')),
+        ('ll_llm_errors_total', 'counter', 'LLM calls that failed.', per_client('errors')),
+        ('ll_llm_in_flight', 'gauge', 'LLM requests in progress.', per_client('in_flight')),
+        ('ll_llm_wait_seconds_total', 'counter', 'Time spent waiting for LLM rate limits and slots.',
+         per_client('waited_seconds')),
+        ('ll_extractions_total', 'counter', 'Text extractions by outcome.',
+         [({'outcome': outcome}, extract_stats[outcome]) for outcome in ['extracted', 'too_large', 'late',
+                                                                          'broken_pool']]),
+        ('ll_http_requests_total', 'counter', 'Page downloads requested.',
+         [({'client': 'threads'}, page_stats['http']['requests']),
+          ({'client': 'async'}, page_stats['async_http']['requests'])]),
+        ('ll_http_connections_total', 'counter', 'TCP connections opened for page downloads.',
+         [({'client': 'threads'}, page_stats['http']['connections'])]),
+        ('ll_http_open_circuits', 'gauge', 'Hosts not requested after repeated failures.',
+         [({}, len(page_stats['http']['open_circuits']))]),
+    ]
+
 @api.route('/ping', methods=['GET'])
 def ping():
   return jsonify({'status': 'ok'})
 
+@api.route('/models', methods=['GET'])
+def model_stats():
+    return jsonify(models.stats())
+
+@api.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'pages': pages.stats(),
+        'metadata': url_cache.stats(),
+        'snippets': snippet_cache.stats(),
+    })
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage and endpoint latencies and the counters of stats_metrics, per worker, for Prometheus."""
+    return Response(timing.prometheus(stats_metrics()), mimetype=timing.PROMETHEUS_TYPE)
+
 @api.route('/summary', methods=['POST', 'OPTIONS'])
 def summary():
     if request.method == 'OPTIONS':
@@ -48,20 +204,79 @@ def metadata_endpoint():
     if request.method == 'OPTIONS':
         return handle_options_request()
     elif request.method == 'POST':
-        response = metadata.enrich(request.json['results'])
-        response = jsonify(response)
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
+        if format := stream_format():
+            return stream_response(metadata.stream(request.json['results'], request_deadline()), format)
+        return partial_response(metadata.enrich(request.json['results'], request_deadline()))
 
 @api.route('/enhanced-snippets', methods=['POST', 'OPTIONS'])
 def enhanced_snippets():
     if request.method == 'OPTIONS':
         return handle_options_request()
     elif request.method == 'POST':
-        response = snippets.enhance(request.json['results'], request.json['query'])
-        response = jsonify(response)
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
+        if format := stream_format():
+            return stream_response(snippets.stream(request.json['results'], request.json['query'],
+                                                   request_deadline()), format)
+        return partial_response(snippets.enhance(request.json['results'], request.json['query'],
+                                                 request_deadline()))
+
+@api.route('/analyze', methods=['POST', 'OPTIONS'])
+def analyze():
+    """Summary, metadata and enhanced snippets in one request, fetching each page once."""
+    if request.method == 'OPTIONS':
+        return handle_options_request()
+    response = jsonify(analyzer.analyze(request.json['results'], request.json['query'], request_deadline(),
+                                        merge=request.json.get('merge', True)))
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@api.route('/jobs', methods=['POST', 'OPTIONS'])
+def create_job():
+    """Annotate all results of a SERP in the background, top ranks first."""
+    if request.method == 'OPTIONS':
+        return handle_options_request()
+    query, features = request.json.get('query'), request.json.get('features')
+    if 'snippets' in (features or jobs.handlers) and not query:
+        return jsonify({'error': 'Snippets need a query'}), 400
+    try:
+        job_id = jobs.submit(request.json['results'], query, features)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull:
+        return jsonify({'error': 'Too many jobs in progress, retry later'}), 503
+    response = jsonify({
+        'job_id': job_id,
+        'status_url': url_for('api.job_status', job_id=job_id),
+        'stream_url': url_for('api.job_stream', job_id=job_id),
+    })
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, 202
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    snapshot = jobs.get(job_id)
+    if snapshot is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    response = jsonify(snapshot)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@api.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    """Per-URL results of a job as they complete (NDJSON, or SSE when asked for)."""
+    if jobs.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return stream_response(JobFollower(job_id), stream_format() or 'ndjson')
+
+class JobFollower:
+    """A job's results in the shape stream_response expects."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.pending = []
+
+    def __iter__(self):
+        yield from jobs.follow(self.job_id)
+        self.pending = (jobs.get(self.job_id) or {}).get('pending', [])
 
 @api.route('/study-settings', methods=['OPTIONS', 'POST'])
 def study_settings():
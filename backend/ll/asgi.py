@@ -0,0 +1,285 @@
+"""
+ASGI serving mode: the annotation endpoints run as coroutines on one event
+loop per worker, fetching pages with httpx and calling the LLMs with the
+async SDK clients. A request waiting for the network holds no thread, the
+limits are the global semaphores of the LLM and HTTP clients instead of a
+thread pool per request. Every other route is served by the Flask app,
+called in a small thread pool; the streams of the job routes are read in
+a pool of their own.
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker 'll.asgi:create_app()'
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from ll.api import STREAM_TYPES, analyzer, choose_stream_format, encode_event, metadata, pages, parse_deadline, \
+    snippets
+from ll import timing
+from ll.deadline import Deadline
+
+log = logging.getLogger("asgi")
+
+Headers = List[Tuple[bytes, bytes]]
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+class BadRequest(Exception):
+    """The request body is not the JSON the endpoint expects."""
+
+
+class Request:
+    """An HTTP request of the ASGI app, its body read in full."""
+
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {name: values[-1] for name, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+        self._json = None
+
+    @property
+    def json(self) -> Dict[str, Any]:
+        if self._json is None:
+            try:
+                self._json = json.loads(self.body or b'null')
+            except ValueError as e:
+                raise BadRequest(f"Invalid JSON: {e}")
+            if not isinstance(self._json, dict):
+                raise BadRequest("Expected a JSON object")
+        return self._json
+
+    def field(self, name: str) -> Any:
+        try:
+            return self.json[name]
+        except KeyError:
+            raise BadRequest(f"Missing {name}")
+
+    def deadline(self) -> Deadline:
+        return parse_deadline(self.headers.get('x-deadline-ms', self.json.get('deadline_ms')))
+
+    def stream_format(self) -> Optional[str]:
+        return choose_stream_format(self.args.get('stream'), self.headers.get('accept', ''))
+
+
+class Response:
+    def __init__(self, body: Any = b'', status: int = 200, headers: Headers = (),
+                 content_type: bytes = b'application/json'):
+        self.body = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.status = status
+        self.headers = [(b'content-type', content_type), *headers]
+
+    async def send(self, send: Callable[[Dict], Awaitable[None]]):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': [*self.headers, (b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse(Response):
+    """stream_response of the Flask app: one message per result as it completes, then the pending URLs."""
+
+    def __init__(self, results: AsyncIterable, format: str):
+        super().__init__(status=200, content_type=STREAM_TYPES[format].encode(), headers=[
+            (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'), *CORS_HEADERS])
+        self.results = results
+        self.format = format
+
+    async def send(self, send: Callable[[Dict], Awaitable[None]]):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+        async for result in self.results:
+            await send({'type': 'http.response.body', 'more_body': True,
+                        'body': encode_event(self.format, 'result', result).encode('utf-8')})
+        done = {'done': True, 'pending': self.results.pending}
+        await send({'type': 'http.response.body', 'body': encode_event(self.format, 'done', done).encode('utf-8')})
+
+
+def partial_response(results) -> Response:
+    """JSON list of the finished results, the URLs still pending in X-Pending-Results."""
+    headers = [*CORS_HEADERS, (b'access-control-expose-headers', b'X-Pending-Results')]
+    if results.pending:
+        headers.append((b'x-pending-results', json.dumps(results.pending).encode('utf-8')))
+    return Response(list(results), headers=headers)
+
+
+def options_response() -> Response:
+    return Response({'status': 'ok'}, headers=[
+        *CORS_HEADERS,
+        (b'access-control-allow-headers', b'Content-Type,Accept,X-Deadline-Ms'),
+        (b'access-control-allow-methods', b'GET,POST,OPTIONS'),
+    ])
+
+
+# Endpoints served on the event loop, the same as their Flask routes in ll.api
+
+async def ping(request: Request) -> Response:
+    return Response({'status': 'ok'}, headers=CORS_HEADERS)
+
+
+async def metadata_endpoint(request: Request) -> Response:
+    results, deadline = request.field('results'), request.deadline()
+    if format := request.stream_format():
+        return StreamingResponse(await metadata.stream_async(results, deadline), format)
+    return partial_response(await metadata.enrich_async(results, deadline))
+
+
+async def enhanced_snippets(request: Request) -> Response:
+    results, query, deadline = request.field('results'), request.field('query'), request.deadline()
+    if format := request.stream_format():
+        return StreamingResponse(await snippets.stream_async(results, query, deadline), format)
+    return partial_response(await snippets.enhance_async(results, query, deadline))
+
+
+async def analyze(request: Request) -> Response:
+    return Response(await analyzer.analyze_async(request.field('results'), request.field('query'),
+                                                 request.deadline(), merge=request.json.get('merge', True)),
+                    headers=CORS_HEADERS)
+
+
+ROUTES: Dict[str, Tuple[Tuple[str, ...], Callable[[Request], Awaitable[Response]]]] = {
+    '/api/ping': (('GET',), ping),
+    '/api/metadata': (('POST', 'OPTIONS'), metadata_endpoint),
+    '/api/enhanced-snippets': (('POST', 'OPTIONS'), enhanced_snippets),
+    '/api/analyze': (('POST', 'OPTIONS'), analyze),
+}
+
+
+def wsgi_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class ASGIApp:
+    """
+    Serves ROUTES natively and hands every other request to `wsgi_app`,
+    run in a pool of `wsgi_threads` threads. Responses of the Flask app are
+    sent chunk by chunk as it produces them, so the job streams still work.
+    Streamed responses (those without a Content-Length) are read in a
+    separate pool of `stream_threads`, so that clients following job
+    streams for minutes do not hold up the other Flask routes.
+    """
+
+    def __init__(self, wsgi_app, wsgi_threads: int = int(os.getenv('LL_ASGI_WSGI_THREADS', 8)),
+                 stream_threads: int = int(os.getenv('LL_ASGI_STREAM_THREADS', 32))):
+        self.wsgi_app = wsgi_app
+        self.wsgi_executor = ThreadPoolExecutor(wsgi_threads, thread_name_prefix='wsgi')
+        self.stream_executor = ThreadPoolExecutor(stream_threads, thread_name_prefix='wsgi-stream')
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict]],
+                       send: Callable[[Dict], Awaitable[None]]):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        body = await read_body(receive)
+        methods, endpoint = ROUTES.get(scope['path'], ((), None))
+        if scope['method'] not in methods:
+            return await self.call_wsgi(scope, body, send)
+        if scope['method'] == 'OPTIONS':
+            return await options_response().send(send)
+
+        # Timed like the Flask routes, under their endpoint names
+        token = timing.begin()
+        try:
+            try:
+                response = await endpoint(Request(scope, body))
+            except BadRequest as e:
+                response = Response({'error': str(e)}, status=400, headers=CORS_HEADERS)
+            except Exception as e:
+                log.error(f"Error serving {scope['path']}", exc_info=e)
+                response = Response({'error': 'Internal server error'}, status=500, headers=CORS_HEADERS)
+            response.headers += [(b'server-timing', timing.current().header().encode('latin-1')),
+                                 (b'timing-allow-origin', b'*')]
+            await response.send(send)
+        finally:
+            timing.end(token, f'api.{endpoint.__name__}')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await pages.async_http.aclose()
+                self.wsgi_executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope: Dict[str, Any], body: bytes, send: Callable[[Dict], Awaitable[None]]):
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return lambda data: None
+
+        chunks = await loop.run_in_executor(self.wsgi_executor, self.wsgi_app, wsgi_environ(scope, body),
+                                            start_response)
+        streamed = all(name != b'content-length' for name, _ in started['headers'])
+        executor = self.stream_executor if streamed else self.wsgi_executor
+        iterator = iter(chunks)
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while (chunk := await loop.run_in_executor(executor, next, iterator, None)) is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(executor, chunks.close)
+
+
+async def read_body(receive: Callable[[], Awaitable[Dict]]) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def create_app(wsgi_app=None) -> ASGIApp:
+    """The ASGI app, around the Flask app of ll.init_webapp unless one is given."""
+    if wsgi_app is None:
+        from ll import init_webapp
+        wsgi_app = init_webapp()
+    return ASGIApp(wsgi_app)
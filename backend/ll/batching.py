@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from ll import deadline
+
+log = logging.getLogger("batching")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a piece of prompt, about four characters per token."""
+    return len(text) // 4 + 1
+
+
+class Batch:
+    def __init__(self, group: Hashable):
+        self.group = group
+        self.documents: List[str] = []
+        self.tokens = 0
+        self.full = threading.Event()
+        # Responses by index into documents, for the documents the batch call answered
+        self.responses: Future = Future()
+
+
+class Batcher:
+    """
+    Packs documents sent to the LLM at the same time, by the threads
+    annotating one SERP or by the job workers, into one prompt. The first
+    document opens a batch and waits up to `window` seconds for others
+    with the same group, the part of the prompt they share (e.g. the
+    snippet questions), until `budget` tokens or `max_documents` are
+    reached. Its thread then sends them with fetch_batch(group, documents),
+    which returns the usable responses by document index. The call is
+    shared, so it runs without the deadline of the thread sending it; each
+    caller stops waiting at its own deadline.
+
+    A document alone in its batch, one larger than the budget, or one
+    without a usable response is sent on its own with fetch_one(input).
+    A budget of 0 turns batching off.
+    """
+
+    def __init__(self, fetch_batch: Callable[[Hashable, List[str]], Dict[int, Any]],
+                 fetch_one: Callable[[Any], Any],
+                 split: Callable[[Any], Tuple[Hashable, str]] = lambda input: (None, input),
+                 budget: int = int(os.getenv('LL_LLM_BATCH_TOKENS', 8000)),
+                 window: float = float(os.getenv('LL_LLM_BATCH_WINDOW', 0.05)),
+                 max_documents: int = 8, timeout: float = 60):
+        self.fetch_batch = fetch_batch
+        self.fetch_one = fetch_one
+        self.split = split
+        self.budget = budget
+        self.window = window
+        self.max_documents = max_documents
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._open: Dict[Hashable, Batch] = {}
+
+    def __call__(self, input: Any) -> Any:
+        group, document = self.split(input)
+        tokens = estimate_tokens(document)
+        if tokens > self.budget:
+            return self.fetch_one(input)
+
+        with self._lock:
+            batch = self._open.get(group)
+            if batch is not None and batch.tokens + tokens > self.budget:
+                # Full: let its leader send it now, and start the next one
+                del self._open[group]
+                batch.full.set()
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._open[group] = Batch(group)
+            index = len(batch.documents)
+            batch.documents.append(document)
+            batch.tokens += tokens
+            if len(batch.documents) >= self.max_documents:
+                del self._open[group]
+                batch.full.set()
+
+        responses = self._send(batch) if leader else self._wait(batch)
+        response = responses.get(index)
+        if response is None:
+            return self.fetch_one(input)
+        return response
+
+    def _send(self, batch: Batch) -> Dict[int, Any]:
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._open.get(batch.group) is batch:
+                del self._open[batch.group]
+        responses = {}
+        if len(batch.documents) > 1:
+            try:
+                with deadline.deadline_scope(None):
+                    responses = self.fetch_batch(batch.group, batch.documents) or {}
+            except Exception as e:
+                log.error(f"Batch of {len(batch.documents)} documents failed: {e}")
+            if len(responses) < len(batch.documents):
+                log.warning(f"{len(batch.documents) - len(responses)} of {len(batch.documents)} "
+                            f"batched documents fall back to single calls")
+        batch.responses.set_result(responses)
+        return responses
+
+    def _wait(self, batch: Batch) -> Dict[int, Any]:
+        try:
+            return batch.responses.result(timeout=deadline.timeout(self.window + self.timeout))
+        except TimeoutError:
+            deadline.check()
+            return {}
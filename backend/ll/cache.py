@@ -1,33 +1,134 @@
-import hashlib
+import asyncio
+import codecs
 import json
 import logging
 import os
+import shutil
+import time
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
 
-import pypdf
 import requests
-import trafilatura
-from docx import Document
-from PIL import Image
+
+from ll import deadline, timing
+from ll.extract import Extractor, docx_text, extractor as shared_extractor, pdf_text, read_body
+from ll.http_client import AsyncHTTPClient, CircuitOpenError, HTTPClient, httpx
+from ll.lazy import lazy_import
+from ll.memcache import MemoryCache, memory_cache
+from ll.pack import PagePack, open_pack
+from ll.singleflight import AsyncSingleFlight, AtomicFile, SingleFlight, atomic_write, file_lock
+from ll.store import BODY_SIZE, CacheStore, Entry, cache_root, dictionaries, hash, open_store
 
 log = logging.getLogger("cache")
 logging.getLogger("trafilatura").setLevel(logging.FATAL)
 logging.getLogger("urllib3").setLevel(logging.FATAL)
 import urllib3
+
+Image = lazy_import('PIL.Image')
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def hash(key):
-    return hashlib.md5(str(key).encode()).hexdigest()
-    
+
+class BodyTooLarge(Exception):
+    """A response body over the size limit of its content type."""
+
+
+class BodyChunks:
+    """
+    The body of a streamed response in chunks, as UTF-8 when an `encoding`
+    to decode it from is given. Past `limit` bytes it ends early when
+    `truncate` is set, and raises BodyTooLarge otherwise. Iterated with
+    async for, it reads an httpx response instead of a requests one.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, response, limit: int, truncate: bool = False, encoding: Optional[str] = None):
+        self.response = response
+        self.limit = limit
+        self.truncate = truncate
+        self.encoding = encoding
+        self.truncated = False
+        self.size = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace') if encoding else None
+
+    def _take(self, chunk: bytes) -> bytes:
+        # A slow server can take longer than any single read timeout
+        deadline.check()
+        if self.size + len(chunk) > self.limit:
+            if not self.truncate:
+                raise BodyTooLarge(f"More than {self.limit} bytes")
+            chunk = chunk[:self.limit - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        return self._decoder.decode(chunk).encode('utf-8') if self._decoder else chunk
+
+    def _end(self) -> bytes:
+        return self._decoder.decode(b'', final=True).encode('utf-8') if self._decoder else b''
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.response.iter_content(self.CHUNK_SIZE):
+            yield self._take(chunk)
+            if self.truncated:
+                break
+        yield self._end()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.response.aiter_bytes(self.CHUNK_SIZE):
+            yield self._take(chunk)
+            if self.truncated:
+                break
+        yield self._end()
+
 
 class WebPageCache:
-    def __init__(self,request_timeout: int = 30,
-                 head_timeout: int = 10):
-        self.cache_path = Path(os.getenv("HOME")) / '.cache' / 'LessonLens' / 'web_page_cache' 
+    CONTENT_TYPES = {
+        'text/html': 'html',
+        'application/pdf': 'pdf',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx'
+    }
+    # With a budget set, eviction runs after every EVICT_EVERY downloads
+    EVICT_EVERY = 50
+    # Bodies of these types are stored compressed as content.<ext>.z (PDF
+    # and DOCX files are compressed internally already)
+    COMPRESSED_TYPES = {'html'}
+    # Largest body downloaded per type, overridden with LL_MAX_BODY_<EXT>.
+    # Longer HTML is cut off at the limit, its beginning holds enough text;
+    # PDF and DOCX files are unreadable without their end and not kept.
+    MAX_BODY_BYTES = {'html': 5 * 1024 * 1024, 'pdf': 20 * 1024 * 1024, 'docx': 10 * 1024 * 1024}
+    TRUNCATABLE_TYPES = {'html'}
+
+    def __init__(self, request_timeout: int = 30, http: Optional[HTTPClient] = None,
+                 store: Optional[CacheStore] = None, memory: Optional[MemoryCache] = None,
+                 pack: Optional[PagePack] = None, failures: Optional[CacheStore] = None,
+                 extractor: Optional[Extractor] = None, async_http: Optional[AsyncHTTPClient] = None):
+        # Page bodies are files under cache_path, manifests and extracted text live in
+        # the store, with recently used entries also kept in memory
+        self.cache_path = cache_root() / 'web_page_cache'
         self.cache_path.mkdir(exist_ok=True, parents=True)
+        self.dictionaries = dictionaries()
+        self.store = store or open_store('pages')
+        self.memory = memory or memory_cache('pages')
+        # Read-only texts of the pre-rendered corpus, when the pack has been built
+        self.pack = pack if pack is not None else open_pack()
+        self.pack_hits = 0
+        # Failed downloads are remembered for negative_ttl seconds, so that
+        # dead or slow URLs are not requested again on every search
+        self.failures = failures or open_store('page_failures')
+        self.negative_ttl = float(os.getenv('LL_NEGATIVE_TTL', 600))
+        self.negative_hits = 0
         self.request_timeout = request_timeout
-        self.head_timeout = head_timeout
+        self.http = http or HTTPClient()
+        # Downloads of the ASGI app, sharing the circuit breaker of the threads' client
+        self.async_http = async_http or AsyncHTTPClient(breaker=self.http.breaker)
+        # Parsing runs in a process pool, downloads stay on the calling threads
+        self.extractor = extractor or shared_extractor
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.max_bytes = int(os.getenv('LL_CACHE_MAX_BYTES', 0))
+        if self.max_bytes and not self.store.evictable:
+            log.warning(f"LL_CACHE_MAX_BYTES is ignored, {type(self.store).__name__} cannot evict")
+            self.max_bytes = 0
+        self._downloads = 0
         self.hit = 0
         self.miss = 0
         
@@ -35,29 +136,12 @@ class WebPageCache:
         self.logger = logging.getLogger(__name__)
         
     def _url_to_path(self, url: str) -> Path:
-        """Generate a unique path for a URL using SHA-256 hashing."""
-        hashed = hash(url)
-        path = self.cache_path / hashed
-        path.mkdir(exist_ok=True)
-        return path
+        """Generate a unique path for a URL using MD5 hashing."""
+        return self.cache_path / hash(url)
         
-    def _get_content_type(self, url: str) -> Optional[str]:
-        """Determine content type using HEAD request."""
-        try:
-            head_response = requests.head(url, timeout=self.head_timeout, verify=False)
-            return head_response.headers.get('content-type', '').split(';')[0]
-        except requests.RequestException as e:
-            self.logger.error(f"HEAD request failed for {url}: {e}")
-            return None
-            
     def _get_file_extension(self, content_type: str) -> str:
         """Map content type to file extension."""
-        content_type_map = {
-            'text/html': 'html',
-            'application/pdf': 'pdf',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx'
-        }
-        return content_type_map.get(content_type, 'html')
+        return self.CONTENT_TYPES.get(content_type, 'html')
         
     def _read_if_exists(self, path: Path, read_as_image: bool = False) -> Optional[Any]:
         """Read file if it exists, with support for different file types."""
@@ -68,114 +152,481 @@ class WebPageCache:
             if read_as_image:
                 return Image.open(path)
             elif path.suffix == '.pdf':
-                with open(path, 'rb') as f:
-                    reader = pypdf.PdfReader(f)
-                    return ' '.join(page.extract_text() for page in reader.pages)
+                return pdf_text(path)
             elif path.suffix == '.docx':
-                doc = Document(path)
-                return ' '.join(paragraph.text for paragraph in doc.paragraphs)
+                return docx_text(path)
             else:
-                return path.read_text(encoding='utf-8')
+                return self._read_text(path)
         except Exception as e:
             self.logger.error(f"Error reading {path}: {e}")
             return None
             
-    def _download_file(self, url: str, content_type: str) -> Optional[str]:
-        """Download file from URL and save with appropriate extension."""
+    def _read_text(self, path: Path) -> str:
+        """Text of a body file, decompressing it while it is read."""
+        return read_body(path, self.dictionaries.directory)
+
+    @classmethod
+    def legacy_manifest(cls, url_path: Path) -> Optional[Dict[str, Any]]:
+        """Manifest for a page directory cached before manifests existed, from its content file."""
+        for content_type, ext in cls.CONTENT_TYPES.items():
+            content_path = url_path / f'content.{ext}'
+            if content_path.exists():
+                return {'content_type': content_type, 'content_file': content_path.name,
+                        'final_url': None, 'status': None, 'fetched_at': None,
+                        BODY_SIZE: content_path.stat().st_size}
+        return None
+
+    @classmethod
+    def legacy_page(cls, url_path: Path) -> Optional[Entry]:
+        """(extracted text, manifest) of a page directory written by the file-only cache."""
+        manifest_path = url_path / 'manifest.json'
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        else:
+            manifest = cls.legacy_manifest(url_path)
+            if manifest is None:
+                return None
+        text_path = url_path / 'extracted_text.txt'
+        text = text_path.read_text(encoding='utf-8') if text_path.exists() else None
+        return text, manifest
+
+    @timing.timed('cache_lookup')
+    def _lookup(self, url: str) -> Optional[Entry]:
+        """
+        (extracted text, manifest) known for a URL, without touching the
+        network. Text is None when it has not been extracted yet. Page
+        directories from before the store are imported on first access.
+        """
+        entry = self.memory.get(hash(url))
+        if entry is not None:
+            return entry
+        entry = self.store.get_entry(url)
+        if entry is not None:
+            self.memory.set(hash(url), entry)
+            return entry
+        url_path = self._url_to_path(url)
+        if not url_path.is_dir():
+            return None
         try:
-            response = requests.get(url, timeout=self.request_timeout, verify=False)
-            response.raise_for_status()
-            
-            ext = self._get_file_extension(content_type)
-            path = self._url_to_path(url) / f'content.{ext}'
-            
-            # Write binary content for PDFs and DOCXs
-            if ext in ['pdf', 'docx']:
-                path.write_bytes(response.content)
-            else:
-                path.write_text(response.text, encoding='utf-8')
-                
-            return str(path)
-        except requests.RequestException as e:
-            self.logger.error(f"Failed to download {url}: {e}")
+            entry = self.legacy_page(url_path)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.error(f"Unreadable cache entry {url_path}: {e}")
+            return None
+        if entry is not None:
+            self._save(url, *entry)
+        return entry
+
+    def _save(self, url: str, text: Optional[str], manifest: Dict[str, Any]):
+        self.store.set(url, text, manifest)
+        self.memory.set(hash(url), (text, manifest))
+
+    @timing.timed('download')
+    def _download_file(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Download file from URL, save it with the extension matching the
+        content type of the response and record it in the URL's manifest.
+        """
+        # Within the request's deadline, if there is one
+        request_timeout = deadline.timeout(self.request_timeout)
+        if request_timeout <= 0:
             return None
-            
-    def _extract_text(self, path: Path, content_type: str) -> Optional[str]:
-        """Extract text content based on file type."""
         try:
-            if content_type == 'text/html':
-                html_content = path.read_text(encoding='utf-8')
-                return trafilatura.extract(html_content) or ""
-            else:
-                return self._read_if_exists(path)
-        except Exception as e:
-            self.logger.error(f"Error extracting text from {path}: {e}")
+            # The body is streamed to disk in chunks instead of being held in memory
+            with self.http.stream(url, timeout=request_timeout) as response:
+                response.raise_for_status()
+                content_type, ext, path, body = self._body(url, response, response.encoding)
+                chunks = iter(body)
+                if ext in self.COMPRESSED_TYPES:
+                    chunks = self.dictionaries.codec(ext).compress_chunks(chunks)
+                size = atomic_write(path, chunks)
+            return self._downloaded(url, content_type, path, str(response.url), response.status_code, size,
+                                    body.truncated)
+        except (CircuitOpenError, BodyTooLarge) as e:
+            return self._not_downloaded(url, e)
+        except requests.RequestException as e:
+            return self._not_downloaded(url, e, timed_out=isinstance(e, requests.Timeout),
+                                        request_timeout=request_timeout)
+
+    @timing.timed('download')
+    async def _download_file_async(self, url: str) -> Optional[Dict[str, Any]]:
+        """_download_file over the AsyncHTTPClient."""
+        request_timeout = deadline.timeout(self.request_timeout)
+        if request_timeout <= 0:
             return None
-            
-    def fetch(self, url: str) -> Dict[str, Optional[str]]:
+        await asyncio.to_thread(self._url_to_path(url).mkdir, exist_ok=True)
+        try:
+            async with self.async_http.stream(url, request_timeout) as response:
+                response.raise_for_status()
+                content_type, ext, path, body = self._body(url, response, response.charset_encoding)
+                codec = self.dictionaries.codec(ext) if ext in self.COMPRESSED_TYPES else None
+                compressor = codec.compressor() if codec else None
+                # Chunks are small, writing them to the local disk does not hold up the loop
+                with AtomicFile(path) as f:
+                    if compressor is not None:
+                        f.write(codec.header)
+                    async for chunk in body:
+                        f.write(compressor.compress(chunk) if compressor is not None else chunk)
+                    if compressor is not None:
+                        f.write(compressor.flush())
+            return await asyncio.to_thread(self._downloaded, url, content_type, path, str(response.url),
+                                           response.status_code, f.size, body.truncated)
+        except (CircuitOpenError, BodyTooLarge) as e:
+            return await asyncio.to_thread(self._not_downloaded, url, e)
+        except httpx.HTTPError as e:
+            return await asyncio.to_thread(self._not_downloaded, url, e,
+                                           timed_out=isinstance(e, httpx.TimeoutException),
+                                           request_timeout=request_timeout)
+
+    def _body(self, url: str, response, encoding: Optional[str]) -> Tuple[str, str, Path, BodyChunks]:
         """
-        Fetch content from URL or cache, handling different file types.
-        
-        Returns:
-            Dictionary containing original content and extracted text
+        (content type, extension, body file, body chunks) of a response of
+        requests or httpx whose body is still to be read, raising
+        BodyTooLarge when its length is known to be over the limit.
         """
-        content_type = self._get_content_type(url)
-        if not content_type:
-            return {'content': None, 'text': None}
-            
-        url_path = self._url_to_path(url)
+        content_type = response.headers.get('content-type', '').split(';')[0].strip() or 'text/html'
         ext = self._get_file_extension(content_type)
-        content_path = url_path / f'content.{ext}'
-        text_path = url_path / 'extracted_text.txt'
+        path = self._url_to_path(url) / f'content.{ext}'
+        if ext in self.COMPRESSED_TYPES:
+            path = path.with_name(f'{path.name}.z')
+        limit = self._max_body_bytes(ext)
+        length = response.headers.get('content-length', '')
+        if ext not in self.TRUNCATABLE_TYPES and length.isdigit() and int(length) > limit:
+            raise BodyTooLarge(f"{length} bytes of {content_type}, more than {limit}")
+        body = BodyChunks(response, limit, truncate=ext in self.TRUNCATABLE_TYPES,
+                          encoding=None if ext in ['pdf', 'docx'] else encoding or 'utf-8')
+        return content_type, ext, path, body
+
+    def _downloaded(self, url: str, content_type: str, path: Path, final_url: str, status: int, size: int,
+                    truncated: bool) -> Dict[str, Any]:
+        """Record a downloaded body in the URL's manifest."""
+        manifest = {
+            'content_type': content_type,
+            'content_file': path.name,
+            'final_url': final_url,
+            'status': status,
+            'fetched_at': time.time(),
+            BODY_SIZE: size,
+        }
+        if truncated:
+            manifest['truncated'] = True
+        self._save(url, None, manifest)
+        self._downloads += 1
+        if self.max_bytes and self._downloads % self.EVICT_EVERY == 0:
+            evict(self.max_bytes, self.store)
+        return manifest
+
+    def _not_downloaded(self, url: str, e: Exception, timed_out: bool = False,
+                        request_timeout: Optional[float] = None) -> None:
+        if isinstance(e, CircuitOpenError):
+            # The breaker decides when the host is tried again
+            self.logger.info(f"Not downloading {url}: {e}")
+            return None
+        if isinstance(e, BodyTooLarge):
+            self.logger.warning(f"Not downloading {url}: {e}")
+        else:
+            self.logger.error(f"Failed to download {url}: {e}")
+            if timed_out and request_timeout < self.request_timeout:
+                # Only too slow for this request's deadline, not known to be failing
+                return None
+        self.failures.set(url, {'error': type(e).__name__, 'until': time.time() + self.negative_ttl})
+        return None
+
+    def _max_body_bytes(self, ext: str) -> int:
+        return int(os.getenv(f'LL_MAX_BODY_{ext.upper()}', self.MAX_BODY_BYTES.get(ext, self.MAX_BODY_BYTES['html'])))
+
+    def _failed_recently(self, url: str) -> bool:
+        failure = self.failures.get(url)
+        return failure is not None and failure['until'] > time.time()
+            
+    def _extract_text(self, path: Path, content_type: str,
+                      on_late: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Extract text content based on file type."""
+        return self.extractor.extract(path, content_type, self.dictionaries.directory, on_late)
+            
+    def _ensure_cached(self, url: str) -> Optional[Entry]:
+        """(extracted text, manifest) of the URL, downloading it first on a miss."""
+        entry = self._lookup(url)
         
-        # Check if content exists in cache
-        if not content_path.exists():
+        # Cache hits are served from the store without any network I/O
+        if entry is None:
             self.miss += 1
-            content_file = self._download_file(url, content_type)
-            if not content_file:
-                return {'content': None, 'text': None}
+            if self._failed_recently(url):
+                self.negative_hits += 1
+                return None
+            manifest = self.flights.do(f'page:{hash(url)}', self._download_once, url)
+            entry = (None, manifest) if manifest else None
         else:
             self.hit += 1
             
         # Log cache hit rate every 10 requests
         if (self.hit + self.miss) % 10 == 0:
             self.logger.info(f"Cache hit rate: {self.hit / (self.hit + self.miss):.2%}")
-            
-        # Extract and cache text if needed
-        if not text_path.exists():
-            text_content = self._extract_text(content_path, content_type)
-            if text_content:
-                text_path.write_text(text_content, encoding='utf-8')
-                
+        return entry
+
+    def _download_once(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Download under a per-URL file lock, so that of several workers
+        missing the same URL only one downloads it and the others read
+        the result from the cache.
+        """
+        url_path = self._url_to_path(url)
+        url_path.mkdir(exist_ok=True)
+        with file_lock(url_path / '.lock'):
+            entry = self._lookup(url)
+            if entry is not None:
+                return entry[1]
+            if self._failed_recently(url):
+                return None
+            return self._download_file(url)
+
+    def _ensure_text(self, url: str, manifest: Dict[str, Any]) -> Optional[str]:
+        """Extracted text of a cached URL, extracting and caching it once."""
+        return self.flights.do(f'text:{hash(url)}', self._extract_once, url, manifest)
+
+    def _extract_once(self, url: str, manifest: Dict[str, Any]) -> Optional[str]:
+        url_path = self._url_to_path(url)
+        with file_lock(url_path / '.lock'):
+            entry = self.store.get_entry(url)
+            if entry is not None and entry[0] is not None:
+                return entry[0]
+            # Extractions finishing after the deadline are still cached for the next request
+            text_content = self._extract_text(url_path / manifest['content_file'], manifest['content_type'],
+                                              on_late=lambda text: self._save(url, text, manifest))
+            if text_content is not None:
+                # Cache empty extractions too, so they are not re-parsed on every request
+                self._save(url, text_content, manifest)
+            return text_content
+
+    def fetch(self, url: str, load_content: bool = False) -> Dict[str, Optional[str]]:
+        """
+        Fetch content from URL or cache, handling different file types.
+        
+        Parsing the original document again is only needed for 'content',
+        so it is left out unless load_content is set.
+        
+        Returns:
+            Dictionary containing original content and extracted text
+        """
+        entry = self._ensure_cached(url)
+        if not entry:
+            return {'content': None, 'text': None}
+        text, manifest = entry
+        if text is None:
+            text = self._ensure_text(url, manifest)
+        content_path = self._url_to_path(url) / manifest['content_file']
         return {
-            'content': self._read_if_exists(content_path),
-            'text': self._read_if_exists(text_path)
+            'content': self._read_if_exists(content_path) if load_content else None,
+            'text': text
         }
 
+    def _cached_text(self, url: str) -> Tuple[Optional[str], Optional[Entry]]:
+        """(text, entry) from memory, the store or the page pack; text is None when it still has to be fetched."""
+        entry = self._lookup(url)
+        if entry is not None and entry[0] is not None:
+            self.hit += 1
+            return entry[0], entry
+        if self.pack is not None:
+            text = self.pack.get(url)
+            if text is not None:
+                self.pack_hits += 1
+                return text, entry
+        return None, entry
+
     def fetch_text(self, url: str) -> Optional[str]:
+        """
+        Extracted text only, from memory or one store lookup when it is
+        cached, then from the page pack, and only then from the network.
+        """
+        text, _ = self._cached_text(url)
+        if text is not None:
+            return text
         return self.fetch(url)['text']
 
+    async def fetch_text_async(self, url: str) -> Optional[str]:
+        """
+        fetch_text for the ASGI app: lookups run in threads, the download
+        streams over the AsyncHTTPClient and extraction is awaited from the
+        process pool. Concurrent misses in this process share one download;
+        unlike fetch_text it takes no file lock, as that would block the
+        loop, and the atomic writes keep a download of the same URL by
+        another worker harmless.
+        """
+        text, entry = await asyncio.to_thread(self._cached_text, url)
+        if text is not None:
+            return text
+        if entry is None:
+            self.miss += 1
+            if await asyncio.to_thread(self._failed_recently, url):
+                self.negative_hits += 1
+                return None
+            manifest = await self.async_flights.do(f'page:{hash(url)}', self._download_once_async, url)
+            if manifest is None:
+                return None
+        else:
+            self.hit += 1
+            manifest = entry[1]
+        return await self.async_flights.do(f'text:{hash(url)}', self._extract_async, url, manifest)
+
+    async def _download_once_async(self, url: str) -> Optional[Dict[str, Any]]:
+        # A download that finished since our lookup is not repeated
+        entry = await asyncio.to_thread(self._lookup, url)
+        if entry is not None:
+            return entry[1]
+        return await self._download_file_async(url)
+
+    async def _extract_async(self, url: str, manifest: Dict[str, Any]) -> Optional[str]:
+        entry = await asyncio.to_thread(self.store.get_entry, url)
+        if entry is not None and entry[0] is not None:
+            return entry[0]
+        text_content = await self.extractor.extract_async(
+            self._url_to_path(url) / manifest['content_file'], manifest['content_type'],
+            self.dictionaries.directory, on_late=lambda text: self._save(url, text, manifest))
+        if text_content is not None:
+            await asyncio.to_thread(self._save, url, text_content, manifest)
+        return text_content
+
+    def stats(self) -> Dict[str, Any]:
+        # Memory hits count towards the overall hits as well
+        return {'memory': self.memory.stats(), 'overall': {'hits': self.hit, 'misses': self.miss},
+                'pack': {'pages': len(self.pack) if self.pack is not None else 0, 'hits': self.pack_hits},
+                'negative': {'hits': self.negative_hits}, 'http': self.http.stats(),
+                'async_http': self.async_http.stats(),
+                'extract': self.extractor.stats()}
+
+
+def evict(max_bytes: int, store: Optional[CacheStore] = None) -> int:
+    """
+    Evict least recently used entries of all namespaces until the cache
+    fits the byte budget, removing the bodies of evicted pages with them.
+    """
+    store = store or open_store('pages')
+    evicted = store.evict(max_bytes)
+    for namespace, hkey in evicted:
+        if namespace == 'pages':
+            shutil.rmtree(cache_root() / 'web_page_cache' / hkey, ignore_errors=True)
+    if evicted:
+        log.info(f"Evicted {len(evicted)} cache entries")
+    return len(evicted)
+
+
+def compact(store: Optional[CacheStore] = None) -> int:
+    """
+    Drop the raw bodies of pages whose text has been extracted; fetch()
+    then returns no 'content' for them, the text is served as before.
+    """
+    store = store or open_store('pages')
+    compacted = []
+    for hkey, text, manifest in store.scan():
+        if text is None or not manifest or not manifest.get(BODY_SIZE):
+            continue
+        compacted.append((hkey, text, {**manifest, BODY_SIZE: 0}))
+    for i in range(0, len(compacted), 500):
+        store.set_entries(compacted[i:i + 500])
+    for hkey, _, _ in compacted:
+        shutil.rmtree(cache_root() / 'web_page_cache' / hkey, ignore_errors=True)
+    if hasattr(store, 'vacuum'):
+        store.vacuum()
+    return len(compacted)
+
+
 class URLLevelCache:
-    def __init__(self):
-        self.cache_dir = Path(os.getenv("HOME")) / '.cache' / 'LessonLens' / 'url_cache'
-        self.cache_dir.mkdir(exist_ok=True, parents=True)
-    
-    def _cache_path(self, key):
-        return f'{self.cache_dir / hash(key)}.json' 
-
-    def _get(self, key):
-        with open(self._cache_path(key), 'r') as f:
-            out = json.load(f)
-        return out
-
-    def _set(self, key, response):
-        with open(self._cache_path(key), 'w') as f:
-            json.dump(response, f)
+    """
+    Responses keyed by URL (or any key), stored in `namespace` of the cache
+    store. With `memory` set, the named in-memory tier is checked first.
+    """
+
+    def __init__(self, namespace: str = 'url_cache', store: Optional[CacheStore] = None,
+                 memory: Optional[str] = None):
+        self.store = store or open_store(namespace)
+        self.memory = memory_cache(memory) if memory else None
+        self.lock_dir = cache_root() / 'locks' / namespace
+        self.lock_dir.mkdir(exist_ok=True, parents=True)
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.hit = 0
+        self.miss = 0
+
+    @timing.timed('cache_lookup')
+    def _get_entry(self, key):
+        return self.store.get_entry(key)
+
+    def _remember(self, key, response):
+        # Entries are wrapped so that a cached None is told apart from a miss
+        if self.memory is not None:
+            self.memory.set(hash(key), (response,))
+
+    def _fetch_once(self, key, input, fetch_fn):
+        # Another worker may have stored the response while we waited for the lock
+        with file_lock(self.lock_dir / f'{hash(key)}.lock'):
+            entry = self.store.get_entry(key)
+            if entry is not None:
+                self._remember(key, entry[0])
+                return entry[0]
+            response = fetch_fn(input)
+            self.store.set(key, response)
+            self._remember(key, response)
+            return response
 
     def get_or_fetch(self, key, input, fetch_fn):
-        if os.path.exists(self._cache_path(key)):
-            return self._get(key)
+        if self.memory is not None:
+            remembered = self.memory.get(hash(key))
+            if remembered is not None:
+                return remembered[0]
+        entry = self._get_entry(key)
+        if entry is not None:
+            self.hit += 1
+            self._remember(key, entry[0])
+            return entry[0]
         else:
-            response = fetch_fn(input)
-            self._set(key, response)
-            return response
\ No newline at end of file
+            self.miss += 1
+            return self.flights.do(hash(key), self._fetch_once, key, input, fetch_fn)
+
+    async def get_or_fetch_async(self, key, input, fetch_fn):
+        """
+        get_or_fetch for a coroutine fetch_fn, with the store read and
+        written in threads. Concurrent misses in this process share one
+        fetch, without the lock file shared with other workers.
+        """
+        if self.memory is not None:
+            remembered = self.memory.get(hash(key))
+            if remembered is not None:
+                return remembered[0]
+        entry = await asyncio.to_thread(self._get_entry, key)
+        if entry is not None:
+            self.hit += 1
+            self._remember(key, entry[0])
+            return entry[0]
+        self.miss += 1
+        return await self.async_flights.do(hash(key), self._fetch_async, key, input, fetch_fn)
+
+    async def _fetch_async(self, key, input, fetch_fn):
+        # A fetch that finished since our lookup is not repeated
+        entry = await asyncio.to_thread(self.store.get_entry, key)
+        if entry is not None:
+            self._remember(key, entry[0])
+            return entry[0]
+        response = await fetch_fn(input)
+        await asyncio.to_thread(self.put, key, response)
+        return response
+
+    def peek(self, key) -> Optional[tuple]:
+        """(response,) when the key is cached, None otherwise, without fetching."""
+        if self.memory is not None:
+            remembered = self.memory.get(hash(key))
+            if remembered is not None:
+                return remembered
+        entry = self._get_entry(key)
+        if entry is None:
+            return None
+        self._remember(key, entry[0])
+        return (entry[0],)
+
+    def put(self, key, response):
+        """Cache a response obtained some other way than through get_or_fetch."""
+        self.store.set(key, response)
+        self._remember(key, response)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'memory': self.memory.stats() if self.memory else None,
+                'store': {'hits': self.hit, 'misses': self.miss}}
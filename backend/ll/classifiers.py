@@ -1,26 +1,31 @@
+from contextlib import contextmanager
 from inspect import signature
+import asyncio
 import json
 import re
+from ll.batching import Batcher
 from ll.cache import URLLevelCache
+from ll import deadline, llm, timing
+from ll.registry import ModelRegistry
+from ll.linear import LinearSVM, load_compact_models
 from pathlib import Path
-import spacy
 import json
-from openai import OpenAI
 import os
 import numpy as np
-import pandas as pd
 import pickle
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.pipeline import Pipeline
-from sklearn.svm import SVC
 import logging
 
 log = logging.getLogger("classifiers")
 
 # SVM Classifiers for various metadata fields
 
+TEXT_TARGETS = ['commercial', 'type', 'audience', 'educational_level']
+
 # Training
-def train():
+# sklearn and pandas are only imported here, serving can run from the
+# exported compact models without them.
+def train(shared_text=True):
+    import pandas as pd
     df = pd.read_pickle('../../tins/data/jupyter-caches/04-training-data.pkl')
     
     # Remove low frequency labels
@@ -32,10 +37,16 @@ def train():
     train_source_classifier(df)
     
     # Train other classifiers with text features
-    for col in ['commercial', 'type', 'audience', 'educational_level']:
-        train_other_classifier(df, col)
+    if shared_text:
+        train_text_classifier(df)
+    else:
+        for col in TEXT_TARGETS:
+            train_other_classifier(df, col)
 
 def train_source_classifier(df):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import SVC
     domains = df['url'].str.extract(r'https?://([^/]+)')[0]
     pipeline = Pipeline([
         ('tfidf', TfidfVectorizer(analyzer='char', ngram_range=(3,5), max_features=5000)),
@@ -46,6 +57,9 @@ def train_source_classifier(df):
         pickle.dump(pipeline, f)
 
 def train_other_classifier(df, target_column):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import SVC
     df['text'] = df['title'] + ' ' + df['description']
     pipeline = Pipeline([
         ('tfidf', TfidfVectorizer(max_features=5000)),
@@ -55,6 +69,160 @@ def train_other_classifier(df, target_column):
     with open(f'models/{target_column}_classifier.pkl', 'wb') as f:
         pickle.dump(pipeline, f)
 
+def train_text_classifier(df, target_columns=TEXT_TARGETS):
+    """Train one vectorizer over title+description with a linear SVC head per field."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.svm import SVC
+    text = df['title'] + ' ' + df['description']
+    vectorizer = TfidfVectorizer(max_features=5000)
+    features = vectorizer.fit_transform(text)
+    heads = {col: SVC(kernel='linear').fit(features, df[col]) for col in target_columns}
+    save_text_classifier(vectorizer, heads)
+
+def save_text_classifier(vectorizer, heads, path='models/text_classifier.pkl'):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'vectorizer': vectorizer, 'heads': heads}, f)
+    os.replace(tmp_path, path)
+
+def parity_sample(path='data/metadata.pkl', size=500):
+    """
+    SERP-like rows to compare rebuilt models with the pickled pipelines on:
+    the annotated pages with their learning goals as description.
+    """
+    import pandas as pd
+    rows = []
+    for row in pd.read_pickle(path).head(size).itertuples():
+        goals = row.learning_goals
+        description = ' '.join(goals) if isinstance(goals, list) else str(goals)
+        rows.append({'url': row.url, 'title': '', 'description': description})
+    if not rows:
+        raise ValueError(f"No rows to check parity on in {path}")
+    return rows
+
+def combine_text_classifiers(target_columns=TEXT_TARGETS, texts=None):
+    """
+    Build the shared text classifier from the existing per-field pipelines.
+    Only possible when they were all fitted with the same vectorizer. Its
+    labels are checked against theirs on `texts`, by default on parity_sample.
+    """
+    if texts is None:
+        texts = [f"{r['title']} {r['description']}" for r in parity_sample()]
+    pipelines = {}
+    for col in target_columns:
+        with open(f'models/{col}_classifier.pkl', 'rb') as f:
+            pipelines[col] = pickle.load(f)
+    vectorizer = pipelines[target_columns[0]][0]
+    for col, pipeline in pipelines.items():
+        other = pipeline[0]
+        if (other.get_params() != vectorizer.get_params()
+                or other.vocabulary_ != vectorizer.vocabulary_
+                or not np.array_equal(other.idf_, vectorizer.idf_)):
+            raise ValueError(f"The {col} classifier uses a different vectorizer, retrain with train_text_classifier")
+    shared = MultiHeadTextClassifier(vectorizer, {col: p[-1] for col, p in pipelines.items()})
+    mismatches = check_text_classifier_parity(shared, list(texts))
+    if mismatches:
+        raise ValueError(f"Shared text classifier disagrees with per-field pipelines: {mismatches[:5]}")
+    save_text_classifier(vectorizer, {col: p[-1] for col, p in pipelines.items()})
+
+# Export
+def _same_vectorizer(a, b):
+    return (a.get_params() == b.get_params() and a.vocabulary_ == b.vocabulary_
+            and np.array_equal(getattr(a, 'idf_', None), getattr(b, 'idf_', None)))
+
+def _vectorizer_config(vectorizer):
+    params = vectorizer.get_params()
+    if (params['analyzer'] not in ('word', 'char') or params['input'] != 'content'
+            or any(params[p] is not None for p in ['preprocessor', 'tokenizer', 'stop_words', 'strip_accents'])):
+        raise ValueError(f"Cannot export vectorizer with parameters {params}")
+    return {p: params[p] for p in
+            ['analyzer', 'ngram_range', 'lowercase', 'token_pattern', 'norm', 'use_idf', 'sublinear_tf', 'binary']}
+
+def _save_array(root, filename, array):
+    tmp_path = root / f'{filename}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    # Replace rather than overwrite, workers may have the old file mapped
+    os.replace(tmp_path, root / filename)
+
+def _export_vectorizer(root, name, vectorizer):
+    terms = sorted(vectorizer.vocabulary_, key=lambda t: t.encode('utf-8'))
+    order = np.array([vectorizer.vocabulary_[t] for t in terms])
+    idf = vectorizer.idf_[order] if vectorizer.use_idf else np.ones(len(order))
+    _save_array(root, f'{name}.vocab.npy', np.array([t.encode('utf-8') for t in terms]))
+    _save_array(root, f'{name}.idf.npy', idf)
+    return order
+
+def _export_head(root, name, svc, order):
+    head = LinearSVM.from_svc(svc)
+    _save_array(root, f'{name}.coef.npy', np.ascontiguousarray(head.coef[:, order]))
+    _save_array(root, f'{name}.intercept.npy', head.intercept)
+    _save_array(root, f'{name}.classes.npy', head.classes.astype(str))
+
+def export_compact_models(root='models/compact', results=None):
+    """
+    Export every SVM classifier as flat .npy arrays (sorted vocabulary, idf,
+    coefficients, intercepts, classes) that ll.linear loads with mmap and
+    scores without sklearn. The export is checked against the pipelines on
+    `results`, by default on parity_sample. manifest.json is replaced last,
+    so running workers pick up a complete export on their next reload check.
+    """
+    if results is None:
+        results = parity_sample()
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    kinds = {name: kind for name, kind, _ in SVM_CLASSIFIERS.values()}
+
+    fields = {}
+    for name in kinds:
+        with open(models.path(name), 'rb') as f:
+            pipeline = pickle.load(f)
+        fields[name] = (pipeline[0], pipeline[-1])
+    if models.available('text'):
+        with open(models.path('text'), 'rb') as f:
+            bundle = pickle.load(f)
+        for name, svc in bundle['heads'].items():
+            fields[name] = (bundle['vectorizer'], svc)
+
+    manifest = {'vectorizers': {}, 'heads': {}}
+    exported = []
+    for name, (vectorizer, svc) in fields.items():
+        match = next((e for e in exported if _same_vectorizer(e[1], vectorizer)), None)
+        if match is None:
+            vectorizer_name = kinds[name] if kinds[name] not in manifest['vectorizers'] else f'{kinds[name]}_{name}'
+            manifest['vectorizers'][vectorizer_name] = _vectorizer_config(vectorizer)
+            match = (vectorizer_name, vectorizer, _export_vectorizer(root, vectorizer_name, vectorizer))
+            exported.append(match)
+        _export_head(root, name, svc, match[2])
+        manifest['heads'][name] = {'vectorizer': match[0]}
+
+    mismatches = check_compact_parity(load_compact_models(root / 'manifest.json', manifest), fields, list(results))
+    if mismatches:
+        raise ValueError(f"Exported models disagree with the pickled pipelines: {mismatches[:5]}")
+    tmp_path = root / 'manifest.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, root / 'manifest.json')
+
+def check_compact_parity(compact, fields, results, threshold=0.0):
+    """Labels where the exported models disagree with the sklearn ones."""
+    if not results:
+        raise ValueError("No results to check parity on")
+    kinds = {name: kind for name, kind, _ in SVM_CLASSIFIERS.values()}
+    inputs = {
+        'text': [f"{r.get('title', '')} {r.get('description', '')}" for r in results],
+        'domain': [url_domain(r.get('url', '')) for r in results],
+    }
+    mismatches = []
+    for name, (vectorizer, svc) in fields.items():
+        batch = inputs[kinds[name]]
+        expected = LinearSVM.from_svc(svc).predict(vectorizer.transform(batch), threshold)
+        actual = compact.predict(batch, {name: threshold})[name]
+        for i, (a, b) in enumerate(zip(actual, expected)):
+            if a['label'] != b['label'] or abs(a['confidence'] - b['confidence']) > 1e-6:
+                mismatches.append((name, batch[i], a, b))
+    return mismatches
+
 # Prediction
 def predict_with_threshold(model, input_data, threshold=0.5):
     confidence_scores = model.decision_function(input_data)[0]
@@ -69,54 +237,159 @@ def predict_with_threshold(model, input_data, threshold=0.5):
     else:
         return {'label': prediction, 'confidence': max_confidence}
 
-def commercial_classifier(url, title, description, content=None):
-    with open('models/commercial_classifier.pkl', 'rb') as f:
-        model = pickle.load(f)
-    text = f"{title} {description}"
-    return predict_with_threshold(model, [text], threshold=0.7)
+class SVMPipeline:
+    """
+    A fitted TfidfVectorizer + linear SVC pipeline, with the SVC weights
+    precomputed so a whole batch is scored with one matrix product.
+    """
 
-def source_classifier(url, title, description, content=None):
-    with open('models/source_classifier.pkl', 'rb') as f:
-        model = pickle.load(f)
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.vectorizer = pipeline[:-1]
+        self.head = LinearSVM.from_svc(pipeline[-1])
+
+    def predict(self, input_data, threshold=0.5):
+        return self.head.predict(self.vectorizer.transform(input_data), threshold)
+
+def load_svm_pipeline(path):
+    with open(path, 'rb') as f:
+        return SVMPipeline(pickle.load(f))
+
+class MultiHeadTextClassifier:
+    """
+    One TfidfVectorizer feeding a linear SVC head per field, so a batch of
+    title+description texts is tokenized and vectorized only once.
+    """
+
+    def __init__(self, vectorizer, heads):
+        self.vectorizer = vectorizer
+        self.heads = {name: LinearSVM.from_svc(svc) for name, svc in heads.items()}
+
+    def predict(self, texts, thresholds):
+        features = self.vectorizer.transform(texts)
+        return {name: self.heads[name].predict(features, threshold)
+                for name, threshold in thresholds.items()}
+
+def load_query_term_model(path):
+    # spaCy takes most of the import time of the app, it is loaded with the model
+    import spacy
+    return spacy.load(path)
+
+def load_text_classifier(path):
+    with open(path, 'rb') as f:
+        bundle = pickle.load(f)
+    return MultiHeadTextClassifier(bundle['vectorizer'], bundle['heads'])
+
+def check_text_classifier_parity(shared, texts, threshold=0.0):
+    """Labels where the shared classifier disagrees with the per-field pipelines."""
+    if not texts:
+        raise ValueError("No texts to check parity on")
+    mismatches = []
+    predictions = shared.predict(texts, {name: threshold for name in shared.heads})
+    for name, shared_predictions in predictions.items():
+        field_predictions = models.get(name).predict(texts, threshold)
+        for i, (a, b) in enumerate(zip(shared_predictions, field_predictions)):
+            if a['label'] != b['label']:
+                mismatches.append((name, texts[i], a['label'], b['label']))
+    return mismatches
+
+models = ModelRegistry('models')
+models.register('commercial', 'commercial_classifier.pkl', load_svm_pipeline)
+models.register('source', 'source_classifier.pkl', load_svm_pipeline)
+models.register('type', 'type_classifier.pkl', load_svm_pipeline)
+models.register('audience', 'audience_classifier.pkl', load_svm_pipeline)
+models.register('educational_level', 'educational_level_classifier.pkl', load_svm_pipeline)
+models.register('text', 'text_classifier.pkl', load_text_classifier)
+models.register('compact', 'compact/manifest.json', load_compact_models)
+models.register('query_terms', 'query_term_classification', load_query_term_model)
+
+@timing.timed('svm')
+def predict_fields(thresholds, inputs):
+    """
+    Predict several fields over the same inputs, preferring the exported
+    compact models, then the shared text classifier (both vectorize the
+    inputs once), then the per-field pipelines.
+    """
+    for name in ('compact', 'text'):
+        if models.available(name):
+            shared = models.get(name)
+            if all(head in shared.heads for head in thresholds):
+                return shared.predict(inputs, thresholds)
+    return {name: models.get(name).predict(inputs, threshold)
+            for name, threshold in thresholds.items()}
+
+def warm_models():
+    """Load the models serving will use, without touching the pickles if exported ones exist."""
+    names = ['compact', 'query_terms'] if models.available('compact') else \
+        [n for n in models.names() if n != 'compact']
+    for name in names:
+        models.get(name)
+    return models.stats()
+
+def url_domain(url):
     try:
-        domain = url.split('//')[1].split('/')[0]
+        return url.split('//')[1].split('/')[0]
     except:
         log.error(f"Malformed URL: {url}")
-        domain = "None"
-    return predict_with_threshold(model, [domain], threshold=0.6)
+        return "None"
+
+# (model, input, threshold) per summary attribute
+SVM_CLASSIFIERS = {
+    'is_commercial': ('commercial', 'text', 0.7),
+    'is_educational': ('type', 'text', 0.7),
+    'educational_level': ('educational_level', 'text', 0.5),
+    'audience': ('audience', 'text', 0.6),
+    'source_institution_type': ('source', 'domain', 0.6),
+}
+
+def classify_batch(results):
+    """Run every SVM classifier once over all results of a SERP."""
+    if not results:
+        return []
+    texts = [f"{r.get('title', '')} {r.get('description', '')}" for r in results]
+    domains = [url_domain(r.get('url', '')) for r in results]
+    inputs = {'text': texts, 'domain': domains}
+    by_model = {}
+    for kind in inputs:
+        by_model.update(predict_fields(
+            {name: threshold for name, k, threshold in SVM_CLASSIFIERS.values() if k == kind}, inputs[kind]))
+    predictions = {attribute: by_model[name] for attribute, (name, _, _) in SVM_CLASSIFIERS.items()}
+    return [
+        {attribute: predictions[attribute][i] for attribute in SVM_CLASSIFIERS}
+        for i in range(len(results))
+    ]
+
+def commercial_classifier(url, title, description, content=None):
+    text = f"{title} {description}"
+    return predict_fields({'commercial': 0.7}, [text])['commercial'][0]
+
+def source_classifier(url, title, description, content=None):
+    domain = url_domain(url)
+    return predict_fields({'source': 0.6}, [domain])['source'][0]
 
 def page_classifier(url, title, description, content=None):
-    with open('models/type_classifier.pkl', 'rb') as f:
-        model = pickle.load(f)
     text = f"{title} {description}"
-    return predict_with_threshold(model, [text], threshold=0.7)
+    return predict_fields({'type': 0.7}, [text])['type'][0]
 
 def audience_classifier(url, title, description, content=None):
-    with open('models/audience_classifier.pkl', 'rb') as f:
-        model = pickle.load(f)
     text = f"{title} {description}"
-    return predict_with_threshold(model, [text], threshold=0.6)
+    return predict_fields({'audience': 0.6}, [text])['audience'][0]
 
 def ed_level_classifier(url, title, description, content=None):
-    with open('models/educational_level_classifier.pkl', 'rb') as f:
-        model = pickle.load(f)
     text = f"{title} {description}"
-    return predict_with_threshold(model, [text], threshold=0.5)
+    return predict_fields({'educational_level': 0.5}, [text])['educational_level'][0]
 
 # GPT Based Classifiers
 
-url_cache = URLLevelCache()
-client_openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+url_cache = URLLevelCache(memory='metadata')
+snippet_cache = URLLevelCache(memory='snippets')
 def get_gpt4_labels(prompt, fast=False):
-    response = client_openai.chat.completions.create(
-        model="gpt-3.5-turbo-0125" if fast else "gpt-4o-2024-08-06",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    response_text = response.choices[0].message.content
-    return response_text
+    return llm.complete(prompt, fast=fast)
+
+async def get_gpt4_labels_async(prompt, fast=False):
+    return await llm.complete_async(prompt, fast=fast)
 
+@timing.timed('json_parse')
 def parse_json(response_text):
     # Try to find JSON content between triple backticks
     code_pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
@@ -164,10 +437,48 @@ def parse_json(response_text):
         
     return {}
 
+def _ask(prompt, parse=parse_json):
+    """parse of the LLM's response to `prompt`, None when the call fails."""
+    try:
+        return parse(get_gpt4_labels(prompt))
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.warning(f"LLM call failed: {e}")
+        return None
+
+async def _ask_async(prompt, parse=parse_json):
+    try:
+        return parse(await get_gpt4_labels_async(prompt))
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        log.warning(f"LLM call failed: {e}")
+        return None
+
+# Annotating one SERP result
+def page_content(result, text, limit=5000):
+    """The page's text up to `limit` characters, the result's title and description when there is none."""
+    if text:
+        return text[:limit]
+    return f"Title: {result['title']}\nDescription: {result['description']}"
+
+@contextmanager
+def result_errors(url, logger=log):
+    """Ends the with block on any error annotating the result at `url`, logging it unless it ran out of time."""
+    try:
+        yield
+    except deadline.DeadlineExceeded:
+        pass
+    except Exception as e:
+        logger.error(f"Error processing {url}: {str(e)}")
+
 # Metadata Snippet
+METADATA_FIELDS = ['assesses', 'teaches', 'educational_level',
+                   'educational_role', 'educational_use', 'learning_resource_type']
 
-def fetch_content_based_gpt_metadata_inference(content):
-    prompt = """
+def metadata_prompt(content):
+    return """
     Extract educational metadata from the following content based on LRMI definitions. 
     Use these fields:
     1. assesses (string): What skills or knowledge does this resource evaluate?
@@ -184,22 +495,59 @@ def fetch_content_based_gpt_metadata_inference(content):
     Respond in the same language as the content.
     """
 
-    try:
-        response = get_gpt4_labels(prompt)
-        return parse_json(response)
-    except Exception as e:
-        print(e)
-        return None
+def fetch_content_based_gpt_metadata_inference(content):
+    return _ask(metadata_prompt(content))
+
+async def fetch_content_based_gpt_metadata_inference_async(content):
+    return await _ask_async(metadata_prompt(content))
+
+# Several documents in one prompt, answered in a JSON object keyed by document number
+def documents_prompt(documents):
+  return "\n\n".join(f"Document {i}:\n{document}" for i, document in enumerate(documents))
+
+def batch_responses(response_text, documents, valid):
+  response = parse_json(response_text)
+  if not isinstance(response, dict):
+    return {}
+  return {i: response[str(i)] for i in range(len(documents)) if valid(response.get(str(i)))}
+
+def fetch_batched_gpt_metadata_inference(documents):
+    prompt = """
+    Extract educational metadata from each of the following documents based on LRMI definitions.
+    Use these fields:
+    1. assesses (string): What skills or knowledge does this resource evaluate?
+    2. teaches (string): What skills or knowledge does this resource impart?
+    3. educational_level (list): Relevant levels from [Grundschule, Sek. I, Sek. II, Higher Education].
+    4. educational_role (list): Applicable roles from [student, teacher, administrator, mentor, instructional_designer, parent_guardian, researcher, support_staff].
+    5. educational_use (list): Applicable uses are [""" + ','.join([u['use'] for u in EDUCATIONAL_USES])+ f"""].
+    6. learning_resource_type (list): Applicable types such as [exercise, simulation, questionnaire, diagram, etc.].
+
+    Documents:
+    {documents_prompt(documents)}
+
+    Respond only in JSON format with one object per document, keyed by the document number, each with the fields:
+    "assesses", "teaches", "educational_level", "educational_role", "educational_use", and "learning_resource_type".
+    Respond in the same language as each document.
+    """
+    response = get_gpt4_labels(prompt)
+    return batch_responses(response, documents,
+                           lambda metadata: isinstance(metadata, dict) and set(METADATA_FIELDS) <= set(metadata))
+
+metadata_batcher = Batcher(lambda group, documents: fetch_batched_gpt_metadata_inference(documents),
+                           fetch_content_based_gpt_metadata_inference, timeout=llm.LLM_TIMEOUT)
 
 def content_based_gpt_metadata_inference(url, content):
-  return url_cache.get_or_fetch(url, content, fetch_content_based_gpt_metadata_inference)
+  return url_cache.get_or_fetch(url, content, metadata_batcher)
+
+# Not batched: on the event loop concurrent calls cost no threads, and waiting for a batch would delay them
+async def content_based_gpt_metadata_inference_async(url, content):
+  return await url_cache.get_or_fetch_async(url, content, fetch_content_based_gpt_metadata_inference_async)
 
 
 # Task Snippet
 ## Based on questions
-def fetch_content_question_based_gpt_adaptive_snippet(content_questions):
-  content, questions = content_questions
-  prompt = f"""
+def question_snippet_prompt(content, questions):
+  return f"""
   Respond to the following questions given the following content. 
   Respond in keywords and not full sentences.
   Respond in same language as the content. 
@@ -214,11 +562,12 @@ def fetch_content_question_based_gpt_adaptive_snippet(content_questions):
   Repond in JSON format with a list of objects with keys: question and answer. 
   Keep the answers to one sentence each and brief.
   """
-  try:
-    response = get_gpt4_labels(prompt)
-    return parse_json(response)
-  except Exception as e:
-    return None
+
+def fetch_content_question_based_gpt_adaptive_snippet(content_questions):
+  return _ask(question_snippet_prompt(*content_questions))
+
+async def fetch_content_question_based_gpt_adaptive_snippet_async(content_questions):
+  return await _ask_async(question_snippet_prompt(*content_questions))
 
 ## Based on relevance dimensions
 def fetch_content_relevance_dimension_based_gpt_adaptive_snippet(content_relevance_dimensions):
@@ -243,6 +592,8 @@ def fetch_content_relevance_dimension_based_gpt_adaptive_snippet(content_relevan
   try:
     response = get_gpt4_labels(prompt)
     return parse_json(response)
+  except deadline.DeadlineExceeded:
+    raise
   except Exception as e:
     return None
 
@@ -269,13 +620,120 @@ def fetch_content_queries_based_gpt_adaptive_snippet(content_queries):
   try:
     response = get_gpt4_labels(prompt)
     return parse_json(response)
+  except deadline.DeadlineExceeded:
+    raise
   except Exception as e:
     return None
 
+def fetch_batched_question_based_gpt_adaptive_snippet(questions, documents):
+  prompt = f"""
+  Respond to the following questions given each of the following documents.
+  Respond in keywords and not full sentences.
+  Respond in same language as the document.
+  Translate and paraphrase the question if needed.
+
+  Documents:
+  {documents_prompt(documents)}
+
+  Questions:
+  {list(questions)}
+
+  Repond in JSON format with one list per document, keyed by the document number,
+  of objects with keys: question and answer.
+  Keep the answers to one sentence each and brief.
+  """
+  response = get_gpt4_labels(prompt)
+  return batch_responses(response, documents, lambda answers: isinstance(answers, list) and len(answers) > 0)
+
+# Documents are batched with others asked the same questions
+snippet_batcher = Batcher(fetch_batched_question_based_gpt_adaptive_snippet,
+                          fetch_content_question_based_gpt_adaptive_snippet,
+                          split=lambda content_questions: (tuple(content_questions[1]), content_questions[0]),
+                          timeout=llm.LLM_TIMEOUT)
+
 def content_based_adaptive_snippet(url, content, questions):
-  return url_cache.get_or_fetch((url, content, questions), 
-                                (content,questions), 
-                                fetch_content_question_based_gpt_adaptive_snippet)
+  return snippet_cache.get_or_fetch((url, content, questions), 
+                                    (content,questions), 
+                                    snippet_batcher)
+
+async def content_based_adaptive_snippet_async(url, content, questions):
+  return await snippet_cache.get_or_fetch_async((url, content, questions), (content, questions),
+                                                fetch_content_question_based_gpt_adaptive_snippet_async)
+
+## Metadata and question-based snippet in one call
+
+def analysis_prompt(content, questions):
+  return """
+  Extract educational metadata from the following content based on LRMI definitions,
+  and respond to the questions given the content.
+
+  Metadata fields:
+  1. assesses (string): What skills or knowledge does this resource evaluate?
+  2. teaches (string): What skills or knowledge does this resource impart?
+  3. educational_level (list): Relevant levels from [Grundschule, Sek. I, Sek. II, Higher Education].
+  4. educational_role (list): Applicable roles from [student, teacher, administrator, mentor, instructional_designer, parent_guardian, researcher, support_staff].
+  5. educational_use (list): Applicable uses are [""" + ','.join([u['use'] for u in EDUCATIONAL_USES]) + f"""].
+  6. learning_resource_type (list): Applicable types such as [exercise, simulation, questionnaire, diagram, etc.].
+
+  Answer the questions in keywords and not full sentences, one sentence each at most.
+  Translate and paraphrase the questions if needed.
+  Respond in the same language as the content.
+
+  Content:
+  {content}
+
+  Questions:
+  {questions}
+
+  Respond only in JSON format with two keys: "metadata", an object with the fields
+  "assesses", "teaches", "educational_level", "educational_role", "educational_use" and
+  "learning_resource_type", and "answers", a list of objects with keys: question and answer.
+  """
+
+def analysis_response(response_text):
+  response = parse_json(response_text)
+  if (isinstance(response, dict) and isinstance(response.get('metadata'), dict)
+      and set(METADATA_FIELDS) <= set(response['metadata']) and isinstance(response.get('answers'), list)):
+    return response
+  return None
+
+def fetch_content_based_gpt_analysis(content_questions):
+  return _ask(analysis_prompt(*content_questions), analysis_response)
+
+async def fetch_content_based_gpt_analysis_async(content_questions):
+  return await _ask_async(analysis_prompt(*content_questions), analysis_response)
+
+def _cache_analysis(url, snippet_key, merged):
+  url_cache.put(url, merged['metadata'])
+  snippet_cache.put(snippet_key, merged['answers'])
+  return merged['metadata'], merged['answers']
+
+def content_based_analysis(url, content, questions):
+  """
+  (metadata, snippet) of a page as content_based_gpt_metadata_inference and
+  content_based_adaptive_snippet return them, from one LLM call when neither
+  is cached yet. Both halves are cached under their own keys.
+  """
+  snippet_key = (url, content, questions)
+  metadata, snippet = url_cache.peek(url), snippet_cache.peek(snippet_key)
+  if metadata is None and snippet is None:
+    merged = fetch_content_based_gpt_analysis((content, questions))
+    if merged is not None:
+      return _cache_analysis(url, snippet_key, merged)
+  # One half is cached already, or the merged response was unusable
+  return (metadata[0] if metadata else content_based_gpt_metadata_inference(url, content),
+          snippet[0] if snippet else content_based_adaptive_snippet(url, content, questions))
+
+async def content_based_analysis_async(url, content, questions):
+  snippet_key = (url, content, questions)
+  metadata, snippet = await asyncio.gather(asyncio.to_thread(url_cache.peek, url),
+                                           asyncio.to_thread(snippet_cache.peek, snippet_key))
+  if metadata is None and snippet is None:
+    merged = await fetch_content_based_gpt_analysis_async((content, questions))
+    if merged is not None:
+      return await asyncio.to_thread(_cache_analysis, url, snippet_key, merged)
+  return (metadata[0] if metadata else await content_based_gpt_metadata_inference_async(url, content),
+          snippet[0] if snippet else await content_based_adaptive_snippet_async(url, content, questions))
 
 EDUCATIONAL_USES = [
     {
@@ -346,18 +804,9 @@ LEARNING_RESOURCE_TYPES = ["exercise", "simulation", "questionnaire", "diagram",
                            "problem_statement", "assessment", "lecture", "case study", "definition", 
                            "illustration", "demonstration", "simulation", "interactive activity", "video"]
 
-def load_query_term_model():
-    model_path = 'models/query_term_classification'
-    if not Path(model_path).exists():
-        raise ValueError(f"Model path {model_path} does not exist")
-    nlp = spacy.load(model_path)
-    return nlp
-
-ner_model = load_query_term_model()
-
-
+@timing.timed('ner')
 def classify_query_type(query):
-    return [(e.text, e.label_) for e in ner_model(query).ents]
+    return [(e.text, e.label_) for e in models.get('query_terms')(query).ents]
 
 
 
@@ -1,6 +1,6 @@
-from anthropic import Anthropic
 import logging
 
+from ll import deadline, llm
 from ll.cache import URLLevelCache
 
 log = logging.getLogger(__name__)
@@ -8,19 +8,16 @@ log = logging.getLogger(__name__)
 class Claude:
     
     def __init__(self):
-        self.client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
         self.CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
         self.RESPONSE_LENGTH = 1024
+        self.client = llm.client(provider='anthropic', model=self.CLAUDE_MODEL)
         self.cache = URLLevelCache()
         
     def _send_prompt(self, prompt):
         try:
-            response = self.client.messages.create(
-                model=self.CLAUDE_MODEL,
-                max_tokens=self.RESPONSE_LENGTH,
-                messages=[{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}]
-            )
-            return response.content[0].text
+            return self.client.complete(prompt, max_tokens=self.RESPONSE_LENGTH)
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:
             log.warning(f"Error calling Claude API: {e}")
             return None
@@ -0,0 +1,181 @@
+import hashlib
+import io
+import re
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator
+
+# Compressed data is MAGIC, the 8 character id of the preset dictionary it
+# was compressed with (NO_DICTIONARY for none) and a zlib stream. Values
+# that do not start with MAGIC are stored as they are, so plain files and
+# JSON values written before compression existed stay readable.
+MAGIC = b'\x00z'
+NO_DICTIONARY = '00000000'
+HEADER_SIZE = len(MAGIC) + len(NO_DICTIONARY)
+
+# zlib only looks back 32 KiB, a larger dictionary would not be used
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+def is_compressed(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+class Codec:
+    """zlib with an optional preset dictionary shared by all entries of a kind."""
+
+    def __init__(self, zdict: bytes = b'', level: int = 6):
+        self.zdict = zdict
+        self.level = level
+        self.id = hashlib.md5(zdict).hexdigest()[:8] if zdict else NO_DICTIONARY
+
+    def compress(self, data: bytes) -> bytes:
+        return b''.join(self.compress_chunks([data]))
+
+    @property
+    def header(self) -> bytes:
+        return MAGIC + self.id.encode('ascii')
+
+    def compressor(self):
+        """zlib compressor of the data following the header, for data pushed rather than iterated."""
+        if self.zdict:
+            return zlib.compressobj(self.level, zdict=self.zdict)
+        return zlib.compressobj(self.level)
+
+    def compress_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Compressed data of the concatenated chunks, produced as they are consumed."""
+        compressor = self.compressor()
+        yield self.header
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+class _DecompressingReader(io.RawIOBase):
+    """Readable file object that decompresses an iterator of compressed chunks as it is read."""
+
+    def __init__(self, chunks: Iterator[bytes], dictionaries: 'Dictionaries'):
+        self._chunks = chunks
+        self._dictionaries = dictionaries
+        self._decompressor = None
+        self._pending = b''
+        self._buffer = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self) -> bool:
+        for chunk in self._chunks:
+            if self._decompressor is None:
+                self._pending += chunk
+                if len(self._pending) < HEADER_SIZE:
+                    continue
+                header, chunk, self._pending = self._pending[:HEADER_SIZE], self._pending[HEADER_SIZE:], b''
+                if not is_compressed(header):
+                    raise ValueError("Not compressed data")
+                zdict = self._dictionaries.get(header[len(MAGIC):].decode('ascii'))
+                self._decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+            self._buffer, self._offset = self._decompressor.decompress(chunk), 0
+            if self._buffer:
+                return True
+        if self._decompressor is not None:
+            self._buffer, self._offset = self._decompressor.flush(), 0
+            self._decompressor = None
+        return bool(self._buffer)
+
+    def readinto(self, b):
+        if self._offset >= len(self._buffer) and not self._fill():
+            return 0
+        n = min(len(b), len(self._buffer) - self._offset)
+        b[:n] = self._buffer[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+
+def _file_chunks(path: Path, chunk_size: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+class Dictionaries:
+    """
+    Trained preset dictionaries, saved as <name>-<id>.zdict in `directory`.
+    New data is compressed with the newest dictionary of its name, data is
+    decompressed with whichever dictionary its header names, so dictionaries
+    are never deleted once used.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._by_id: Dict[str, bytes] = {}
+        self._codecs: Dict[str, Codec] = {}
+
+    def get(self, id: str) -> bytes:
+        if id == NO_DICTIONARY:
+            return b''
+        with self._lock:
+            if id not in self._by_id:
+                paths = list(self.directory.glob(f'*-{id}.zdict'))
+                if not paths:
+                    raise FileNotFoundError(f"Compression dictionary {id} not found in {self.directory}")
+                self._by_id[id] = paths[0].read_bytes()
+            return self._by_id[id]
+
+    def codec(self, name: str) -> Codec:
+        """Codec for new data of a kind, loaded once per process."""
+        with self._lock:
+            if name not in self._codecs:
+                paths = sorted(self.directory.glob(f'{name}-*.zdict'), key=lambda p: p.stat().st_mtime)
+                self._codecs[name] = Codec(paths[-1].read_bytes() if paths else b'')
+            return self._codecs[name]
+
+    def save(self, name: str, zdict: bytes) -> Codec:
+        self.directory.mkdir(exist_ok=True, parents=True)
+        codec = Codec(zdict)
+        (self.directory / f'{name}-{codec.id}.zdict').write_bytes(zdict)
+        with self._lock:
+            self._codecs[name] = codec
+            self._by_id[codec.id] = zdict
+        return codec
+
+    def open(self, path: Path, chunk_size: int = 64 * 1024) -> BinaryIO:
+        """Binary file object over the decompressed content of a compressed file."""
+        return io.BufferedReader(_DecompressingReader(_file_chunks(path, chunk_size), self))
+
+    def decompress(self, data: bytes) -> bytes:
+        return io.BufferedReader(_DecompressingReader(iter([data]), self)).read()
+
+    def loads(self, data: bytes) -> bytes:
+        """Data as it was before compression, whether or not it was compressed."""
+        return self.decompress(data) if is_compressed(data) else data
+
+
+_segments = re.compile(rb'[^\n<>]{8,256}|<[^<>\n]{4,256}>')
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = MAX_DICTIONARY_SIZE) -> bytes:
+    """
+    Preset dictionary from the segments (markup tags, lines of boilerplate,
+    frequent phrases) that recur across samples, ranked by the bytes they
+    would save. The most valuable segments go last, where zlib reaches them
+    with the shortest distances.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(_segments.findall(sample)))
+    ranked = sorted(((count - 1) * len(segment), segment)
+                    for segment, count in counts.items() if count > 1)
+    chosen, total = [], 0
+    for _, segment in reversed(ranked):
+        if total + len(segment) > size:
+            continue
+        chosen.append(segment)
+        total += len(segment)
+    return b''.join(reversed(chosen))
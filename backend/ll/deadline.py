@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+log = logging.getLogger("deadline")
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before the work could be done."""
+
+
+class Deadline:
+    """Point in time by which a request has to be answered."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, default: float) -> float:
+        """`default`, shortened to what is left of the deadline."""
+        return min(default, self.remaining())
+
+    def extended(self, seconds: float) -> 'Deadline':
+        """This deadline, `seconds` later."""
+        deadline = Deadline(self.seconds + seconds)
+        deadline.expires_at = self.expires_at + seconds
+        return deadline
+
+
+# The deadline of the work of the current context: page fetches and LLM
+# calls further down shorten their timeouts to it and raise
+# DeadlineExceeded once it has passed. The deadline maps below set it to
+# the request's deadline plus GRACE for their tasks.
+_current: contextvars.ContextVar = contextvars.ContextVar('deadline', default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def timeout(default: float) -> float:
+    """`default`, shortened to the current deadline if there is one."""
+    deadline = current()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def check():
+    """Raise DeadlineExceeded when the current deadline has passed."""
+    deadline = current()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(f"Deadline of {deadline.seconds:.1f}s exceeded")
+
+
+class PartialResults(list):
+    """Results that finished in time; `pending` holds the keys of those that did not."""
+
+    def __init__(self, results: Iterable = (), pending: Iterable = ()):
+        super().__init__(results)
+        self.pending = list(pending)
+
+
+# Seconds tasks keep running after the deadline of their request, so that
+# results that are late for it still get cached for the next one
+GRACE = float(os.getenv('LL_DEADLINE_GRACE', 60))
+
+
+class DeadlineMap:
+    """
+    Runs fn over items in a thread pool and yields the non-empty results
+    as they complete, until all are done or the deadline passes. Only the
+    waiting stops at the deadline: the tasks run under the deadline
+    extended by `grace`, their page fetches and LLM calls are cut short
+    only then. `pending` then holds the keys of the items without a result: those
+    still running, and those that returned nothing or raised
+    DeadlineExceeded. The pool is not waited for: tasks still running
+    finish in the background (filling the caches for the next request),
+    tasks not yet started are cancelled.
+    """
+
+    def __init__(self, fn: Callable[[Dict], Any], items: List[Dict], key: Callable[[Dict], str],
+                 deadline: Optional[Deadline] = None, max_workers: int = 10, grace: float = GRACE):
+        self.fn = fn
+        self.items = items
+        self.key = key
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.grace = grace
+        self.pending = [key(item) for item in items]
+
+    def task_deadline(self) -> Optional[Deadline]:
+        return self.deadline and self.deadline.extended(self.grace)
+
+    def __iter__(self) -> Iterator[Any]:
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        # Each task runs in a copy of the caller's context with the extended deadline set
+        with deadline_scope(self.task_deadline()):
+            future_to_key = {
+                executor.submit(contextvars.copy_context().run, self.fn, item): self.key(item)
+                for item in self.items
+            }
+        try:
+            for future in as_completed(future_to_key, timeout=self.deadline.remaining() if self.deadline else None):
+                try:
+                    result = future.result()
+                except DeadlineExceeded:
+                    continue
+                except Exception as e:
+                    log.error(f"Error processing future for {future_to_key[future]}: {str(e)}")
+                    self.pending.remove(future_to_key[future])
+                    continue
+                if result:
+                    self.pending.remove(future_to_key[future])
+                    yield result
+        except TimeoutError:
+            pass
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def map_until_deadline(fn: Callable[[Dict], Any], items: List[Dict], key: Callable[[Dict], str],
+                       deadline: Optional[Deadline] = None, max_workers: int = 10,
+                       grace: float = GRACE) -> PartialResults:
+    """The results of a DeadlineMap that finished in time, as one list."""
+    mapped = DeadlineMap(fn, items, key, deadline, max_workers, grace)
+    results = list(mapped)
+    return PartialResults(results, mapped.pending)
+
+
+# Tasks of AsyncDeadlineMaps left running past their deadline; the event loop only keeps weak references
+_background: Set[asyncio.Task] = set()
+
+
+def _forget(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error(f"Error in background task: {task.exception()}")
+
+
+class AsyncDeadlineMap:
+    """
+    DeadlineMap for a coroutine function: fn runs on the event loop, one
+    task per item, instead of in a thread pool. Tasks still running at the
+    deadline are not cancelled, they finish in the background within the
+    grace period.
+    """
+
+    def __init__(self, fn: Callable[[Dict], Awaitable[Any]], items: List[Dict], key: Callable[[Dict], str],
+                 deadline: Optional[Deadline] = None, grace: float = GRACE):
+        self.fn = fn
+        self.items = items
+        self.key = key
+        self.deadline = deadline
+        self.grace = grace
+        self.pending = [key(item) for item in items]
+
+    def task_deadline(self) -> Optional[Deadline]:
+        return self.deadline and self.deadline.extended(self.grace)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        # Each task runs in a copy of the caller's context with the extended deadline set
+        with deadline_scope(self.task_deadline()):
+            task_to_key = {asyncio.ensure_future(self.fn(item)): self.key(item) for item in self.items}
+        running = set(task_to_key)
+        try:
+            while running:
+                done, running = await asyncio.wait(running, timeout=self.deadline.remaining() if self.deadline else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    try:
+                        result = task.result()
+                    except DeadlineExceeded:
+                        continue
+                    except Exception as e:
+                        log.error(f"Error processing task for {task_to_key[task]}: {str(e)}")
+                        self.pending.remove(task_to_key[task])
+                        continue
+                    if result:
+                        self.pending.remove(task_to_key[task])
+                        yield result
+        finally:
+            for task in running:
+                _background.add(task)
+                task.add_done_callback(_forget)
+
+
+async def gather_until_deadline(fn: Callable[[Dict], Awaitable[Any]], items: List[Dict], key: Callable[[Dict], str],
+                                deadline: Optional[Deadline] = None, grace: float = GRACE) -> PartialResults:
+    """The results of an AsyncDeadlineMap that finished in time, as one list."""
+    mapped = AsyncDeadlineMap(fn, items, key, deadline, grace)
+    results = [result async for result in mapped]
+    return PartialResults(results, mapped.pending)
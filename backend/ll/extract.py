@@ -0,0 +1,249 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from ll import deadline, timing
+from ll.lazy import lazy_import
+from ll.store import dictionaries
+
+pypdf = lazy_import('pypdf')
+trafilatura = lazy_import('trafilatura')
+docx = lazy_import('docx')
+
+log = logging.getLogger("extract")
+logging.getLogger("trafilatura").setLevel(logging.FATAL)
+
+
+class ExtractionTimeout(BaseException):
+    """
+    Extraction used up its CPU time. A BaseException, like
+    KeyboardInterrupt, so that the parsers' own `except Exception` blocks
+    do not swallow it: the timer fires only once.
+    """
+
+
+# Parsers, run in the extraction processes
+
+def read_body(path: Path, dictionary_dir: Optional[Path] = None) -> str:
+    """Text of a body file, decompressing it while it is read."""
+    if path.suffix == '.z':
+        with dictionaries(dictionary_dir).open(path) as f:
+            return io.TextIOWrapper(f, encoding='utf-8').read()
+    return path.read_text(encoding='utf-8')
+
+
+def _join_until(texts: Iterable[str], max_chars: Optional[int]) -> str:
+    """' '.join(texts), without taking more texts once max_chars are reached."""
+    parts, length = [], 0
+    for text in texts:
+        parts.append(text)
+        length += len(text) + 1
+        if max_chars and length >= max_chars:
+            break
+    return ' '.join(parts)
+
+
+def pdf_text(path: Path, max_chars: Optional[int] = None) -> str:
+    with open(path, 'rb') as f:
+        reader = pypdf.PdfReader(f)
+        # Pages are only parsed until there is enough text
+        return _join_until((page.extract_text() for page in reader.pages), max_chars)
+
+
+def docx_text(path: Path, max_chars: Optional[int] = None) -> str:
+    return _join_until((paragraph.text for paragraph in docx.Document(path).paragraphs), max_chars)
+
+
+def extract_file(path: Path, content_type: str, dictionary_dir: Optional[Path] = None,
+                 max_chars: Optional[int] = None) -> str:
+    """Text of a downloaded body, by its content type, at most max_chars long."""
+    path = Path(path)
+    if content_type == 'text/html':
+        text = trafilatura.extract(read_body(path, dictionary_dir)) or ""
+    elif path.suffix == '.pdf':
+        text = pdf_text(path, max_chars)
+    elif path.suffix == '.docx':
+        text = docx_text(path, max_chars)
+    else:
+        text = read_body(path, dictionary_dir)
+    return text[:max_chars] if max_chars else text
+
+
+def _cpu_limit_reached(signum, frame):
+    raise ExtractionTimeout()
+
+
+def run_limited(fn: Callable[..., Any], *args, cpu_seconds: float) -> Any:
+    """fn(*args), raising ExtractionTimeout after `cpu_seconds` of CPU time. Main thread only."""
+    previous = signal.signal(signal.SIGPROF, _cpu_limit_reached)
+    signal.setitimer(signal.ITIMER_PROF, cpu_seconds)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+
+
+def _extract_in_worker(path: str, content_type: str, dictionary_dir: Optional[str], max_chars: Optional[int],
+                       cpu_seconds: float) -> Optional[str]:
+    try:
+        return run_limited(extract_file, Path(path), content_type, dictionary_dir and Path(dictionary_dir),
+                           max_chars, cpu_seconds=cpu_seconds)
+    except ExtractionTimeout:
+        log.warning(f"Extraction of {path} took more than {cpu_seconds}s of CPU time")
+        # Cached as empty, like a page without text, so it is not parsed again on every request
+        return ""
+    except Exception as e:
+        log.error(f"Error extracting text from {path}: {e}")
+        return None
+
+
+class Extractor:
+    """
+    Runs text extraction (trafilatura, pypdf, python-docx) in a pool of
+    `workers` processes, so that parsing one large document neither holds
+    the GIL for the threads downloading and annotating other results nor
+    blocks other requests of the worker. Each document gets at most
+    `cpu_seconds` of CPU time, bodies over `max_bytes` are not parsed at
+    all, and parsing stops once `max_chars` of text are extracted (callers
+    use the first 5000). Waiting for a result is bounded by the current
+    deadline.
+
+    The pool is started on first use, in each process that uses it, from
+    fresh interpreters (spawn) rather than forks of a threaded server.
+    With `workers` 0 extraction runs inline, without the CPU limit.
+    extract_async awaits the same pool from an event loop.
+    """
+
+    def __init__(self, workers: int = int(os.getenv('LL_EXTRACT_WORKERS', min(4, os.cpu_count() or 1))),
+                 cpu_seconds: float = float(os.getenv('LL_EXTRACT_CPU_SECONDS', 20)),
+                 max_bytes: int = int(os.getenv('LL_EXTRACT_MAX_BYTES', 20 * 1024 * 1024)),
+                 max_chars: int = int(os.getenv('LL_EXTRACT_MAX_CHARS', 20000)),
+                 timeout: float = float(os.getenv('LL_EXTRACT_TIMEOUT', 60))):
+        self.workers = workers
+        self.cpu_seconds = cpu_seconds
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counts = {'extracted': 0, 'too_large': 0, 'late': 0, 'broken_pool': 0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._pool
+
+    def _reset(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    @timing.timed('extract')
+    def extract(self, path: Path, content_type: str, dictionary_dir: Optional[Path] = None,
+                on_late: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        Text of the body at `path`, None when it cannot be parsed. When the
+        deadline passes first DeadlineExceeded is raised, and the text is
+        handed to on_late once the extraction finishes.
+        """
+        path = Path(path)
+        if not self._admit(path):
+            return "" if path.exists() else None
+        if not self.workers:
+            return self._extract_inline(path, content_type, dictionary_dir)
+
+        pool = self._executor()
+        try:
+            future = self._submit(pool, path, content_type, dictionary_dir)
+            return future.result(timeout=deadline.timeout(self.timeout))
+        except BrokenProcessPool:
+            return self._broken(pool, path)
+        except TimeoutError:
+            return self._late(future, path, on_late)
+
+    @timing.timed('extract')
+    async def extract_async(self, path: Path, content_type: str, dictionary_dir: Optional[Path] = None,
+                            on_late: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """extract, awaiting the extraction process without blocking the event loop."""
+        path = Path(path)
+        if not self._admit(path):
+            return "" if path.exists() else None
+        if not self.workers:
+            return await asyncio.to_thread(self._extract_inline, path, content_type, dictionary_dir)
+
+        pool = self._executor()
+        try:
+            future = self._submit(pool, path, content_type, dictionary_dir)
+            # Shielded, the timeout must not cancel the future on_late waits for
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                          deadline.timeout(self.timeout))
+        except BrokenProcessPool:
+            return self._broken(pool, path)
+        except asyncio.TimeoutError:
+            return self._late(future, path, on_late)
+
+    def _admit(self, path: Path) -> bool:
+        """Whether the body at `path` is there and small enough to be parsed."""
+        if not path.exists():
+            return False
+        if path.stat().st_size > self.max_bytes:
+            log.warning(f"Not extracting {path}, {path.stat().st_size} bytes is over {self.max_bytes}")
+            self.counts['too_large'] += 1
+            return False
+        self.counts['extracted'] += 1
+        return True
+
+    def _extract_inline(self, path: Path, content_type: str, dictionary_dir: Optional[Path]) -> Optional[str]:
+        try:
+            return extract_file(path, content_type, dictionary_dir, self.max_chars)
+        except Exception as e:
+            log.error(f"Error extracting text from {path}: {e}")
+            return None
+
+    def _submit(self, pool: ProcessPoolExecutor, path: Path, content_type: str,
+                dictionary_dir: Optional[Path]) -> Future:
+        return pool.submit(_extract_in_worker, str(path), content_type,
+                           dictionary_dir and str(dictionary_dir), self.max_chars, self.cpu_seconds)
+
+    def _broken(self, pool: ProcessPoolExecutor, path: Path) -> None:
+        # An extraction process died, e.g. killed for its memory use
+        log.error(f"Extraction process died extracting {path}, restarting the pool")
+        self.counts['broken_pool'] += 1
+        self._reset(pool)
+        return None
+
+    def _late(self, future: Future, path: Path, on_late: Optional[Callable[[str], None]]) -> None:
+        if on_late is not None:
+            self.counts['late'] += 1
+            future.add_done_callback(lambda f: self._finish_late(f, on_late))
+        deadline.check()
+        log.error(f"Extraction of {path} took more than {self.timeout}s")
+        return None
+
+    @staticmethod
+    def _finish_late(future: Future, on_late: Callable[[str], None]):
+        try:
+            text = future.result()
+            if text is not None:
+                on_late(text)
+        except Exception as e:
+            log.error(f"Could not keep late extraction: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {'workers': self.workers, **self.counts}
+
+
+extractor = Extractor()
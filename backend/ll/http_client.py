@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ll.lazy import lazy_import
+
+httpx = lazy_import('httpx')
+
+log = logging.getLogger("http_client")
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report every new TCP connection."""
+
+    def __init__(self, on_connect, **kwargs):
+        self._on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_connect = self._on_connect
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                on_connect()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                on_connect()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After `failures` consecutive timeouts or
+    connection errors the host's circuit opens and requests to it fail
+    immediately; after `reset_after` seconds one request is let through,
+    and its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, failures: int = int(os.getenv('LL_BREAKER_FAILURES', 3)),
+                 reset_after: float = float(os.getenv('LL_BREAKER_RESET', 60))):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        # host -> [consecutive failures, opened at or None, probe in flight]
+        self._hosts: Dict[str, list] = {}
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[1] is None:
+                return True
+            if state[2] or time.monotonic() - state[1] < self.reset_after:
+                return False
+            state[2] = True
+            return True
+
+    def success(self, host: str):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def release(self, host: str):
+        """Let the next request probe the host again, after one that neither succeeded nor failed."""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None:
+                state[2] = False
+
+    def failure(self, host: str):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, None, False])
+            state[0] += 1
+            if state[0] >= self.failures:
+                if state[1] is None:
+                    log.warning(f"Circuit open for {host} after {state[0]} failures")
+                state[1], state[2] = time.monotonic(), False
+
+    def open_hosts(self):
+        with self._lock:
+            return sorted(host for host, state in self._hosts.items() if state[1] is not None)
+
+
+class HTTPClient:
+    """
+    Keep-alive HTTP client shared by all page fetches of a worker.
+
+    Connections are pooled per host and reused across requests and threads;
+    at most `per_host` requests run against the same host at a time, and
+    `pool_hosts` is the number of hosts whose pools are kept open. Hosts
+    that keep timing out are cut off by a CircuitBreaker for a while.
+    """
+
+    def __init__(self, pool_hosts: int = int(os.getenv('LL_HTTP_POOL_HOSTS', 64)),
+                 per_host: int = int(os.getenv('LL_HTTP_PER_HOST', 4)),
+                 verify: bool = False, breaker: CircuitBreaker = None):
+        self.per_host = per_host
+        self.verify = verify
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = _CountingAdapter(self._connected, pool_connections=pool_hosts, pool_maxsize=per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.requests = 0
+        self.connections = 0
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _send(self, host: str, url: str, **kwargs) -> requests.Response:
+        # Checked once a slot is free, the circuit may have opened meanwhile
+        if not self.breaker.allow(host):
+            raise CircuitOpenError(f"Circuit open for {host}")
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self.session.get(url, verify=self.verify, **kwargs)
+        except (requests.Timeout, requests.ConnectionError):
+            self.breaker.failure(host)
+            raise
+        except BaseException:
+            self.breaker.release(host)
+            raise
+        self.breaker.success(host)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        host = urlsplit(url).netloc.lower()
+        with self._host_slot(host):
+            return self._send(host, url, **kwargs)
+
+    @contextmanager
+    def stream(self, url: str, **kwargs) -> Iterator[requests.Response]:
+        """GET `url`, the response's body to be read within the with block, which holds the host's slot."""
+        host = urlsplit(url).netloc.lower()
+        with self._host_slot(host):
+            response = self._send(host, url, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': max(self.requests - self.connections, 0),
+            }
+        stats['open_circuits'] = self.breaker.open_hosts()
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHTTPClient:
+    """
+    HTTPClient for the event loop of the ASGI app, on httpx. At most
+    `per_host` requests run against a host at a time and `max_connections`
+    in total, waiting for asyncio semaphores instead of holding threads.
+    Pass the breaker of the HTTPClient to share which hosts are cut off.
+
+    httpx connections belong to the event loop that opened them, so the
+    client and the semaphores are created anew on a different loop.
+    """
+
+    def __init__(self, pool_hosts: int = int(os.getenv('LL_HTTP_POOL_HOSTS', 64)),
+                 per_host: int = int(os.getenv('LL_HTTP_PER_HOST', 4)),
+                 max_connections: int = int(os.getenv('LL_HTTP_MAX_CONNECTIONS', 256)),
+                 verify: bool = False, breaker: CircuitBreaker = None, transport=None):
+        self.pool_hosts = pool_hosts
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.verify = verify
+        self.breaker = breaker or CircuitBreaker()
+        # An httpx transport to send the requests with instead of the network, e.g. in tests
+        self.transport = transport
+        self._loop = None
+        self._client = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                verify=self.verify, follow_redirects=True, transport=self.transport,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.pool_hosts * self.per_host))
+            self._host_slots = {}
+        return self._client
+
+    def _host_slot(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self._host_slots[host]
+
+    @asynccontextmanager
+    async def stream(self, url: str, timeout: float) -> AsyncIterator['httpx.Response']:
+        """GET `url`, the response's body to be read within the with block."""
+        client = self._bind()
+        host = urlsplit(url).netloc.lower()
+        async with self._host_slot(host):
+            if not self.breaker.allow(host):
+                raise CircuitOpenError(f"Circuit open for {host}")
+            self.requests += 1
+            try:
+                response = await client.send(client.build_request('GET', url, timeout=timeout), stream=True)
+            except httpx.TransportError:
+                self.breaker.failure(host)
+                raise
+            except BaseException:
+                # Also when cancelled, so that the host can be probed again
+                self.breaker.release(host)
+                raise
+            self.breaker.success(host)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'requests': self.requests, 'open_circuits': self.breaker.open_hosts()}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._loop = self._client = None
@@ -0,0 +1,191 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from ll.store import CacheStore, open_store
+
+log = logging.getLogger("jobs")
+
+# handler(result, query) -> annotation for one search result, or None
+Handler = Callable[[Dict, Optional[str]], Any]
+
+
+class QueueFull(Exception):
+    """The job queue has no room for another SERP."""
+
+
+class Job:
+    def __init__(self, id: str, results: List[Dict], query: Optional[str], features: List[str]):
+        self.id = id
+        self.query = query
+        self.created_at = time.time()
+        self.urls = [result['url'] for result in results]
+        self.features = features
+        self.total = len(results) * len(features)
+        # Per (url, feature), in the order they completed
+        self.results: List[Dict] = []
+        self.condition = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) >= self.total
+
+    def pending(self) -> List[str]:
+        """URLs, in rank order, with features still to be done."""
+        completed = {}
+        for event in self.results:
+            completed[event['url']] = completed.get(event['url'], 0) + 1
+        return [url for url in dict.fromkeys(self.urls)
+                if completed.get(url, 0) < self.urls.count(url) * len(self.features)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                'id': self.id,
+                'status': 'done' if self.done else 'running',
+                'created_at': self.created_at,
+                'total': self.total,
+                'completed': len(self.results),
+                'pending': self.pending(),
+                'results': list(self.results),
+            }
+
+
+class JobQueue:
+    """
+    Annotates whole SERPs in the background. Every (search result, feature)
+    pair is a task in one priority queue shared by all jobs, ordered by the
+    result's rank, so the top results of a new SERP are worked on before
+    the tail of older ones. A fixed number of worker threads drain it.
+
+    Job state is mirrored to the cache store after every task, so any
+    worker process can answer polls for a job started in another one.
+    Finished jobs are forgotten `ttl` seconds after they were submitted,
+    in memory and in the store.
+    """
+
+    # Seconds between sweeps of the store for expired jobs
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, handlers: Dict[str, Handler], workers: int = int(os.getenv('LL_JOB_WORKERS', 4)),
+                 max_tasks: int = int(os.getenv('LL_JOB_MAX_TASKS', 1000)),
+                 ttl: float = float(os.getenv('LL_JOB_TTL', 3600)), store: Optional[CacheStore] = None):
+        self.handlers = handlers
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self.store = store or open_store('jobs')
+        # Bounded by submit(), so that a full queue rejects a SERP instead of blocking the request
+        self.tasks: queue.PriorityQueue = queue.PriorityQueue()
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._pid = None
+        self._swept_at = 0.0
+
+    def _start_workers(self):
+        # Started on first use, and again in a forked child, which inherits no threads
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, results: List[Dict], query: Optional[str] = None,
+               features: Optional[List[str]] = None) -> str:
+        features = features or list(self.handlers)
+        unknown = set(features) - set(self.handlers)
+        if unknown:
+            raise ValueError(f"Unknown features {sorted(unknown)}")
+        if self.tasks.qsize() + len(results) * len(features) > self.max_tasks:
+            raise QueueFull(f"{self.tasks.qsize()} tasks queued")
+        self._start_workers()
+        self._expire()
+
+        job = Job(uuid.uuid4().hex, results, query, features)
+        with self._lock:
+            self.jobs[job.id] = job
+        self._save(job)
+        for rank, result in enumerate(results):
+            for feature in features:
+                self.tasks.put((rank, next(self._seq), job, feature, result))
+        return job.id
+
+    def _work(self):
+        while True:
+            rank, _, job, feature, result = self.tasks.get()
+            event = {'url': result['url'], 'rank': rank, 'feature': feature, 'result': None}
+            try:
+                event['result'] = self.handlers[feature](result, job.query)
+            except Exception as e:
+                log.error(f"Job {job.id}: {feature} failed for {result['url']}: {e}")
+                event['error'] = str(e)
+            with job.condition:
+                job.results.append(event)
+                # Saved before anyone can see the result, so a job seen done here is done in the store too
+                self._save(job)
+                job.condition.notify_all()
+
+    def _save(self, job: Job):
+        try:
+            self.store.set(job.id, job.snapshot())
+        except Exception as e:
+            log.error(f"Could not save job {job.id}: {e}")
+
+    def _expired(self, snapshot: Dict[str, Any]) -> bool:
+        return snapshot['status'] == 'done' and snapshot['created_at'] < time.time() - self.ttl
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for id in [id for id, job in self.jobs.items() if job.done and job.created_at < cutoff]:
+                del self.jobs[id]
+            sweep = time.time() - self._swept_at >= self.SWEEP_INTERVAL
+            if sweep:
+                self._swept_at = time.time()
+        if sweep:
+            # Including jobs of other worker processes, and of earlier runs
+            try:
+                expired = [hkey for hkey, snapshot, _ in self.store.scan() if self._expired(snapshot)]
+                self.store.delete_entries(expired)
+            except Exception as e:
+                log.error(f"Could not expire saved jobs: {e}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        snapshot = self.store.get(job_id)
+        if snapshot is not None and self._expired(snapshot):
+            self.store.delete(job_id)
+            return None
+        return snapshot
+
+    def follow(self, job_id: str, timeout: float = 600, poll_interval: float = 0.25) -> Iterator[Dict]:
+        """Yields the job's results as they complete, until it is done or `timeout` passes."""
+        end = time.monotonic() + timeout
+        seen = 0
+        while True:
+            with self._lock:
+                job = self.jobs.get(job_id)
+            if job is not None:
+                with job.condition:
+                    job.condition.wait_for(lambda: len(job.results) > seen or job.done,
+                                           timeout=max(0, end - time.monotonic()))
+            else:
+                # Running in another worker process: poll its saved state
+                time.sleep(poll_interval)
+            snapshot = self.get(job_id)
+            if snapshot is None:
+                return
+            yield from snapshot['results'][seen:]
+            seen = len(snapshot['results'])
+            if snapshot['status'] == 'done' or time.monotonic() >= end:
+                return
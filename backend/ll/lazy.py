@@ -0,0 +1,42 @@
+import importlib
+import sys
+import threading
+import types
+from typing import Dict
+
+_lazy: Dict[str, 'LazyModule'] = {}
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module that is only imported when one of its attributes is first used."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        # Set through __dict__, before __getattr__ could be asked for them
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """The module `name`, imported on first use unless it is imported already."""
+    if name in sys.modules:
+        return sys.modules[name]
+    if name not in _lazy:
+        _lazy[name] = LazyModule(name)
+    return _lazy[name]
+
+
+def preload():
+    """Import all modules deferred so far, e.g. in the gunicorn master before it forks the workers."""
+    for module in list(_lazy.values()):
+        module._load()
@@ -0,0 +1,197 @@
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+# Decision math for linear SVMs as plain NumPy arrays.
+# Kept free of sklearn imports so it can score exported models too.
+
+
+def ovo_votes_and_scores(dec, n_classes):
+    """
+    Turn one-vs-one decision values into per-class votes and the
+    one-vs-rest scores that sklearn's SVC.decision_function returns.
+    """
+    first, second = np.triu_indices(n_classes, k=1)
+    wins = (dec > 0).astype(float)
+    to_first = np.zeros((len(first), n_classes))
+    to_first[np.arange(len(first)), first] = 1
+    to_second = np.zeros((len(second), n_classes))
+    to_second[np.arange(len(second)), second] = 1
+
+    votes = wins @ to_first + (1 - wins) @ to_second
+    confidences = dec @ (to_first - to_second)
+    scores = votes + confidences / (3 * (np.abs(confidences) + 1))
+    return votes, scores
+
+
+def labels_with_threshold(dec, classes, threshold=0.5):
+    """
+    Labels and confidences for a batch of raw decision values, matching
+    predict_with_threshold on a single input: below the threshold the
+    label is 'Other'.
+    """
+    if dec.ndim == 1:
+        # Binary: signed distance to the hyperplane, positive means classes[1]
+        confidences = dec
+        labels = classes[(dec > 0).astype(int)]
+    else:
+        votes, scores = ovo_votes_and_scores(dec, len(classes))
+        confidences = np.abs(scores).max(axis=1)
+        labels = classes[votes.argmax(axis=1)]
+    labels = np.where(confidences < threshold, 'Other', labels)
+    return [{'label': label, 'confidence': confidence}
+            for label, confidence in zip(labels.tolist(), confidences.tolist())]
+
+
+class LinearSVM:
+    """A linear SVC reduced to its weights, giving raw one-vs-one decisions."""
+
+    def __init__(self, coef, intercept, classes):
+        self.coef = coef
+        self.intercept = intercept
+        self.classes = np.asarray(classes)
+
+    @classmethod
+    def from_svc(cls, svc):
+        coef = svc.coef_
+        coef = coef.toarray() if hasattr(coef, 'toarray') else np.asarray(coef)
+        return cls(coef, np.asarray(svc.intercept_), svc.classes_)
+
+    def decision_function(self, features):
+        dec = np.asarray(features @ self.coef.T) + self.intercept
+        return dec.ravel() if len(self.classes) == 2 else dec
+
+    def predict(self, features, threshold=0.5):
+        return labels_with_threshold(self.decision_function(features), self.classes, threshold)
+
+
+# Compact exported models
+#
+# A directory holding, per vectorizer, a sorted byte-string vocabulary and
+# the matching idf weights, and per classifier head, the coefficient,
+# intercept and class arrays, all as .npy files that are memory-mapped on
+# load. manifest.json describes how they fit together and is written last.
+
+_white_spaces = re.compile(r"\s\s+")
+
+
+class CompactVectorizer:
+    """TfidfVectorizer.transform reimplemented over a sorted vocabulary table."""
+
+    def __init__(self, vocab, idf, analyzer='word', ngram_range=(1, 1), lowercase=True,
+                 token_pattern=r"(?u)\b\w\w+\b", norm='l2', use_idf=True,
+                 sublinear_tf=False, binary=False):
+        self.vocab = vocab
+        self.idf = idf
+        self.analyzer = analyzer
+        self.ngram_range = tuple(ngram_range)
+        self.lowercase = lowercase
+        self.token_pattern = re.compile(token_pattern) if token_pattern else None
+        self.norm = norm
+        self.use_idf = use_idf
+        self.sublinear_tf = sublinear_tf
+        self.binary = binary
+
+    def _ngrams(self, items, join=None):
+        min_n, max_n = self.ngram_range
+        out = list(items) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n + 1, len(items) + 1)):
+            if join is None:
+                out.extend(items[i:i + n] for i in range(len(items) - n + 1))
+            else:
+                out.extend(join(items[i:i + n]) for i in range(len(items) - n + 1))
+        return out
+
+    def analyze(self, doc):
+        if self.lowercase:
+            doc = doc.lower()
+        if self.analyzer == 'char':
+            return self._ngrams(_white_spaces.sub(" ", doc))
+        return self._ngrams(self.token_pattern.findall(doc), ' '.join)
+
+    def lookup(self, terms):
+        """Feature index for each term, -1 when it is not in the vocabulary."""
+        if not terms:
+            return np.zeros(0, dtype=np.int64)
+        keys = np.array([t.encode('utf-8') for t in terms])
+        fits = np.char.str_len(keys) <= self.vocab.itemsize
+        positions = np.searchsorted(self.vocab, keys.astype(self.vocab.dtype))
+        positions = np.minimum(positions, len(self.vocab) - 1)
+        found = fits & (self.vocab[positions] == keys)
+        return np.where(found, positions, -1)
+
+    def transform(self, docs):
+        n_docs, n_features = len(docs), len(self.vocab)
+        terms, rows = [], []
+        for row, doc in enumerate(docs):
+            analyzed = self.analyze(doc)
+            terms.extend(analyzed)
+            rows.extend([row] * len(analyzed))
+        # One vocabulary lookup for the whole batch
+        indices = self.lookup(terms)
+        found = indices >= 0
+        flat = np.asarray(rows, dtype=np.int64)[found] * n_features + indices[found]
+        features = np.bincount(flat, minlength=n_docs * n_features).astype(float)
+        features = features.reshape(n_docs, n_features)
+        if self.binary:
+            np.minimum(features, 1, out=features)
+        if self.sublinear_tf:
+            present = features > 0
+            np.log(features, out=features, where=present)
+            features[present] += 1
+        if self.use_idf:
+            features *= self.idf
+        if self.norm == 'l2':
+            lengths = np.sqrt((features ** 2).sum(axis=1, keepdims=True))
+        elif self.norm == 'l1':
+            lengths = np.abs(features).sum(axis=1, keepdims=True)
+        else:
+            return features
+        np.divide(features, lengths, out=features, where=lengths > 0)
+        return features
+
+
+class CompactModels:
+    """Exported classifier heads scored with NumPy only, grouped by vectorizer."""
+
+    def __init__(self, vectorizers, heads, head_vectorizer):
+        self.vectorizers = vectorizers
+        self.heads = heads
+        self.head_vectorizer = head_vectorizer
+
+    def predict(self, inputs, thresholds):
+        features = {}
+        predictions = {}
+        for name, threshold in thresholds.items():
+            vectorizer = self.head_vectorizer[name]
+            if vectorizer not in features:
+                features[vectorizer] = self.vectorizers[vectorizer].transform(inputs)
+            predictions[name] = self.heads[name].predict(features[vectorizer], threshold)
+        return predictions
+
+
+def _load_array(root, filename):
+    return np.load(root / filename, mmap_mode='r', allow_pickle=False)
+
+
+def load_compact_models(manifest_path, manifest=None):
+    root = Path(manifest_path).parent
+    if manifest is None:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    vectorizers = {
+        name: CompactVectorizer(_load_array(root, f'{name}.vocab.npy'),
+                                _load_array(root, f'{name}.idf.npy'),
+                                **config)
+        for name, config in manifest['vectorizers'].items()
+    }
+    heads = {
+        name: LinearSVM(_load_array(root, f'{name}.coef.npy'),
+                        _load_array(root, f'{name}.intercept.npy'),
+                        _load_array(root, f'{name}.classes.npy').astype(str))
+        for name in manifest['heads']
+    }
+    head_vectorizer = {name: config['vectorizer'] for name, config in manifest['heads'].items()}
+    return CompactModels(vectorizers, heads, head_vectorizer)
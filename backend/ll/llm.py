@@ -0,0 +1,463 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ll import deadline, timing
+from ll.batching import estimate_tokens
+
+log = logging.getLogger("llm")
+
+LLM_TIMEOUT = float(os.getenv('LL_LLM_TIMEOUT', 60))
+
+
+class RetryableError(Exception):
+    """A provider error worth retrying (rate limited, overloaded, connection lost)."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, 'response', None)
+    try:
+        return float(response.headers['retry-after'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Allows `rate` units per second on average and bursts of up to
+    `capacity`. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, amount: float) -> float:
+        """Take `amount` and return 0, or return the seconds until it is there."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1, timeout: float = math.inf) -> bool:
+        """Take `amount`, waiting for it at most `timeout` seconds. False when that is not enough."""
+        if not self.rate:
+            return True
+        # Requests larger than the bucket would never fit, they wait for a full one instead
+        amount = min(amount, self.capacity)
+        end = time.monotonic() + timeout
+        while wait := self._take(amount):
+            if time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
+        return True
+
+    async def acquire_async(self, amount: float = 1, timeout: float = math.inf) -> bool:
+        """Like acquire, waiting without blocking the event loop."""
+        if not self.rate:
+            return True
+        amount = min(amount, self.capacity)
+        end = time.monotonic() + timeout
+        while wait := self._take(amount):
+            if time.monotonic() + wait > end:
+                return False
+            await asyncio.sleep(wait)
+        return True
+
+
+class Provider:
+    """Sends one prompt to a model. Errors worth retrying are raised as RetryableError."""
+
+    name = 'provider'
+    _async_client = None
+
+    def complete(self, model: str, prompt: str, max_tokens: Optional[int], temperature: float,
+                 timeout: float) -> str:
+        raise NotImplementedError
+
+    async def complete_async(self, model: str, prompt: str, max_tokens: Optional[int], temperature: float,
+                        timeout: float) -> str:
+        return await asyncio.to_thread(self.complete, model, prompt, max_tokens, temperature, timeout)
+
+    def _loop_client(self, create: Callable[[], Any]) -> Any:
+        # Async SDK clients hold connections bound to the event loop they were created in
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            self._async_client = (loop, create())
+        return self._async_client[1]
+
+
+class OpenAIProvider(Provider):
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use, so that importing the app needs neither the SDK nor a key
+        if self._client is None:
+            from openai import OpenAI
+            # Retries are done by LLMClient, which knows the rate limits and the deadline
+            self._client = OpenAI(api_key=self.api_key or os.getenv('OPENAI_API_KEY'), max_retries=0)
+        return self._client
+
+    @property
+    def aclient(self):
+        from openai import AsyncOpenAI
+        return self._loop_client(
+            lambda: AsyncOpenAI(api_key=self.api_key or os.getenv('OPENAI_API_KEY'), max_retries=0))
+
+    @staticmethod
+    def _request(model, prompt, max_tokens, temperature, timeout) -> Dict[str, Any]:
+        return dict(model=model, messages=[{"role": "user", "content": prompt}], temperature=temperature,
+                    timeout=timeout, **({'max_tokens': max_tokens} if max_tokens else {}))
+
+    def complete(self, model, prompt, max_tokens, temperature, timeout):
+        import openai
+        try:
+            response = self.client.chat.completions.create(
+                **self._request(model, prompt, max_tokens, temperature, timeout))
+        except openai.APITimeoutError as e:
+            raise RetryableError(str(e)) from e
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            raise RetryableError(str(e), _retry_after(e)) from e
+        return response.choices[0].message.content
+
+    async def complete_async(self, model, prompt, max_tokens, temperature, timeout):
+        import openai
+        try:
+            response = await self.aclient.chat.completions.create(
+                **self._request(model, prompt, max_tokens, temperature, timeout))
+        except openai.APITimeoutError as e:
+            raise RetryableError(str(e)) from e
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            raise RetryableError(str(e), _retry_after(e)) from e
+        return response.choices[0].message.content
+
+
+class AnthropicProvider(Provider):
+    name = 'anthropic'
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import Anthropic
+            self._client = Anthropic(api_key=self.api_key or os.getenv('ANTHROPIC_API_KEY'), max_retries=0)
+        return self._client
+
+    @property
+    def aclient(self):
+        from anthropic import AsyncAnthropic
+        return self._loop_client(
+            lambda: AsyncAnthropic(api_key=self.api_key or os.getenv('ANTHROPIC_API_KEY'), max_retries=0))
+
+    @staticmethod
+    def _request(model, prompt, max_tokens, temperature, timeout) -> Dict[str, Any]:
+        return dict(model=model, max_tokens=max_tokens or 1024, temperature=temperature,
+                    messages=[{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}], timeout=timeout)
+
+    def complete(self, model, prompt, max_tokens, temperature, timeout):
+        import anthropic
+        try:
+            response = self.client.messages.create(**self._request(model, prompt, max_tokens, temperature, timeout))
+        except anthropic.APITimeoutError as e:
+            raise RetryableError(str(e)) from e
+        except (anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError) as e:
+            raise RetryableError(str(e), _retry_after(e)) from e
+        return response.content[0].text
+
+    async def complete_async(self, model, prompt, max_tokens, temperature, timeout):
+        import anthropic
+        try:
+            response = await self.aclient.messages.create(
+                **self._request(model, prompt, max_tokens, temperature, timeout))
+        except anthropic.APITimeoutError as e:
+            raise RetryableError(str(e)) from e
+        except (anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError) as e:
+            raise RetryableError(str(e), _retry_after(e)) from e
+        return response.content[0].text
+
+
+class FakeProvider(Provider):
+    """
+    Answers without a network, for load tests and offline development:
+    after `latency` seconds (plus up to `jitter`), with a response that
+    only depends on the prompt, and failing with a retryable error at
+    `error_rate`. The delays and failures come from a seeded generator, so
+    runs repeat.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency: float = float(os.getenv('LL_FAKE_LLM_LATENCY', 0.5)),
+                 jitter: float = float(os.getenv('LL_FAKE_LLM_JITTER', 0)),
+                 error_rate: float = float(os.getenv('LL_FAKE_LLM_ERROR_RATE', 0)),
+                 respond: Optional[Callable[[str, str], str]] = None, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.respond = respond or self.echo
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def echo(model: str, prompt: str) -> str:
+        return json.dumps({'model': model, 'prompt': hashlib.md5(prompt.encode('utf-8')).hexdigest()})
+
+    def _draw(self) -> Tuple[float, bool]:
+        with self._lock:
+            return self.latency + self.random.uniform(0, self.jitter), self.random.random() < self.error_rate
+
+    def complete(self, model, prompt, max_tokens, temperature, timeout):
+        delay, failed = self._draw()
+        time.sleep(min(delay, timeout))
+        return self._answer(model, prompt, delay > timeout, failed)
+
+    async def complete_async(self, model, prompt, max_tokens, temperature, timeout):
+        delay, failed = self._draw()
+        await asyncio.sleep(min(delay, timeout))
+        return self._answer(model, prompt, delay > timeout, failed)
+
+    def _answer(self, model: str, prompt: str, timed_out: bool, failed: bool) -> str:
+        if timed_out:
+            raise RetryableError(f"Fake {model} timed out")
+        if failed:
+            raise RetryableError(f"Fake {model} rate limited")
+        return self.respond(model, prompt)
+
+
+class LLMClient:
+    """
+    One model of one provider, shared by all threads of the process.
+    Requests wait for the per-minute request and token budgets (token
+    buckets) and for one of `concurrency` slots, and are retried with
+    exponential backoff and full jitter when the provider asks to slow
+    down. Waiting is bounded by the current deadline.
+
+    The limits are per process: with several gunicorn workers, configure
+    each for its share of the account's limits. complete_async waits the
+    same way on the event loop, its slots are an asyncio.Semaphore.
+    """
+
+    def __init__(self, provider: Provider, model: str, requests_per_minute: float = 0,
+                 tokens_per_minute: float = 0, concurrency: int = 8, max_retries: int = 3,
+                 backoff: float = 1.0, max_backoff: float = 20.0):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self._async_slots = None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.random = random.Random()
+        self.counts = {'requests': 0, 'retries': 0, 'errors': 0, 'in_flight': 0}
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] += n
+
+    def _wait_for(self, acquire: Callable[[float], bool], what: str):
+        start = time.monotonic()
+        if not acquire(deadline.timeout(math.inf)):
+            deadline.check()
+            raise deadline.DeadlineExceeded(f"No {what} for {self.provider.name}/{self.model} before the deadline")
+        with self._lock:
+            self.waited += time.monotonic() - start
+
+    async def _await_for(self, acquire: Callable[[float], Awaitable[bool]], what: str):
+        start = time.monotonic()
+        if not await acquire(deadline.timeout(math.inf)):
+            deadline.check()
+            raise deadline.DeadlineExceeded(f"No {what} for {self.provider.name}/{self.model} before the deadline")
+        with self._lock:
+            self.waited += time.monotonic() - start
+
+    def _retry_delay(self, e: RetryableError, attempt: int) -> float:
+        """Seconds to wait before retrying after `e`, raising it when there is no retry left."""
+        # A timeout shortened by the deadline is not retried
+        deadline.check()
+        if attempt == self.max_retries:
+            self._count('errors')
+            raise e
+        delay = max(e.retry_after or 0, self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+        log.warning(f"{self.provider.name}/{self.model}: {e}, retrying in {delay:.1f}s")
+        self._count('retries')
+        if delay >= deadline.timeout(math.inf):
+            raise deadline.DeadlineExceeded(f"Retry of {self.provider.name}/{self.model} would miss the deadline")
+        return delay
+
+    @timing.timed('llm')
+    def complete(self, prompt: str, max_tokens: Optional[int] = None, temperature: float = 0) -> str:
+        # Not started, or cut short, when the request's deadline has passed
+        deadline.check()
+        cost = estimate_tokens(prompt) + (max_tokens or 0)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for(lambda timeout: self.requests.acquire(1, timeout), 'request budget')
+            self._wait_for(lambda timeout: self.tokens.acquire(cost, timeout), 'token budget')
+            self._wait_for(lambda timeout: self.slots.acquire(timeout=min(timeout, threading.TIMEOUT_MAX)),
+                           'free slot')
+            self._count('requests')
+            self._count('in_flight')
+            try:
+                return self.provider.complete(self.model, prompt, max_tokens, temperature,
+                                              deadline.timeout(LLM_TIMEOUT))
+            except RetryableError as e:
+                delay = self._retry_delay(e, attempt)
+            except Exception:
+                self._count('errors')
+                raise
+            finally:
+                self._count('in_flight', -1)
+                self.slots.release()
+            time.sleep(delay)
+
+    def _slots_async(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_slots is None or self._async_slots[0] is not loop:
+                self._async_slots = (loop, asyncio.Semaphore(self.concurrency))
+            return self._async_slots[1]
+
+    @timing.timed('llm')
+    async def complete_async(self, prompt: str, max_tokens: Optional[int] = None, temperature: float = 0) -> str:
+        deadline.check()
+        cost = estimate_tokens(prompt) + (max_tokens or 0)
+        slots = self._slots_async()
+        for attempt in range(self.max_retries + 1):
+            await self._await_for(lambda timeout: self.requests.acquire_async(1, timeout), 'request budget')
+            await self._await_for(lambda timeout: self.tokens.acquire_async(cost, timeout), 'token budget')
+            await self._await_for(lambda timeout: _acquire_async(slots, timeout), 'free slot')
+            self._count('requests')
+            self._count('in_flight')
+            try:
+                return await self.provider.complete_async(self.model, prompt, max_tokens, temperature,
+                                                     deadline.timeout(LLM_TIMEOUT))
+            except RetryableError as e:
+                delay = self._retry_delay(e, attempt)
+            except Exception:
+                self._count('errors')
+                raise
+            finally:
+                self._count('in_flight', -1)
+                slots.release()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'provider': self.provider.name, 'model': self.model, **self.counts,
+                    'waited_seconds': round(self.waited, 3)}
+
+
+async def _acquire_async(semaphore: asyncio.Semaphore, timeout: float) -> bool:
+    """
+    Whether a permit of `semaphore` was acquired within `timeout`. An
+    acquire given up on, on timeout or when the caller is cancelled, may
+    still complete; its permit is then released again instead of leaking.
+    """
+    acquire = asyncio.ensure_future(semaphore.acquire())
+
+    def give_back(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None:
+            semaphore.release()
+
+    gave_up = True
+    try:
+        await asyncio.wait({acquire}, timeout=None if timeout == math.inf else timeout)
+        gave_up = not acquire.done()
+    finally:
+        if gave_up:
+            acquire.cancel()
+            acquire.add_done_callback(give_back)
+    return not gave_up and acquire.result()
+
+
+PROVIDERS = {'openai': OpenAIProvider, 'anthropic': AnthropicProvider, 'fake': FakeProvider}
+
+# Model used for regular and for fast calls, per provider
+MODELS = {
+    'openai': ('gpt-4o-2024-08-06', 'gpt-3.5-turbo-0125'),
+    'anthropic': ('claude-3-5-sonnet-20241022', 'claude-3-5-haiku-20241022'),
+    'fake': ('fake', 'fake-fast'),
+}
+
+# Requests per minute, tokens per minute and concurrent requests per model, 0 is unlimited.
+# Rate limits depend on the account's usage tier, so they are only enforced
+# when set with LL_LLM_<PROVIDER>_RPM and _TPM.
+LIMITS = {
+    'openai': (0, 0, 8),
+    'anthropic': (0, 0, 4),
+    'fake': (0, 0, 64),
+}
+
+_providers: Dict[str, Provider] = {}
+_clients: Dict[Tuple[str, str], LLMClient] = {}
+_lock = threading.Lock()
+
+
+def _limit(provider: str, name: str, default: float) -> float:
+    return float(os.getenv(f'LL_LLM_{provider.upper()}_{name}', default))
+
+
+def client(fast: bool = False, provider: Optional[str] = None, model: Optional[str] = None) -> LLMClient:
+    """
+    The client for `model` of `provider`, by default LL_LLM_PROVIDER
+    (openai) and its regular or fast model. Limits are read from
+    LL_LLM_<PROVIDER>_RPM, _TPM and _CONCURRENCY.
+    """
+    provider = provider or os.getenv('LL_LLM_PROVIDER', 'openai')
+    model = model or MODELS[provider][1 if fast else 0]
+    with _lock:
+        if (provider, model) not in _clients:
+            if provider not in _providers:
+                _providers[provider] = PROVIDERS[provider]()
+            rpm, tpm, concurrency = LIMITS[provider]
+            _clients[provider, model] = LLMClient(
+                _providers[provider], model,
+                requests_per_minute=_limit(provider, 'RPM', rpm),
+                tokens_per_minute=_limit(provider, 'TPM', tpm),
+                concurrency=int(_limit(provider, 'CONCURRENCY', concurrency)))
+        return _clients[provider, model]
+
+
+def complete(prompt: str, fast: bool = False, **kwargs) -> str:
+    return client(fast).complete(prompt, **kwargs)
+
+
+async def complete_async(prompt: str, fast: bool = False, **kwargs) -> str:
+    return await client(fast).complete_async(prompt, **kwargs)
+
+
+def stats():
+    with _lock:
+        return [c.stats() for c in _clients.values()]
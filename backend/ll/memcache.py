@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+MiB = 1024 * 1024
+
+# Per namespace: (max bytes, ttl seconds), overridable with
+# LL_L1_<NAMESPACE>_BYTES and LL_L1_<NAMESPACE>_TTL
+L1_DEFAULTS = {
+    'pages': (64 * MiB, 3600),
+    'metadata': (16 * MiB, 24 * 3600),
+    'snippets': (16 * MiB, 24 * 3600),
+}
+
+_MISSING = object()
+
+
+def sizeof(value: Any) -> int:
+    """Approximate memory held by a cached value."""
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value) + len(json.dumps(value, default=str))
+
+
+class MemoryCache:
+    """
+    In-process LRU cache bounded by the bytes its values take, not by the
+    number of entries, with a TTL after which entries are dropped.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl: float):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[Any, int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+_tiers: Dict[str, MemoryCache] = {}
+_tiers_lock = threading.Lock()
+
+
+def memory_cache(namespace: str) -> MemoryCache:
+    """The process-wide L1 tier for a namespace, created on first use."""
+    with _tiers_lock:
+        if namespace not in _tiers:
+            max_bytes, ttl = L1_DEFAULTS.get(namespace, (16 * MiB, 3600))
+            prefix = f'LL_L1_{namespace.upper()}'
+            _tiers[namespace] = MemoryCache(namespace,
+                                            int(os.getenv(f'{prefix}_BYTES', max_bytes)),
+                                            float(os.getenv(f'{prefix}_TTL', ttl)))
+        return _tiers[namespace]
+
+
+def memory_stats() -> Dict[str, Dict[str, Any]]:
+    with _tiers_lock:
+        return {name: tier.stats() for name, tier in _tiers.items()}
@@ -1,8 +1,9 @@
 from ll.classifiers import *
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict
+from ll.deadline import AsyncDeadlineMap, Deadline, DeadlineMap, PartialResults, \
+    gather_until_deadline, map_until_deadline
+from operator import itemgetter
+from typing import List, Dict, Optional
 import logging
-from threading import Lock
 
 log = logging.getLogger("metadata")
 
@@ -10,70 +11,49 @@ class MetadataEnricher:
     def __init__(self, web_page_cache):
         self.web_page_cache = web_page_cache
 
-    def enrich(self, serp_data: List[Dict]) -> List[Dict]:
+    def enrich(self, serp_data: List[Dict], deadline: Optional[Deadline] = None) -> PartialResults:
         """
         Enrich search results by fetching web pages and inferring metadata in parallel.
         
         Args:
             serp_data: List of search result dictionaries containing url, title, and description
+            deadline: Results not finished by then are returned as pending
             
         Returns:
-            List of enriched metadata
+            List of enriched metadata, with the URLs still in progress in .pending
         """
-        # Thread-safe counters using Lock
-        
-        def process_single_result(result: Dict) -> Dict:
-            """Process a single search result and generate metadata."""
-            metadata_part = {
-                'url': (url := result['url'])
-            }
-            title = result['title']
-            description = result['description']
-            
-            try:
-                content = self.web_page_cache.fetch_text(url)
-                
-                if content:
-                    content = content[:5000]
-                else:
-                    content = f"Title: {title}\nDescription: {description}"
-                
-                response = content_based_gpt_metadata_inference(url, content)
-                if response:
-                    metadata_fields = [
-                        'assesses', 'teaches', 'educational_level', 
-                        'educational_role', 'educational_use', 
-                        'learning_resource_type'
-                    ]
-                    for field in metadata_fields:
-                        metadata_part[field] = response[field]
-                    return metadata_part
-                    
-            except Exception as e:
-                logging.error(f"Error processing {url}: {str(e)}")
-                return None
-                
-            return None
+        return map_until_deadline(self.enrich_result, serp_data[:2], itemgetter('url'), deadline)
+
+    def stream(self, serp_data: List[Dict], deadline: Optional[Deadline] = None) -> DeadlineMap:
+        """Like enrich, yielding each result as soon as it is done."""
+        return DeadlineMap(self.enrich_result, serp_data[:2], itemgetter('url'), deadline)
+
+    async def enrich_async(self, serp_data: List[Dict], deadline: Optional[Deadline] = None) -> PartialResults:
+        """enrich on the event loop of the ASGI app."""
+        return await gather_until_deadline(self.enrich_result_async, serp_data[:2], itemgetter('url'), deadline)
+
+    async def stream_async(self, serp_data: List[Dict], deadline: Optional[Deadline] = None) -> AsyncDeadlineMap:
+        """stream on the event loop of the ASGI app."""
+        return AsyncDeadlineMap(self.enrich_result_async, serp_data[:2], itemgetter('url'), deadline)
+
+    def enrich_result(self, result: Dict) -> Optional[Dict]:
+        """Process a single search result and generate metadata."""
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, self.web_page_cache.fetch_text(url))
+            return metadata_part(url, content_based_gpt_metadata_inference(url, content))
+        return None
+
+    async def enrich_result_async(self, result: Dict) -> Optional[Dict]:
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, await self.web_page_cache.fetch_text_async(url))
+            return metadata_part(url, await content_based_gpt_metadata_inference_async(url, content))
+        return None
 
-        metadatas = []
-        # Use ThreadPoolExecutor since this is I/O bound
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Submit all tasks
-            future_to_url = {
-                executor.submit(process_single_result, result): result['url']
-                for result in serp_data[:2]
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    metadata = future.result()
-                    if metadata:
-                        metadatas.append(metadata)
-                except Exception as e:
-                    logging.error(f"Error processing future for {url}: {str(e)}")
-                    continue
 
-        # Calculate and print hit ratio
-        return metadatas
\ No newline at end of file
+def metadata_part(url: str, metadata: Optional[Dict]) -> Optional[Dict]:
+    """The metadata fields of an LLM response for the result at `url`, None without a response."""
+    if not metadata:
+        return None
+    return {'url': url} | {field: metadata[field] for field in METADATA_FIELDS}
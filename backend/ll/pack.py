@@ -0,0 +1,123 @@
+import argparse
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ll.store import hash
+
+log = logging.getLogger("pack")
+
+# A pack is two files: <name>.pack with the UTF-8 page texts back to back,
+# and <name>.idx.npy with one (md5 digest, offset, length) record per page,
+# sorted by digest. Both are memory-mapped, a lookup is a binary search in
+# the index and a slice of the data file.
+INDEX_DTYPE = np.dtype([('key', 'S16'), ('offset', '<u8'), ('length', '<u4')])
+
+LFS_POINTER = b'version https://git-lfs'
+
+
+def index_path(path: Path) -> Path:
+    return Path(path).with_suffix('.idx.npy')
+
+
+class PagePack:
+    """Read-only, memory-mapped page texts keyed by the md5 of their URL."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.index = np.load(index_path(self.path), mmap_mode='r', allow_pickle=False)
+        self.keys = self.index['key']
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_hashed(self, hkey: str) -> Optional[str]:
+        key = bytes.fromhex(hkey)
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        offset, length = int(self.index['offset'][i]), int(self.index['length'][i])
+        return self.data[offset:offset + length].decode('utf-8')
+
+    def get(self, url: str) -> Optional[str]:
+        return self.get_hashed(hash(url))
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+
+def open_pack(path: Optional[Path] = None) -> Optional[PagePack]:
+    """The page pack at LL_PAGE_PACK (data/webpage_cache.pack), None when it has not been built."""
+    path = Path(path or os.getenv('LL_PAGE_PACK', 'data/webpage_cache.pack'))
+    if not path.exists() or not index_path(path).exists():
+        return None
+    return PagePack(path)
+
+
+def _page_text(raw: bytes) -> str:
+    text = raw.decode('utf-8', errors='replace')
+    if text.lstrip().startswith('<'):
+        # Rendered HTML rather than text: keep what extraction would return
+        import trafilatura
+        return trafilatura.extract(text) or ""
+    return text
+
+
+def build_pack(source: Path = Path('data/webpage_cache'), path: Path = Path('data/webpage_cache.pack'),
+               filename: str = 'playwright.txt') -> int:
+    """
+    Pack <source>/<md5 of url>/<filename> into `path`. Both files are
+    written aside and moved into place when complete, packs that are
+    already open keep reading the files they mapped.
+    """
+    source, path = Path(source), Path(path)
+    page_dirs = sorted(p for p in source.iterdir() if p.is_dir() and len(p.name) == 32)
+    records = []
+    skipped = 0
+    tmp_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as out:
+        for page_dir in page_dirs:
+            try:
+                raw = (page_dir / filename).read_bytes()
+            except FileNotFoundError:
+                continue
+            if raw.startswith(LFS_POINTER):
+                skipped += 1
+                continue
+            data = _page_text(raw).encode('utf-8')
+            if not data:
+                # Nothing was rendered, leave the page to the network
+                continue
+            records.append((bytes.fromhex(page_dir.name), out.tell(), len(data)))
+            out.write(data)
+    if skipped:
+        log.warning(f"Skipped {skipped} Git LFS pointers, run `git lfs pull` to pack them")
+
+    index = np.array(records, dtype=INDEX_DTYPE)
+    index.sort(order='key')
+    tmp_index = Path(f'{index_path(path)}.{os.getpid()}.tmp')
+    with open(tmp_index, 'wb') as f:
+        np.save(f, index, allow_pickle=False)
+    os.replace(tmp_path, path)
+    os.replace(tmp_index, index_path(path))
+    return len(index)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pack the pre-rendered page corpus")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Build the pack from a directory per page")
+    build.add_argument('--source', type=Path, default=Path('data/webpage_cache'))
+    build.add_argument('--output', type=Path, default=Path('data/webpage_cache.pack'))
+    build.add_argument('--filename', default='playwright.txt')
+    args = parser.parse_args()
+    if args.command == 'build':
+        print(f"Packed {build_pack(args.source, args.output, args.filename)} pages into {args.output}")
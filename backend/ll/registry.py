@@ -0,0 +1,141 @@
+import logging
+import os
+import pickle
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+log = logging.getLogger("registry")
+
+
+def load_pickle(path: Path) -> Any:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class LoadedModel:
+    """A model object together with the file state it was loaded from."""
+
+    def __init__(self, model: Any, mtime: float, load_seconds: float, memory_bytes: Optional[int]):
+        self.model = model
+        self.mtime = mtime
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.loaded_at = time.time()
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the classifier models.
+
+    Each model is loaded once on first use (or on `warm`) and kept for the
+    life of the worker. When the file on disk changes, the new version is
+    loaded next to the old one and swapped in under a lock, so concurrent
+    callers always see one complete model.
+
+    Memory per model is only measured with `measure_memory`
+    (LL_MEASURE_MODEL_MEMORY=1) or while tracemalloc is already tracing,
+    e.g. in a benchmark: tracing slows every allocation. Once turned on
+    for a measurement it stays on, as stopping it is global to the
+    process. Loads running at the same time count towards each other.
+    """
+
+    def __init__(self, root: str = 'models', check_interval: float = 5.0,
+                 measure_memory: bool = os.getenv('LL_MEASURE_MODEL_MEMORY') == '1'):
+        self.root = Path(root)
+        self.check_interval = check_interval
+        self.measure_memory = measure_memory
+        self._paths: Dict[str, Path] = {}
+        self._loaders: Dict[str, Callable[[Path], Any]] = {}
+        self._models: Dict[str, LoadedModel] = {}
+        self._last_check: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, filename: str,
+                 loader: Callable[[Path], Any] = load_pickle):
+        self._paths[name] = self.root / filename
+        self._loaders[name] = loader
+
+    def names(self):
+        return [name for name in self._paths if self.available(name)]
+
+    def path(self, name: str) -> Path:
+        return self._paths[name]
+
+    def available(self, name: str) -> bool:
+        return name in self._models or self._paths[name].exists()
+
+    def _mtime(self, name: str) -> float:
+        return os.stat(self._paths[name]).st_mtime
+
+    def _load(self, name: str) -> LoadedModel:
+        path = self._paths[name]
+        mtime = self._mtime(name)
+        if self.measure_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        measuring = tracemalloc.is_tracing()
+        before = tracemalloc.get_traced_memory()[0] if measuring else 0
+        start = time.perf_counter()
+        model = self._loaders[name](path)
+        load_seconds = time.perf_counter() - start
+        memory_bytes = max(tracemalloc.get_traced_memory()[0] - before, 0) if measuring else None
+        loaded = LoadedModel(model, mtime, load_seconds, memory_bytes)
+        log.info(f"Loaded model {name} from {path} in {load_seconds * 1000:.1f}ms"
+                 + (f" ({memory_bytes / 1024:.0f} KiB)" if memory_bytes is not None else ""))
+        return loaded
+
+    def _is_stale(self, name: str, loaded: LoadedModel) -> bool:
+        now = time.monotonic()
+        if now - self._last_check.get(name, 0) < self.check_interval:
+            return False
+        self._last_check[name] = now
+        try:
+            return self._mtime(name) != loaded.mtime
+        except OSError:
+            return False
+
+    def get(self, name: str) -> Any:
+        loaded = self._models.get(name)
+        if loaded is not None and not self._is_stale(name, loaded):
+            return loaded.model
+        with self._lock:
+            current = self._models.get(name)
+            if current is not None and current is not loaded:
+                # Another thread loaded or reloaded it while we waited
+                return current.model
+            try:
+                fresh = self._load(name)
+            except Exception as e:
+                if current is None:
+                    raise
+                log.error(f"Reloading model {name} failed, keeping previous version", exc_info=e)
+                return current.model
+            self._models[name] = fresh
+            self._last_check[name] = time.monotonic()
+            return fresh.model
+
+    def reload(self, name: Optional[str] = None):
+        """Force a reload of one or all models, swapping each in atomically."""
+        for n in ([name] if name else self.names()):
+            fresh = self._load(n)
+            with self._lock:
+                self._models[n] = fresh
+                self._last_check[n] = time.monotonic()
+
+    def warm(self):
+        for name in self.names():
+            self.get(name)
+        return self.stats()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            name: {
+                'path': str(self._paths[name]),
+                'load_seconds': loaded.load_seconds,
+                'memory_bytes': loaded.memory_bytes,
+                'loaded_at': loaded.loaded_at,
+            }
+            for name, loaded in self._models.items()
+        }
@@ -1,3 +1,5 @@
+import os
+
 from ll import init_webapp
 
 app = init_webapp()
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single-flight still applies
+    fcntl = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the
+    computation, callers arriving while it is in flight wait for its result
+    (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop."""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            # Shielded, a waiter giving up does not cancel the call for the others
+            return await asyncio.shield(call)
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        # Retrieved here as well, in case no one else was waiting for it
+        call.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive advisory lock on `path`, held across processes (gunicorn workers)."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AtomicFile:
+    """
+    Binary file written through a temporary file, which replaces `path`
+    when the with block completes and is removed when it raises. `size`
+    counts the bytes written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp_path = Path(f'{path}.{os.getpid()}.{threading.get_ident()}.tmp')
+        self.size = 0
+
+    def __enter__(self) -> 'AtomicFile':
+        self.file = open(self.tmp_path, 'wb')
+        return self
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.file.close()
+            if exc_type is None:
+                os.replace(self.tmp_path, self.path)
+        except BaseException:
+            self.tmp_path.unlink(missing_ok=True)
+            raise
+        if exc_type is not None:
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
+def atomic_write(path: Path, data) -> int:
+    """
+    Write through a temporary file so readers never see a partial file.
+    `data` is bytes, text, or an iterable of byte chunks written as they
+    come; when that fails no file is left behind. Returns the bytes written.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, bytes):
+        data = [data]
+    with AtomicFile(path) as f:
+        for chunk in data:
+            f.write(chunk)
+    return f.size
@@ -1,7 +1,14 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict
+import asyncio
+from functools import partial
+from operator import itemgetter
+from typing import List, Dict, Optional
 import logging
-from ll.classifiers import content_based_adaptive_snippet, QuestionGenerator, RelevanceMatcher, classify_query_type
+from ll.deadline import AsyncDeadlineMap, Deadline, DeadlineMap, PartialResults, gather_until_deadline, \
+    map_until_deadline
+from ll.classifiers import content_based_adaptive_snippet, content_based_adaptive_snippet_async, QuestionGenerator, \
+    RelevanceMatcher, classify_query_type, page_content, result_errors
+
+log = logging.getLogger("snippets")
 
 class SnippetEnhancer:
     def __init__(self, web_page_cache):
@@ -10,59 +17,58 @@ class SnippetEnhancer:
         self.web_page_cache = web_page_cache
         
 
-    def enhance(self, serp_data: List[Dict], query: str) -> List[Dict]:
-        def process_single_result(result: Dict) -> Dict:
-            """Process a single search result and generate enhanced snippet."""
-            summary_part = {
-                'url': (url := result['url']),
-                'title': (title := result['title']),
-                'description': (description := result['description'])
-            }
-            
-            try:
-                content = self.web_page_cache.fetch_text(url)
-                if content:
-                    content = content[:5000]
-                else:
-                    content = f"Title: {title}\nDescription: {description}"
-                    
-                typed_terms = classify_query_type(query)
-                dimensions = self.relevance_matcher.get_top_dimensions(typed_terms)
-                questions = self.question_generator.\
-                    generate_questions(typed_terms, [d[0] for d in dimensions])
-                snippet = content_based_adaptive_snippet(url, content, questions)
-                if snippet:
-                    summary_part['enhanced_snippet'] = \
-                      "<br/> ".join([qna(s) for s in snippet]) if type(snippet) == list else snippet
-                    return summary_part
-                
-            except Exception as e:
-                logging.error(f"Error processing {url}: {str(e)}")
-                return None
-                
-            return None
+    def enhance(self, serp_data: List[Dict], query: str, deadline: Optional[Deadline] = None) -> PartialResults:
+        return map_until_deadline(partial(self.enhance_result, query=query), serp_data[:2], itemgetter('url'), deadline)
+
+    def stream(self, serp_data: List[Dict], query: str, deadline: Optional[Deadline] = None) -> DeadlineMap:
+        """Like enhance, yielding each result as soon as it is done."""
+        return DeadlineMap(partial(self.enhance_result, query=query), serp_data[:2], itemgetter('url'), deadline)
+
+    async def enhance_async(self, serp_data: List[Dict], query: str,
+                            deadline: Optional[Deadline] = None) -> PartialResults:
+        """enhance on the event loop of the ASGI app, deriving the questions once."""
+        questions = await asyncio.to_thread(self.questions, query)
+        return await gather_until_deadline(partial(self.enhance_result_async, questions=questions),
+                                           serp_data[:2], itemgetter('url'), deadline)
+
+    async def stream_async(self, serp_data: List[Dict], query: str,
+                           deadline: Optional[Deadline] = None) -> AsyncDeadlineMap:
+        """stream on the event loop of the ASGI app, deriving the questions once."""
+        questions = await asyncio.to_thread(self.questions, query)
+        return AsyncDeadlineMap(partial(self.enhance_result_async, questions=questions),
+                                serp_data[:2], itemgetter('url'), deadline)
+
+    def questions(self, query: str) -> List[str]:
+        """Questions the snippet of every result of a query answers."""
+        typed_terms = classify_query_type(query)
+        dimensions = self.relevance_matcher.get_top_dimensions(typed_terms)
+        return self.question_generator.\
+            generate_questions(typed_terms, [d[0] for d in dimensions])
+
+    def enhance_result(self, result: Dict, query: str) -> Optional[Dict]:
+        """Process a single search result and generate enhanced snippet."""
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, self.web_page_cache.fetch_text(url))
+            return snippet_part(summary_part(result), content_based_adaptive_snippet(url, content, self.questions(query)))
+        return None
+
+    async def enhance_result_async(self, result: Dict, questions: List[str]) -> Optional[Dict]:
+        url = result['url']
+        with result_errors(url, log):
+            content = page_content(result, await self.web_page_cache.fetch_text_async(url))
+            return snippet_part(summary_part(result), await content_based_adaptive_snippet_async(url, content, questions))
+        return None
+
 
-        # Use ThreadPoolExecutor since this is I/O bound
-        snippets = []
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Submit all tasks
-            future_to_url = {
-                executor.submit(process_single_result, result): result['url']
-                for result in serp_data[:2]
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    snippet = future.result()
-                    if snippet:
-                        snippets.append(snippet)
-                except Exception as e:
-                    logging.error(f"Error processing future for {url}: {str(e)}")
-                    continue
+def summary_part(result: Dict) -> Dict:
+  return {'url': result['url'], 'title': result['title'], 'description': result['description']}
 
-        return snippets
+def snippet_part(summary_part: Dict, snippet) -> Optional[Dict]:
+  if not snippet:
+    return None
+  return {**summary_part,
+          'enhanced_snippet': "<br/> ".join([qna(s) for s in snippet]) if type(snippet) == list else snippet}
 
 def read_answer(a):
   if type(a) == dict:
@@ -77,4 +83,4 @@ def qna(a):
     return f"Q: {a['question']}<br/>A: <i>{a['answer']}</i>"
   else:
     return str(a)
-    
\ No newline at end of file
+    
@@ -0,0 +1,405 @@
+import abc
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ll.compression import Dictionaries, train_dictionary
+from ll.singleflight import atomic_write
+
+log = logging.getLogger("store")
+
+# (value, metadata)
+Entry = Tuple[Any, Optional[Dict[str, Any]]]
+
+# Metadata key for bytes an entry holds outside the store (page bodies),
+# counted towards its size for eviction
+BODY_SIZE = 'body_size'
+
+
+def cache_root() -> Path:
+    return Path(os.getenv("HOME")) / '.cache' / 'LessonLens'
+
+
+_dictionaries: Dict[Path, Dictionaries] = {}
+_dictionaries_lock = threading.Lock()
+
+
+def dictionaries(directory: Optional[Path] = None) -> Dictionaries:
+    """Compression dictionaries of the cache, one instance per directory."""
+    directory = Path(directory or cache_root() / 'dictionaries')
+    with _dictionaries_lock:
+        if directory not in _dictionaries:
+            _dictionaries[directory] = Dictionaries(directory)
+        return _dictionaries[directory]
+
+
+# Cache entries are addressed by the md5 of str(key), the same hash the
+# file caches have always used for their file and directory names.
+def hash(key) -> str:
+    return hashlib.md5(str(key).encode()).hexdigest()
+
+
+class CacheStore(abc.ABC):
+    """
+    Key/value store for one cache namespace. Values are JSON-serializable,
+    each entry can carry a metadata dict next to its value.
+    """
+
+    # Whether the store keeps an access index and implements usage() and evict()
+    evictable = False
+
+    @abc.abstractmethod
+    def get_entries(self, hkeys: List[str]) -> Dict[str, Entry]:
+        ...
+
+    @abc.abstractmethod
+    def set_entries(self, entries: Iterable[Tuple[str, Any, Optional[Dict[str, Any]]]]):
+        ...
+
+    @abc.abstractmethod
+    def delete_entries(self, hkeys: List[str]):
+        ...
+
+    @abc.abstractmethod
+    def scan(self) -> Iterable[Tuple[str, Any, Optional[Dict[str, Any]]]]:
+        """(hashed key, value, metadata) of every entry in the namespace."""
+
+    def get_entry(self, key) -> Optional[Entry]:
+        return self.get_entries([hash(key)]).get(hash(key))
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, metadata: Optional[Dict[str, Any]] = None):
+        self.set_entries([(hash(key), value, metadata)])
+
+    def get_many(self, keys) -> Dict[Any, Any]:
+        hkeys = {hash(key): key for key in keys}
+        return {hkeys[h]: value for h, (value, _) in self.get_entries(list(hkeys)).items()}
+
+    def set_many(self, items: Dict[Any, Any]):
+        self.set_entries([(hash(key), value, None) for key, value in items.items()])
+
+    def delete(self, key):
+        self.delete_entries([hash(key)])
+
+    def __contains__(self, key) -> bool:
+        return self.get_entry(key) is not None
+
+
+class JSONFileStore(CacheStore):
+    """One <hash>.json file per entry (and <hash>.meta.json for its metadata)."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+
+    def _read(self, path: Path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def get_entries(self, hkeys):
+        entries = {}
+        for hkey in hkeys:
+            path = self.directory / f'{hkey}.json'
+            try:
+                value = self._read(path)
+            except FileNotFoundError:
+                continue
+            meta_path = self.directory / f'{hkey}.meta.json'
+            entries[hkey] = (value, self._read(meta_path) if meta_path.exists() else None)
+        return entries
+
+    def set_entries(self, entries):
+        for hkey, value, metadata in entries:
+            if metadata is not None:
+                atomic_write(self.directory / f'{hkey}.meta.json', json.dumps(metadata))
+            atomic_write(self.directory / f'{hkey}.json', json.dumps(value))
+
+    def delete_entries(self, hkeys):
+        for hkey in hkeys:
+            for suffix in ('.json', '.meta.json'):
+                (self.directory / f'{hkey}{suffix}').unlink(missing_ok=True)
+
+    def scan(self):
+        for path in sorted(self.directory.glob('*.json')):
+            if path.name.endswith('.meta.json'):
+                continue
+            for hkey, (value, metadata) in self.get_entries([path.stem]).items():
+                yield hkey, value, metadata
+
+
+class SQLiteStore(CacheStore):
+    """
+    All namespaces in one SQLite database in WAL mode: readers never block
+    the writer, and every write (including batches) is one transaction.
+
+    The table doubles as the access index for eviction: reads refresh
+    accessed_at (at most once per TOUCH_INTERVAL seconds per entry) and
+    size covers the stored value plus any BODY_SIZE from its metadata.
+
+    Values of at least COMPRESS_MIN bytes are compressed with the
+    namespace's dictionary from the dictionaries/ directory next to the
+    database (see `python -m ll.store train-dictionaries`).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB,
+            metadata TEXT,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """
+    INDEX = "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)"
+    BATCH = 500
+    TOUCH_INTERVAL = 60
+    # Eviction frees space down to this fraction of the budget, so that it
+    # does not run again on the next few writes
+    LOW_WATER = 0.9
+    COMPRESS_MIN = 256
+    evictable = True
+
+    def __init__(self, path: Path, namespace: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.namespace = namespace
+        self.dictionaries = dictionaries(self.path.parent / 'dictionaries')
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, and never one inherited across a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(self.SCHEMA)
+            conn.execute(self.INDEX)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def get_entries(self, hkeys):
+        entries = {}
+        now = time.time()
+        stale = []
+        for i in range(0, len(hkeys), self.BATCH):
+            batch = hkeys[i:i + self.BATCH]
+            rows = self._conn().execute(
+                f"SELECT key, value, metadata, accessed_at FROM entries WHERE namespace = ? "
+                f"AND key IN ({','.join('?' * len(batch))})",
+                [self.namespace, *batch])
+            for hkey, value, metadata, accessed_at in rows:
+                entries[hkey] = (json.loads(self.dictionaries.loads(value)),
+                                 json.loads(metadata) if metadata else None)
+                if now - accessed_at > self.TOUCH_INTERVAL:
+                    stale.append((now, self.namespace, hkey))
+        if stale:
+            self._conn().executemany(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", stale)
+        return entries
+
+    def set_entries(self, entries):
+        now = time.time()
+        rows = []
+        for hkey, value, metadata in entries:
+            blob = json.dumps(value).encode('utf-8')
+            if len(blob) >= self.COMPRESS_MIN:
+                blob = self.dictionaries.codec(self.namespace).compress(blob)
+            meta = json.dumps(metadata) if metadata is not None else None
+            size = len(blob) + len(meta or '') + int((metadata or {}).get(BODY_SIZE) or 0)
+            rows.append((self.namespace, hkey, blob, meta, size, now, now))
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Rewriting an entry keeps its place in the eviction order
+            conn.executemany(
+                "INSERT INTO entries (namespace, key, value, metadata, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (namespace, key) DO UPDATE SET "
+                "value = excluded.value, metadata = excluded.metadata, size = excluded.size", rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def delete_entries(self, hkeys):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?",
+                         [(self.namespace, hkey) for hkey in hkeys])
+        conn.execute('COMMIT')
+
+    def scan(self):
+        rows = self._conn().execute(
+            "SELECT key, value, metadata FROM entries WHERE namespace = ?", [self.namespace])
+        for hkey, value, metadata in rows:
+            yield hkey, json.loads(self.dictionaries.loads(value)), json.loads(metadata) if metadata else None
+
+    def usage(self):
+        """Entries and bytes per namespace, for the whole database."""
+        rows = self._conn().execute(
+            "SELECT namespace, COUNT(*), SUM(size) FROM entries GROUP BY namespace ORDER BY namespace")
+        return {namespace: {'entries': count, 'bytes': size} for namespace, count, size in rows}
+
+    def evict(self, max_bytes):
+        """
+        Delete least recently accessed entries, of any namespace, until the
+        database holds at most LOW_WATER * max_bytes. Returns the evicted
+        (namespace, hashed key) pairs so that their bodies can be removed.
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = []
+            if total > max_bytes:
+                target = total - int(max_bytes * self.LOW_WATER)
+                rows = conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed_at")
+                freed = 0
+                for namespace, hkey, size in rows:
+                    if freed >= target:
+                        break
+                    evicted.append((namespace, hkey))
+                    freed += size
+                conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", evicted)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return evicted
+
+    def vacuum(self):
+        """Give the space of deleted entries back to the file system."""
+        conn = self._conn()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+
+
+def open_store(namespace: str, backend: Optional[str] = None) -> CacheStore:
+    """The configured store (LL_CACHE_BACKEND: sqlite or file) for a namespace."""
+    backend = backend or os.getenv('LL_CACHE_BACKEND', 'sqlite')
+    if backend == 'sqlite':
+        return SQLiteStore(Path(os.getenv('LL_CACHE_DB', cache_root() / 'cache.db')), namespace)
+    elif backend == 'file':
+        return JSONFileStore(cache_root() / namespace)
+    raise ValueError(f"Unknown cache backend {backend}")
+
+
+# Migration from the file-per-key caches
+
+def migrate_file_caches(backend: str = 'sqlite', root: Optional[Path] = None) -> Dict[str, int]:
+    """
+    Import url_cache/<hash>.json and web_page_cache/<hash>/ entries into the
+    given backend. Existing files are left in place, page bodies stay where
+    they are and keep being referenced through the page manifests.
+    """
+    root = Path(root or cache_root())
+    counts = {'url_cache': 0, 'pages': 0}
+
+    store = open_store('url_cache', backend)
+    batch = []
+    for path in sorted((root / 'url_cache').glob('*.json')):
+        try:
+            with open(path, 'r') as f:
+                batch.append((path.stem, json.load(f), None))
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning(f"Skipping {path}: {e}")
+        if len(batch) >= SQLiteStore.BATCH:
+            store.set_entries(batch)
+            counts['url_cache'] += len(batch)
+            batch = []
+    store.set_entries(batch)
+    counts['url_cache'] += len(batch)
+
+    from ll.cache import WebPageCache
+    store = open_store('pages', backend)
+    batch = []
+    page_root = root / 'web_page_cache'
+    for page_dir in sorted(page_root.iterdir() if page_root.exists() else []):
+        page = WebPageCache.legacy_page(page_dir) if page_dir.is_dir() else None
+        if page is not None:
+            batch.append((page_dir.name, *page))
+        if len(batch) >= SQLiteStore.BATCH:
+            store.set_entries(batch)
+            counts['pages'] += len(batch)
+            batch = []
+    store.set_entries(batch)
+    counts['pages'] += len(batch)
+    return counts
+
+
+def train_dictionaries(namespaces=('pages', 'url_cache'), samples: int = 1000) -> Dict[str, int]:
+    """
+    Train a compression dictionary for each namespace from its current
+    values, and one for HTML page bodies. Entries written from then on (in
+    processes started afterwards) use them, older entries stay readable.
+    """
+    import itertools
+    trained = {}
+    for namespace in namespaces:
+        store = open_store(namespace)
+        if not isinstance(store, SQLiteStore):
+            continue
+        values = [json.dumps(value).encode('utf-8')
+                  for _, value, _ in itertools.islice(store.scan(), samples)]
+        zdict = train_dictionary(values)
+        if zdict:
+            dictionaries(store.path.parent / 'dictionaries').save(namespace, zdict)
+        trained[namespace] = len(zdict)
+
+    bodies = []
+    for page_dir in itertools.islice((cache_root() / 'web_page_cache').glob('*/'), samples * 4):
+        for path in page_dir.glob('content.html*'):
+            with (dictionaries().open(path) if path.suffix == '.z' else open(path, 'rb')) as f:
+                bodies.append(f.read())
+        if len(bodies) >= samples:
+            break
+    zdict = train_dictionary(bodies)
+    if zdict:
+        dictionaries().save('html', zdict)
+    trained['html'] = len(zdict)
+    return trained
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="LessonLens cache store tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help="Import the file caches into the configured backend")
+    migrate.add_argument('--backend', default='sqlite')
+    commands.add_parser('report', help="Entries and bytes used per namespace")
+    evict = commands.add_parser('evict', help="Evict least recently used entries down to a byte budget")
+    evict.add_argument('--max-bytes', type=int, default=int(os.getenv('LL_CACHE_MAX_BYTES', 0)))
+    commands.add_parser('compact', help="Drop raw page bodies whose text has been extracted")
+    train = commands.add_parser('train-dictionaries', help="Train compression dictionaries from cached entries")
+    train.add_argument('--samples', type=int, default=1000)
+    args = parser.parse_args()
+    if args.command in ('report', 'evict') and not open_store('pages').evictable:
+        parser.error(f"{args.command} needs the sqlite backend, LL_CACHE_BACKEND is "
+                     f"{os.getenv('LL_CACHE_BACKEND', 'sqlite')}")
+    if args.command == 'migrate':
+        print(migrate_file_caches(args.backend))
+    elif args.command == 'report':
+        for namespace, usage in open_store('pages').usage().items():
+            print(f"{namespace:<16} {usage['entries']:>8} entries {usage['bytes'] / 2**20:>10.1f} MiB")
+    elif args.command == 'evict':
+        if not args.max_bytes:
+            parser.error("evict needs --max-bytes or LL_CACHE_MAX_BYTES")
+        from ll.cache import evict
+        print(f"Evicted {evict(args.max_bytes)} entries")
+    elif args.command == 'compact':
+        from ll.cache import compact
+        print(f"Compacted {compact()} pages")
+    elif args.command == 'train-dictionaries':
+        print(train_dictionaries(samples=args.samples))
@@ -51,7 +51,7 @@ class Summarizer:
           return None
 
     def summarize_fast(self, serp_data):
-        summary = [extract_general_attributes(result) for result in serp_data]
+        summary = extract_general_attributes_batch(serp_data)
         attr_importances = calculate_attribute_importance(summary)
         out = {'query_type': None, 
                'tagged_urls': summary, 
@@ -128,3 +128,10 @@ def extract_general_attributes(result: dict) -> dict:
         'audience': audience_classifier(url, title, description),
         'source_institution_type': source_classifier(url, title, description)
     }
+
+def extract_general_attributes_batch(serp_data: list) -> list:
+    """Extract general attributes for a whole SERP with one pass per classifier"""
+    return [
+        {'url': result.get("url", ""), **attributes}
+        for result, attributes in zip(serp_data, classify_batch(serp_data))
+    ]
@@ -0,0 +1,175 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, as Prometheus exposes them."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """(cumulative count per bucket, +Inf last), sum and count of the observations."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+
+class Timings:
+    """Time a request spent per stage, summed over the stage's spans, for its Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        # Spans of the request's worker threads and tasks add up here as well
+        with self._lock:
+            total = self.stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def header(self) -> str:
+        with self._lock:
+            stages = [f'{stage};dur={seconds * 1000:.1f};desc="{count}x"'
+                      for stage, (seconds, count) in self.stages.items()]
+        return ', '.join(stages + [f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}'])
+
+
+# Histograms of the spans by stage and of the requests by endpoint, per process
+stage_seconds: Dict[str, Histogram] = {}
+request_seconds: Dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+# The timings of the request being served, seen by the spans further down
+_current: contextvars.ContextVar = contextvars.ContextVar('timings', default=None)
+
+
+def _observe(histograms: Dict[str, Histogram], label: str, seconds: float):
+    with _lock:
+        if label not in histograms:
+            histograms[label] = Histogram()
+        histogram = histograms[label]
+    histogram.observe(seconds)
+
+
+def current() -> Optional[Timings]:
+    return _current.get()
+
+
+def begin() -> contextvars.Token:
+    """Start recording the timings of a request, in the current context."""
+    return _current.set(Timings())
+
+
+def end(token: contextvars.Token, endpoint: str) -> Timings:
+    timings = _current.get()
+    _current.reset(token)
+    _observe(request_seconds, endpoint, time.perf_counter() - timings.started)
+    return timings
+
+
+def record(stage: str, seconds: float):
+    _observe(stage_seconds, stage, seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the with block as one span of `stage`, whether it returns or raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator timing every call of a function, or of a coroutine function, as a span of `stage`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_coroutine(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return timed_coroutine
+
+        @functools.wraps(fn)
+        def timed_function(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return timed_function
+    return decorator
+
+
+# Prometheus text format
+
+Sample = Tuple[Dict[str, Any], float]
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _histogram_lines(name: str, label: str, histograms: Dict[str, Histogram]) -> List[str]:
+    with _lock:
+        histograms = dict(histograms)
+    lines = []
+    for value, histogram in sorted(histograms.items()):
+        cumulative, total, count = histogram.snapshot()
+        for bound, bucket_count in zip([*histogram.buckets, '+Inf'], cumulative):
+            lines.append(f'{name}_bucket{_labels({label: value, "le": bound})} {bucket_count}')
+        lines.append(f'{name}_sum{_labels({label: value})} {total}')
+        lines.append(f'{name}_count{_labels({label: value})} {count}')
+    return lines
+
+
+def prometheus(families: Iterable[Tuple[str, str, str, List[Sample]]] = ()) -> str:
+    """
+    The stage and request histograms, followed by `families` of
+    (name, 'counter' or 'gauge', help, [(labels, value)]), in the
+    Prometheus text format.
+    """
+    lines = [
+        '# HELP ll_stage_seconds Time spent in each stage of serving requests.',
+        '# TYPE ll_stage_seconds histogram',
+        *_histogram_lines('ll_stage_seconds', 'stage', stage_seconds),
+        '# HELP ll_request_seconds Time until the response of each endpoint was ready.',
+        '# TYPE ll_request_seconds histogram',
+        *_histogram_lines('ll_request_seconds', 'endpoint', request_seconds),
+    ]
+    for name, kind, help, samples in families:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{_labels(labels)} {value}' for labels, value in samples)
+    return '\n'.join(lines) + '\n'
@@ -6,7 +6,7 @@ from ll import init_webapp
 
 assert client
 
-@pytest.fixture(scope='module')
+@pytest.fixture(scope='session')
 def app(request):
     app = init_webapp(test=True)
     ctx = app.app_context()
@@ -0,0 +1,51 @@
+from flask import url_for
+
+from ll import classifiers
+from ll.api import analyzer, pages, snippets, summarizer
+from ll.cache import URLLevelCache
+from ll.classifiers import METADATA_FIELDS
+from ll.store import SQLiteStore
+
+
+def test_analyze_fetches_each_page_once_and_fills_both_caches(client, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    url_cache = URLLevelCache(store=SQLiteStore(tmp_path / 'cache.db', 'url_cache'))
+    snippet_cache = URLLevelCache(store=SQLiteStore(tmp_path / 'cache.db', 'snippets'))
+    monkeypatch.setattr(classifiers, 'url_cache', url_cache)
+    monkeypatch.setattr(classifiers, 'snippet_cache', snippet_cache)
+
+    fetched, prompts = [], []
+
+    def fetch_text(url):
+        fetched.append(url)
+        return f'Text of {url}'
+
+    def analysis(content_questions):
+        prompts.append(content_questions)
+        return {'metadata': {field: [field] for field in METADATA_FIELDS},
+                'answers': [{'question': 'Q?', 'answer': 'A'}]}
+
+    monkeypatch.setattr(pages, 'fetch_text', fetch_text)
+    monkeypatch.setattr(snippets, 'questions', lambda query: ['Q?'])
+    monkeypatch.setattr(summarizer, 'summarize_fast', lambda results: {'results': len(results)})
+    monkeypatch.setattr(classifiers, 'fetch_content_based_gpt_analysis', analysis)
+    results = [{'url': f'https://example.org/{i}', 'title': f'Page {i}', 'description': ''} for i in range(2)]
+
+    response = client.post(url_for('api.analyze'), json={'results': results, 'query': 'Photosynthese'})
+    assert response.status_code == 200
+    assert response.json['summary'] == {'results': 2}
+    assert sorted(m['url'] for m in response.json['metadata']) == [r['url'] for r in results]
+    assert len(response.json['snippets']) == 2
+    assert response.json['pending'] == []
+    assert sorted(fetched) == [r['url'] for r in results]
+    assert len(prompts) == 2
+
+    # The separate endpoints are now answered from the caches the merged calls filled
+    assert classifiers.content_based_gpt_metadata_inference(results[0]['url'], None) == \
+        {field: [field] for field in METADATA_FIELDS}
+    assert url_cache.hit == 1
+    snippet = classifiers.content_based_adaptive_snippet(results[0]['url'], f"Text of {results[0]['url']}", ['Q?'])
+    assert snippet == [{'question': 'Q?', 'answer': 'A'}]
+    assert len(prompts) == 2
+    assert analyzer.analyze(results, 'Photosynthese')['pending'] == []
+    assert len(prompts) == 2
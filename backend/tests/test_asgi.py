@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+
+import httpx
+
+from ll import classifiers
+from ll.api import pages
+from ll.asgi import ASGIApp
+from ll.cache import URLLevelCache, WebPageCache
+from ll.classifiers import METADATA_FIELDS
+from ll.extract import Extractor
+from ll.http_client import AsyncHTTPClient
+from ll.memcache import MemoryCache
+from ll.store import SQLiteStore
+
+
+def call(app, method, path, **kwargs):
+    async def request():
+        transport = httpx.ASGITransport(app=ASGIApp(app))
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(request())
+
+
+def test_native_and_flask_routes(app):
+    response = call(app, 'GET', '/api/ping')
+    assert response.json() == {'status': 'ok'}
+    assert response.headers['server-timing'].startswith('total;dur=')
+    # Served by the Flask app
+    assert call(app, 'GET', '/api/models').status_code == 200
+    assert call(app, 'POST', '/api/metadata', content=b'[]').status_code == 400
+    assert call(app, 'OPTIONS', '/api/metadata').headers['access-control-allow-origin'] == '*'
+
+
+def test_metadata_returns_pending_after_deadline(app, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(classifiers, 'url_cache', URLLevelCache(store=SQLiteStore(tmp_path / 'cache.db', 'url_cache')))
+
+    async def fetch_text_async(url):
+        if url.endswith('slow'):
+            await asyncio.sleep(1)
+        return f'Text of {url}'
+
+    async def inference(content):
+        return {field: content for field in METADATA_FIELDS}
+
+    monkeypatch.setattr(pages, 'fetch_text_async', fetch_text_async)
+    monkeypatch.setattr(classifiers, 'fetch_content_based_gpt_metadata_inference_async', inference)
+    results = [{'url': f'https://example.org/{name}', 'title': name, 'description': ''} for name in ['fast', 'slow']]
+
+    response = call(app, 'POST', '/api/metadata', json={'results': results}, headers={'X-Deadline-Ms': '300'})
+    assert [r['teaches'] for r in response.json()] == ['Text of https://example.org/fast']
+    assert json.loads(response.headers['X-Pending-Results']) == ['https://example.org/slow']
+
+    response = call(app, 'POST', '/api/metadata?stream=ndjson', json={'results': results[:1]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]['url'] == 'https://example.org/fast' and lines[-1] == {'done': True, 'pending': []}
+
+
+def test_fetch_text_async_downloads_once(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    requests = []
+
+    def handler(request):
+        requests.append(str(request.url))
+        return httpx.Response(200, headers={'content-type': 'text/html; charset=utf-8'},
+                              content=b'<html><body><p>Das Ohmsche Gesetz beschreibt den Zusammenhang '
+                                      b'zwischen Spannung und Strom in einem Leiter.</p></body></html>')
+
+    pages = WebPageCache(memory=MemoryCache('pages', 1024 * 1024, 60), extractor=Extractor(workers=0),
+                         async_http=AsyncHTTPClient(transport=httpx.MockTransport(handler)))
+
+    async def fetch():
+        return await asyncio.gather(*[pages.fetch_text_async('https://example.org/ohm') for _ in range(3)])
+
+    texts = asyncio.run(fetch())
+    assert len(set(texts)) == 1 and 'Ohmsche Gesetz' in texts[0]
+    assert requests == ['https://example.org/ohm']
+    manifest = pages.store.get_entry('https://example.org/ohm')[1]
+    assert manifest['content_file'] == 'content.html.z' and manifest['status'] == 200
+    # The sync path reads what the async one stored
+    assert pages.fetch_text('https://example.org/ohm') == texts[0]
+
+
+def test_fetch_text_async_caches_failures(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+
+    def handler(request):
+        raise httpx.ConnectError('offline')
+
+    pages = WebPageCache(memory=MemoryCache('pages', 1024 * 1024, 60), extractor=Extractor(workers=0),
+                         async_http=AsyncHTTPClient(transport=httpx.MockTransport(handler)))
+    assert asyncio.run(pages.fetch_text_async('https://example.org/down')) is None
+    assert asyncio.run(pages.fetch_text_async('https://example.org/down')) is None
+    assert pages.negative_hits == 1
+
+
+def test_wsgi_streams_do_not_hold_up_other_routes():
+    released = threading.Event()
+
+    def wsgi_app(environ, start_response):
+        if environ['PATH_INFO'] == '/stream':
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+
+            def body():
+                yield b'first '
+                released.wait(5)
+                yield b'last'
+            return body()
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+        return [b'ok']
+
+    async def requests():
+        transport = httpx.ASGITransport(app=ASGIApp(wsgi_app, wsgi_threads=1, stream_threads=1))
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            stream = asyncio.ensure_future(client.get('/stream'))
+            await asyncio.sleep(0.1)
+            # The only WSGI thread is free although the stream is still open
+            fast = await asyncio.wait_for(client.get('/fast'), 2)
+            released.set()
+            return fast, await stream
+
+    fast, stream = asyncio.run(requests())
+    assert fast.text == 'ok' and stream.text == 'first last'
@@ -0,0 +1,85 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ll import classifiers, deadline
+from ll.batching import Batcher
+from ll.cache import URLLevelCache
+from ll.classifiers import METADATA_FIELDS
+from ll.deadline import Deadline
+from ll.store import SQLiteStore
+
+
+def test_concurrent_documents_share_one_call():
+    batches, singles = [], []
+
+    def fetch_batch(group, documents):
+        batches.append(list(documents))
+        # The last document gets no usable response
+        return {i: document.upper() for i, document in enumerate(documents) if document != 'd'}
+
+    def fetch_one(document):
+        singles.append(document)
+        return document.upper()
+
+    batcher = Batcher(fetch_batch, fetch_one, budget=100, window=0.5, max_documents=4)
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(batcher, ['a', 'b', 'c', 'd'])) == ['A', 'B', 'C', 'D']
+    assert len(batches) == 1 and sorted(batches[0]) == ['a', 'b', 'c', 'd']
+    assert singles == ['d']
+
+
+def test_budget_splits_batches_and_zero_disables():
+    batches = []
+    batcher = Batcher(lambda group, documents: batches.append(documents) or dict(enumerate(documents)),
+                      lambda document: document, budget=2, window=0.01)
+    # Each document is estimated at one token: two fit in a batch
+    with ThreadPoolExecutor(4) as executor:
+        assert sorted(executor.map(batcher, 'abcd')) == list('abcd')
+    assert all(len(batch) <= 2 for batch in batches)
+
+    off = Batcher(None, lambda document: document, budget=0)
+    assert off('a') == 'a'
+
+
+def test_batch_call_ignores_the_senders_deadline():
+    seen = []
+
+    def fetch_batch(group, documents):
+        seen.append(deadline.current())
+        return dict(enumerate(documents))
+
+    batcher = Batcher(fetch_batch, None, budget=100, window=0.5, max_documents=2)
+
+    def call(document, seconds):
+        with deadline.deadline_scope(Deadline(seconds)):
+            return batcher(document)
+
+    with ThreadPoolExecutor(2) as executor:
+        assert list(executor.map(call, 'ab', [0, 60])) == ['a', 'b']
+    assert seen == [None]
+
+
+def test_metadata_of_concurrent_pages_cached_per_url(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    url_cache = URLLevelCache(store=SQLiteStore(tmp_path / 'cache.db', 'url_cache'))
+    monkeypatch.setattr(classifiers, 'url_cache', url_cache)
+    monkeypatch.setattr(classifiers.metadata_batcher, 'window', 0.5)
+    monkeypatch.setattr(classifiers.metadata_batcher, 'max_documents', 3)
+    prompts = []
+    lock = threading.Lock()
+
+    def labels(prompt):
+        with lock:
+            prompts.append(prompt)
+        return json.dumps({str(i): {field: f'page {i}' for field in METADATA_FIELDS} for i in range(3)})
+
+    monkeypatch.setattr(classifiers, 'get_gpt4_labels', labels)
+    urls = [f'https://example.org/{i}' for i in range(3)]
+    with ThreadPoolExecutor(3) as executor:
+        responses = list(executor.map(classifiers.content_based_gpt_metadata_inference, urls,
+                                      [f'Text {i}' for i in range(3)]))
+    assert len(prompts) == 1
+    assert {response['teaches'] for response in responses} == {'page 0', 'page 1', 'page 2'}
+    for url, response in zip(urls, responses):
+        assert url_cache.peek(url) == (response,)
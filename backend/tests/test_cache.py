@@ -0,0 +1,216 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from ll import cache, extract
+from ll.cache import BodyChunks, URLLevelCache, WebPageCache
+from ll.memcache import MemoryCache
+
+
+class FakeResponse:
+    def __init__(self, url, text, content_type='text/html; charset=utf-8', status_code=200, headers=None):
+        self.url = url
+        self.content = text.encode('utf-8') if isinstance(text, str) else text
+        self.encoding = 'utf-8'
+        self.status_code = status_code
+        self.headers = {'content-type': content_type, **(headers or {})}
+        self.read = 0
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            self.read += chunk_size
+            yield self.content[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def pages(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return WebPageCache(memory=MemoryCache('pages', 1024 * 1024, 60))
+
+
+def test_cache_hit_needs_no_network(pages, monkeypatch):
+    """A miss records a manifest from the GET response, a hit never goes to the network."""
+    calls = []
+
+    def fake_stream(url, **kwargs):
+        calls.append(url)
+        return FakeResponse(url, '<html><body><p>Das Ohmsche Gesetz beschreibt den Zusammenhang '
+                                 'zwischen Spannung und Strom in einem Leiter.</p></body></html>')
+
+    monkeypatch.setattr(pages.http, 'stream', fake_stream)
+    monkeypatch.setattr(cache.requests, 'head', None)
+    assert pages.fetch('https://example.org/ohm', load_content=True)['content'] is not None
+    manifest = pages.store.get_entry('https://example.org/ohm')[1]
+    assert manifest['content_type'] == 'text/html'
+    assert manifest['status'] == 200
+
+    def offline(url, **kwargs):
+        raise requests.ConnectionError('offline')
+
+    monkeypatch.setattr(pages.http, 'stream', offline)
+    assert pages.fetch('https://example.org/ohm', load_content=True)['content'] is not None
+    assert calls == ['https://example.org/ohm']
+    assert (pages.hit, pages.miss) == (1, 1)
+
+
+def test_page_directories_are_imported_into_the_store(pages, monkeypatch):
+    url_path = pages._url_to_path('https://example.org/doc')
+    url_path.mkdir()
+    (url_path / 'content.html').write_text('<p>alt</p>', encoding='utf-8')
+    (url_path / 'extracted_text.txt').write_text('alt', encoding='utf-8')
+    monkeypatch.setattr(pages.http, 'stream', None)
+    assert pages.fetch('https://example.org/doc')['text'] == 'alt'
+    assert pages.store.get_entry('https://example.org/doc') == ('alt', WebPageCache.legacy_manifest(url_path))
+
+
+def test_fetch_text_does_not_parse_original(pages, monkeypatch):
+    url_path = pages._url_to_path('https://example.org/skript.pdf')
+    url_path.mkdir()
+    (url_path / 'content.pdf').write_bytes(b'%PDF-1.4 not really')
+    (url_path / 'extracted_text.txt').write_text('Skript', encoding='utf-8')
+    monkeypatch.setattr(extract.pypdf, 'PdfReader', None)
+    assert pages.fetch_text('https://example.org/skript.pdf') == 'Skript'
+    assert pages.fetch('https://example.org/skript.pdf')['content'] is None
+
+
+def test_concurrent_misses_fetch_once(tmp_path, monkeypatch):
+    """Threads missing the same key wait for one computation instead of repeating it."""
+    monkeypatch.setenv('HOME', str(tmp_path))
+    url_cache = URLLevelCache()
+    calls = []
+
+    def slow_llm_call(prompt):
+        calls.append(prompt)
+        time.sleep(0.2)
+        return {'answer': prompt.upper()}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda _: url_cache.get_or_fetch('https://example.org', 'prompt', slow_llm_call), range(8)))
+    assert calls == ['prompt']
+    assert results == [{'answer': 'PROMPT'}] * 8
+
+
+def test_memory_cache_evicts_by_bytes_and_ttl(monkeypatch):
+    memory = MemoryCache('test', 3000, 60)
+    for key in 'abc':
+        memory.set(key, key * 800)
+    assert memory.get('a') is not None
+    memory.set('d', 'd' * 800)
+    # 'b' was least recently used
+    assert memory.get('b') is None
+    assert memory.get('a') is not None
+    assert memory.bytes <= 3000
+
+    memory.set('huge', 'x' * 5000)
+    assert memory.get('huge') is None
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    assert memory.get('a') is None
+    stats = memory.stats()
+    assert stats['evictions'] >= 1
+    assert stats['expirations'] == 1
+    assert stats['hits'] == 2
+
+
+def test_memory_tier_hit_skips_store(pages, monkeypatch):
+    pages.store.set('https://example.org/ohm', 'Spannung und Strom', {'content_type': 'text/html',
+                                                                      'content_file': 'content.html'})
+    assert pages.fetch_text('https://example.org/ohm') == 'Spannung und Strom'
+    monkeypatch.setattr(pages.store, 'get_entry', None)
+    assert pages.fetch_text('https://example.org/ohm') == 'Spannung und Strom'
+    assert pages.stats()['memory']['hits'] == 1
+
+
+def test_compact_drops_extracted_bodies(pages, monkeypatch):
+    monkeypatch.setattr(pages.http, 'stream', lambda url, **kwargs: FakeResponse(
+        url, '<html><body><p>Der elektrische Widerstand eines Leiters ist das Verhältnis '
+             'von Spannung zu Stromstärke.</p></body></html>'))
+    text = pages.fetch_text('https://example.org/widerstand')
+    manifest = pages.store.get_entry('https://example.org/widerstand')[1]
+    assert (pages._url_to_path('https://example.org/widerstand') / manifest['content_file']).exists()
+
+    assert cache.compact(pages.store) == 1
+    assert not pages._url_to_path('https://example.org/widerstand').exists()
+    assert pages.store.get('https://example.org/widerstand') == text
+    assert cache.compact(pages.store) == 0
+
+
+def test_html_bodies_are_compressed(pages, monkeypatch):
+    html = ('<html><body>' + '<p class="absatz">Die Spannung ist die Ursache des Stroms.</p>' * 200
+            + '</body></html>')
+    monkeypatch.setattr(pages.http, 'stream', lambda url, **kwargs: FakeResponse(url, html))
+    fetched = pages.fetch('https://example.org/spannung', load_content=True)
+    manifest = pages.store.get_entry('https://example.org/spannung')[1]
+    assert manifest['content_file'] == 'content.html.z'
+    assert manifest['body_size'] < len(html) / 10
+    assert fetched['content'] == html
+    assert 'Ursache des Stroms' in fetched['text']
+
+
+def test_failed_downloads_are_negatively_cached(pages, monkeypatch):
+    calls = []
+
+    def timeout(url, **kwargs):
+        calls.append(url)
+        raise requests.Timeout('slow')
+
+    monkeypatch.setattr(pages.http.session, 'get', timeout)
+    assert pages.fetch_text('https://example.org/langsam') is None
+    assert pages.fetch_text('https://example.org/langsam') is None
+    assert len(calls) == 1
+    assert pages.stats()['negative']['hits'] == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + pages.negative_ttl + 1)
+    assert pages.fetch_text('https://example.org/langsam') is None
+    assert len(calls) == 2
+
+
+def test_long_html_is_truncated_while_streaming(pages, monkeypatch):
+    monkeypatch.setenv('LL_MAX_BODY_HTML', '100000')
+    html = '<html><body>' + '<p>Ohmsches Gesetz ü</p>' * 20000 + '</body></html>'
+    response = FakeResponse('https://example.org/long', html)
+    monkeypatch.setattr(pages.http, 'stream', lambda url, **kwargs: response)
+    manifest = pages._download_once('https://example.org/long')
+    assert manifest['truncated']
+    # Stopped reading after the limit instead of loading the whole body
+    assert response.read <= 100000 + BodyChunks.CHUNK_SIZE
+    body = pages._read_text(pages._url_to_path('https://example.org/long') / manifest['content_file'])
+    assert body.startswith('<html><body><p>Ohmsches Gesetz ü</p>') and len(body.encode('utf-8')) <= 100000
+
+
+def test_oversized_pdf_is_not_downloaded(pages, monkeypatch):
+    monkeypatch.setenv('LL_MAX_BODY_PDF', '1000')
+    declared = FakeResponse('https://example.org/big.pdf', b'%PDF' + b'0' * 2000, 'application/pdf',
+                            headers={'content-length': '2004'})
+    monkeypatch.setattr(pages.http, 'stream', lambda url, **kwargs: declared)
+    assert pages.fetch_text('https://example.org/big.pdf') is None
+    assert declared.read == 0
+    assert pages.failures.get('https://example.org/big.pdf')['error'] == 'BodyTooLarge'
+
+    undeclared = FakeResponse('https://example.org/big2.pdf', b'%PDF' + b'0' * 2000, 'application/pdf')
+    monkeypatch.setattr(pages.http, 'stream', lambda url, **kwargs: undeclared)
+    assert pages.fetch_text('https://example.org/big2.pdf') is None
+    assert not list(pages._url_to_path('https://example.org/big2.pdf').glob('content.pdf*'))
+
+
+def test_file_backend_disables_eviction(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('LL_CACHE_MAX_BYTES', '1000')
+    monkeypatch.setenv('LL_CACHE_BACKEND', 'file')
+    assert WebPageCache(memory=MemoryCache('pages', 1024 * 1024, 60)).max_bytes == 0
+    monkeypatch.setenv('LL_CACHE_BACKEND', 'sqlite')
+    assert WebPageCache(memory=MemoryCache('pages', 1024 * 1024, 60)).max_bytes == 1000
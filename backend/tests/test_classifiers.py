@@ -0,0 +1,58 @@
+import pytest
+
+from ll.classifiers import (SVM_CLASSIFIERS, check_compact_parity, check_text_classifier_parity, classify_batch,
+                            models, predict_with_threshold, url_domain)
+
+RESULTS = [
+    {'url': 'https://www.leifiphysik.de/elektrizitaetslehre/ohmsches-gesetz',
+     'title': 'Ohmsches Gesetz', 'description': 'Aufgaben und Versuche zum Ohmschen Gesetz'},
+    {'url': 'https://www.amazon.de/Mathematik-Klasse-5',
+     'title': 'Mathematik Klasse 5 Arbeitsheft', 'description': 'Jetzt bestellen, kostenlose Lieferung'},
+    {'url': 'https://www.uni-due.de/chemie/lehre',
+     'title': 'Vorlesung Organische Chemie', 'description': 'Skript und Übungsblätter für Studierende'},
+    {'url': 'not a url', 'title': '', 'description': ''},
+]
+
+
+def test_batch_matches_single_predictions():
+    """One batched pass gives the same labels as predicting each result alone."""
+    batch = classify_batch(RESULTS)
+    for result, attributes in zip(RESULTS, batch):
+        for attribute, (name, kind, threshold) in SVM_CLASSIFIERS.items():
+            text = f"{result['title']} {result['description']}"
+            single = predict_with_threshold(models.get(name).pipeline,
+                                            [text if kind == 'text' else url_domain(result['url'])],
+                                            threshold)
+            assert attributes[attribute]['label'] == single['label']
+            assert abs(attributes[attribute]['confidence'] - single['confidence']) < 1e-9
+
+
+def test_empty_batch():
+    assert classify_batch([]) == []
+
+
+def test_shared_text_classifier_parity():
+    """The shared-vectorizer model labels texts exactly like the per-field pipelines."""
+    assert models.available('text')
+    texts = [f"{r['title']} {r['description']}" for r in RESULTS]
+    assert check_text_classifier_parity(models.get('text'), texts) == []
+    with pytest.raises(ValueError):
+        check_text_classifier_parity(models.get('text'), [])
+
+
+def test_compact_models_match_pipelines():
+    """The exported NumPy models score like the pickled sklearn pipelines."""
+    assert models.available('compact')
+    compact = models.get('compact')
+    inputs = {
+        'text': [f"{r['title']} {r['description']}" for r in RESULTS],
+        'domain': [url_domain(r['url']) for r in RESULTS],
+    }
+    for name, kind, _ in SVM_CLASSIFIERS.values():
+        expected = models.get(name).predict(inputs[kind], 0.0)
+        actual = compact.predict(inputs[kind], {name: 0.0})[name]
+        assert [p['label'] for p in actual] == [p['label'] for p in expected]
+        for a, b in zip(actual, expected):
+            assert abs(a['confidence'] - b['confidence']) < 1e-6
+    with pytest.raises(ValueError):
+        check_compact_parity(compact, {}, [])
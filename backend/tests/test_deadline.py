@@ -0,0 +1,67 @@
+import json
+import time
+
+from flask import url_for
+
+from ll import deadline, metadata
+from ll.api import pages
+from ll.deadline import Deadline, map_until_deadline
+
+
+def test_map_until_deadline_returns_finished_results():
+    def work(item):
+        time.sleep(item['sleep'])
+        return {'url': item['url'], 'timeout': deadline.timeout(30)}
+
+    items = [{'url': 'fast', 'sleep': 0}, {'url': 'slow', 'sleep': 1}, {'url': 'none', 'sleep': 0}]
+    start = time.monotonic()
+    results = map_until_deadline(lambda item: work(item) if item['url'] != 'none' else None,
+                                 items, lambda item: item['url'], Deadline(0.3), grace=1)
+    assert time.monotonic() - start < 0.9
+    assert [r['url'] for r in results] == ['fast']
+    # Only the waiting stopped at the deadline, the task's own is a second later
+    assert 0.3 < results[0]['timeout'] <= 1.3
+    # Without a result an item stays pending, to be asked for again
+    assert results.pending == ['slow', 'none']
+
+
+def test_metadata_returns_pending_after_deadline(client, monkeypatch):
+    def inference(url, content):
+        if url.endswith('slow'):
+            time.sleep(1)
+        return {field: url for field in ['assesses', 'teaches', 'educational_level', 'educational_role',
+                                         'educational_use', 'learning_resource_type']}
+
+    monkeypatch.setattr(pages, 'fetch_text', lambda url: 'Text')
+    monkeypatch.setattr(metadata, 'content_based_gpt_metadata_inference', inference)
+    results = [{'url': 'https://example.org/fast', 'title': 'Fast', 'description': ''},
+               {'url': 'https://example.org/slow', 'title': 'Slow', 'description': ''}]
+    response = client.post(url_for('api.metadata_endpoint'), json={'results': results},
+                           headers={'X-Deadline-Ms': '300'})
+    assert [r['url'] for r in response.json] == ['https://example.org/fast']
+    assert response.headers['X-Pending-Results'] == '["https://example.org/slow"]'
+
+
+def test_metadata_streams_results_as_they_complete(client, monkeypatch):
+    def inference(url, content):
+        if url.endswith('slow'):
+            time.sleep(0.3)
+        return {field: url for field in ['assesses', 'teaches', 'educational_level', 'educational_role',
+                                         'educational_use', 'learning_resource_type']}
+
+    monkeypatch.setattr(pages, 'fetch_text', lambda url: 'Text')
+    monkeypatch.setattr(metadata, 'content_based_gpt_metadata_inference', inference)
+    results = [{'url': 'https://example.org/slow', 'title': 'Slow', 'description': ''},
+               {'url': 'https://example.org/fast', 'title': 'Fast', 'description': ''}]
+
+    response = client.post(url_for('api.metadata_endpoint'), json={'results': results},
+                           headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line.get('url') for line in lines] == ['https://example.org/fast', 'https://example.org/slow', None]
+    assert lines[-1] == {'done': True, 'pending': []}
+
+    response = client.post(url_for('api.metadata_endpoint', stream='sse'), json={'results': results})
+    events = response.get_data(as_text=True).strip().split('\n\n')
+    assert events[0].startswith('event: result\ndata: {"url": "https://example.org/fast"')
+    assert events[-1] == 'event: done\ndata: {"done": true, "pending": []}'
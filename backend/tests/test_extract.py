@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from ll import extract
+from ll.extract import ExtractionTimeout, Extractor, extract_file, run_limited
+
+HTML = "<html><body><article><h1>Photosynthese</h1>" + \
+    "<p>Pflanzen wandeln Licht in chemische Energie um, dabei entsteht Sauerstoff.</p>" * 20 + \
+    "</article></body></html>"
+
+
+def test_pool_extracts_like_inline(tmp_path):
+    path = tmp_path / 'content.html'
+    path.write_text(HTML, encoding='utf-8')
+    extractor = Extractor(workers=1)
+    assert extractor.extract(path, 'text/html') == extract_file(path, 'text/html')
+    assert 'Sauerstoff' in extractor.extract(path, 'text/html')
+    assert extractor.extract(tmp_path / 'missing.html', 'text/html') is None
+
+
+def test_oversized_bodies_are_not_parsed(tmp_path):
+    path = tmp_path / 'content.html'
+    path.write_text(HTML, encoding='utf-8')
+    extractor = Extractor(workers=0, max_bytes=100)
+    assert extractor.extract(path, 'text/html') == ""
+    assert extractor.stats()['too_large'] == 1
+
+
+def test_cpu_time_is_limited():
+    def spin():
+        while True:
+            pass
+
+    start = time.monotonic()
+    with pytest.raises(ExtractionTimeout):
+        run_limited(spin, cpu_seconds=0.2)
+    assert time.monotonic() - start < 2
+    assert run_limited(sum, [1, 2], cpu_seconds=0.2) == 3
+
+
+def test_cpu_limit_is_not_swallowed_by_parsers():
+    def spin_and_swallow_errors():
+        while True:
+            try:
+                while True:
+                    pass
+            except Exception:
+                pass
+
+    start = time.monotonic()
+    with pytest.raises(ExtractionTimeout):
+        run_limited(spin_and_swallow_errors, cpu_seconds=0.2)
+    assert time.monotonic() - start < 2
+
+
+def test_pdf_pages_are_parsed_until_enough_text(tmp_path, monkeypatch):
+    parsed = []
+
+    class Page:
+        def __init__(self, i):
+            self.i = i
+
+        def extract_text(self):
+            parsed.append(self.i)
+            return 'x' * 1000
+
+    class Reader:
+        def __init__(self, f):
+            self.pages = [Page(i) for i in range(100)]
+
+    monkeypatch.setattr(extract.pypdf, 'PdfReader', Reader)
+    path = tmp_path / 'content.pdf'
+    path.write_bytes(b'%PDF-1.4')
+    assert len(extract_file(path, 'application/pdf', max_chars=2500)) == 2500
+    assert parsed == [0, 1, 2]
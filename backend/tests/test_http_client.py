@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ll.http_client import CircuitBreaker, CircuitOpenError, HTTPClient
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delay)
+        body = b'<html><body>ok</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    server.lock = threading.Lock()
+    server.connections = server.active = server.max_active = 0
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_keep_alive_reuses_connections(server):
+    """Sequential fetches from one host share a single pooled connection."""
+    url = f'http://127.0.0.1:{server.server_port}/page'
+    for i in range(10):
+        requests.get(f'{url}?plain={i}', timeout=5)
+    plain_connections = server.connections
+
+    server.connections = 0
+    client = HTTPClient()
+    for i in range(10):
+        assert client.get(f'{url}?pooled={i}', timeout=5).status_code == 200
+    assert plain_connections == 10
+    assert server.connections == 1
+    assert client.stats() == {'requests': 10, 'connections': 1, 'reused': 9, 'open_circuits': []}
+
+
+def test_per_host_concurrency_cap(server):
+    server.delay = 0.05
+    client = HTTPClient(per_host=2)
+    url = f'http://127.0.0.1:{server.server_port}/page'
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: client.get(f'{url}?i={i}', timeout=5), range(8)))
+    assert server.max_active <= 2
+    assert client.stats()['connections'] <= 2
+
+
+def test_circuit_opens_after_repeated_timeouts(monkeypatch):
+    breaker = CircuitBreaker(failures=3, reset_after=60)
+    client = HTTPClient(breaker=breaker)
+    calls = []
+
+    def timeout(url, **kwargs):
+        calls.append(url)
+        raise requests.Timeout('slow')
+
+    monkeypatch.setattr(client.session, 'get', timeout)
+    for _ in range(3):
+        with pytest.raises(requests.Timeout):
+            client.get('http://slow.example.org/a', timeout=1)
+    with pytest.raises(CircuitOpenError):
+        client.get('http://slow.example.org/b', timeout=1)
+    assert len(calls) == 3
+    assert client.stats()['open_circuits'] == ['slow.example.org']
+
+    # After reset_after a single probe goes through, and its success closes the circuit
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    monkeypatch.setattr(client.session, 'get', lambda url, **kwargs: 'ok')
+    assert breaker.allow('slow.example.org')
+    assert not breaker.allow('slow.example.org')
+    breaker.success('slow.example.org')
+    assert client.get('http://slow.example.org/c', timeout=1) == 'ok'
+    assert client.stats()['open_circuits'] == []
+
+
+def test_probe_is_released_on_other_errors(monkeypatch):
+    breaker = CircuitBreaker(failures=1, reset_after=60)
+    client = HTTPClient(breaker=breaker)
+    breaker.failure('flaky.example.org')
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+
+    def invalid(url, **kwargs):
+        raise requests.exceptions.InvalidHeader('bad header')
+
+    monkeypatch.setattr(client.session, 'get', invalid)
+    with pytest.raises(requests.exceptions.InvalidHeader):
+        client.get('http://flaky.example.org/a', timeout=1)
+    # The probe ended without an outcome, the next request probes again
+    monkeypatch.setattr(client.session, 'get', lambda url, **kwargs: 'ok')
+    assert client.get('http://flaky.example.org/b', timeout=1) == 'ok'
+    assert client.stats()['open_circuits'] == []
+
+
+def test_stream_holds_the_host_slot_until_closed(monkeypatch):
+    client = HTTPClient(per_host=1)
+    closed = []
+
+    class Response:
+        def close(self):
+            closed.append(True)
+
+    monkeypatch.setattr(client.session, 'get', lambda url, **kwargs: Response())
+    slot = client._host_slot('example.org')
+    with client.stream('http://example.org/big', timeout=1):
+        # The body is still being read, other requests to the host wait
+        assert not slot.acquire(blocking=False)
+    assert closed == [True]
+    assert slot.acquire(blocking=False)
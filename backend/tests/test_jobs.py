@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+import pytest
+from flask import url_for
+
+from ll.jobs import JobQueue, QueueFull
+from ll.store import SQLiteStore
+
+
+def serp(name, n):
+    return [{'url': f'https://example.org/{name}{rank}', 'title': '', 'description': ''} for rank in range(n)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(tmp_path / 'cache.db', 'jobs')
+
+
+def test_tasks_run_in_rank_order_across_jobs(store):
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def handler(result, query):
+        order.append(result['url'].rsplit('/', 1)[1])
+        started.set()
+        release.wait(5)
+        return {'query': query}
+
+    jobs = JobQueue({'metadata': handler}, workers=1, store=store)
+    first = jobs.submit(serp('a', 3), 'Ohm')
+    started.wait(5)
+    second = jobs.submit(serp('b', 3), 'Ohm')
+    release.set()
+
+    assert len(list(jobs.follow(first, timeout=5))) == 3
+    assert len(list(jobs.follow(second, timeout=5))) == 3
+    # The top result of the second SERP goes before the tail of the first one
+    assert order == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2']
+    snapshot = jobs.get(second)
+    assert snapshot['status'] == 'done' and snapshot['pending'] == []
+    assert snapshot['results'][0]['result'] == {'query': 'Ohm'}
+
+
+def test_jobs_are_visible_to_other_processes(store):
+    jobs = JobQueue({'metadata': lambda result, query: result['url']}, workers=2, store=store)
+    job_id = jobs.submit(serp('a', 4))
+    list(jobs.follow(job_id, timeout=5))
+
+    # A queue in another worker process only sees the saved state
+    other = JobQueue({'metadata': lambda result, query: None}, store=store)
+    snapshot = other.get(job_id)
+    assert snapshot['completed'] == 4
+    assert sorted(r['result'] for r in other.follow(job_id, timeout=5, poll_interval=0)) == \
+        [f'https://example.org/a{rank}' for rank in range(4)]
+
+
+def test_finished_jobs_expire_from_the_store(store, monkeypatch):
+    jobs = JobQueue({'metadata': lambda result, query: None}, workers=1, ttl=60, store=store)
+    job_id = jobs.submit(serp('a', 1))
+    list(jobs.follow(job_id, timeout=5))
+    other = JobQueue({'metadata': lambda result, query: None}, ttl=60, store=store)
+    assert other.get(job_id) is not None
+
+    later = time.time() + 61
+    monkeypatch.setattr('ll.jobs.time.time', lambda: later)
+    assert other.get(job_id) is None and job_id not in store
+    # Swept on submit, also when nobody asks for it again
+    old = jobs.submit(serp('b', 1))
+    list(jobs.follow(old, timeout=5))
+    monkeypatch.setattr('ll.jobs.time.time', lambda: later + 61)
+    jobs.submit(serp('c', 1))
+    assert old not in store
+
+
+def test_submit_limits(store):
+    jobs = JobQueue({'metadata': lambda result, query: None}, max_tasks=5, store=store)
+    with pytest.raises(ValueError):
+        jobs.submit(serp('a', 1), features=['summary'])
+    with pytest.raises(QueueFull):
+        jobs.submit(serp('a', 6))
+
+
+def test_job_endpoints(client, monkeypatch):
+    from ll.api import jobs
+    monkeypatch.setattr(jobs, 'handlers', {
+        'metadata': lambda result, query: {'url': result['url'], 'teaches': 'Ohm'},
+        'snippets': lambda result, query: {'url': result['url'], 'enhanced_snippet': query},
+    })
+    response = client.post(url_for('api.create_job'), json={'results': serp('a', 10), 'query': 'Ohm'})
+    assert response.status_code == 202
+    stream = client.get(response.json['stream_url']).get_data(as_text=True)
+    lines = [json.loads(line) for line in stream.splitlines()]
+    assert len(lines) == 21 and lines[-1] == {'done': True, 'pending': []}
+    status = client.get(response.json['status_url']).json
+    assert status['status'] == 'done' and status['completed'] == 20
+    assert client.get(url_for('api.job_status', job_id='missing')).status_code == 404
+    # Snippets are answers to the query's questions
+    assert client.post(url_for('api.create_job'), json={'results': serp('a', 1)}).status_code == 400
+    response = client.post(url_for('api.create_job'), json={'results': serp('a', 1), 'features': ['metadata']})
+    assert response.status_code == 202
@@ -0,0 +1,113 @@
+import asyncio
+import math
+import threading
+import time
+
+import pytest
+
+from ll import llm
+from ll.deadline import Deadline, DeadlineExceeded, deadline_scope
+from ll.llm import FakeProvider, LLMClient, RetryableError, TokenBucket
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    start = time.monotonic()
+    for _ in range(4):
+        assert bucket.acquire()
+    # Two from the burst, two more at 20 per second
+    assert 0.08 <= time.monotonic() - start < 0.5
+    assert not bucket.acquire(2, timeout=0.01)
+
+
+def test_retries_retryable_errors():
+    provider = FakeProvider(latency=0, error_rate=0.5, seed=1)
+    client = LLMClient(provider, 'fake', max_retries=10, backoff=0.001)
+    responses = {client.complete(f'prompt {i}') for i in range(10)}
+    assert len(responses) == 10
+    stats = client.stats()
+    assert stats['requests'] == 10 + stats['retries'] and stats['retries'] > 0
+    assert stats['errors'] == 0 and stats['in_flight'] == 0
+
+    failing = LLMClient(FakeProvider(latency=0, error_rate=1), 'fake', max_retries=2, backoff=0.001)
+    with pytest.raises(RetryableError):
+        failing.complete('prompt')
+    assert failing.stats()['requests'] == 3
+
+
+def test_concurrency_is_capped():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def respond(model, prompt):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return prompt
+
+    client = LLMClient(FakeProvider(latency=0, respond=respond), 'fake', concurrency=2)
+    threads = [threading.Thread(target=client.complete, args=(f'{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+
+
+def test_rate_limit_wait_bounded_by_deadline():
+    client = LLMClient(FakeProvider(latency=0), 'fake', requests_per_minute=1)
+    client.complete('first')
+    with deadline_scope(Deadline(0.1)), pytest.raises(DeadlineExceeded):
+        client.complete('second')
+
+
+def test_fake_provider_is_deterministic(monkeypatch):
+    monkeypatch.setenv('LL_LLM_PROVIDER', 'fake')
+    monkeypatch.setattr(llm, '_clients', {})
+    monkeypatch.setattr(llm, '_providers', {'fake': FakeProvider(latency=0)})
+    assert llm.complete('prompt') == llm.complete('prompt') != llm.complete('other prompt')
+    assert llm.client(fast=True).model == 'fake-fast'
+
+
+def test_async_calls_share_the_concurrency_cap():
+    provider = FakeProvider(latency=0.05)
+    client = LLMClient(provider, 'fake', concurrency=4)
+    peak = 0
+
+    async def complete(i):
+        nonlocal peak
+        task = asyncio.ensure_future(client.complete_async(f'prompt {i}'))
+        while not task.done():
+            peak = max(peak, client.stats()['in_flight'])
+            await asyncio.sleep(0.005)
+        return await task
+
+    async def run():
+        return await asyncio.gather(*[complete(i) for i in range(12)])
+
+    start = time.monotonic()
+    assert len(set(asyncio.run(run()))) == 12
+    # Three rounds of four
+    assert time.monotonic() - start >= 0.15
+    assert peak == 4 and client.stats()['requests'] == 12
+
+
+def test_async_slot_given_up_on_is_not_leaked():
+    async def run():
+        slots = asyncio.Semaphore(1)
+        await slots.acquire()
+        assert not await llm._acquire_async(slots, 0.01)
+        waiter = asyncio.ensure_future(llm._acquire_async(slots, math.inf))
+        await asyncio.sleep(0)
+        # The slot frees up just as its waiter is cancelled
+        slots.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+        return await llm._acquire_async(slots, 0.1), await llm._acquire_async(slots, 0.01)
+
+    assert asyncio.run(run()) == (True, False)
@@ -0,0 +1,45 @@
+import time
+
+from flask import url_for
+
+from ll import classifiers, timing
+from ll.api import pages
+from ll.cache import URLLevelCache
+from ll.classifiers import METADATA_FIELDS
+from ll.store import SQLiteStore
+from ll.timing import Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1))
+    for seconds in [0.05, 0.5, 0.7, 3]:
+        histogram.observe(seconds)
+    assert histogram.snapshot() == ([1, 3, 4], 4.25, 4)
+
+
+def test_metadata_reports_stages_and_metrics(client, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(classifiers, 'url_cache', URLLevelCache(store=SQLiteStore(tmp_path / 'cache.db', 'url_cache')))
+
+    @timing.timed('download')
+    def fetch_text(url):
+        time.sleep(0.01)
+        return 'Text'
+
+    monkeypatch.setattr(pages, 'fetch_text', fetch_text)
+    monkeypatch.setattr(classifiers, 'get_gpt4_labels',
+                        lambda prompt: '{%s}' % ', '.join(f'"{field}": "x"' for field in METADATA_FIELDS))
+    results = [{'url': f'https://example.org/{i}', 'title': f'Page {i}', 'description': ''} for i in range(2)]
+    response = client.post(url_for('api.metadata_endpoint'), json={'results': results})
+    assert len(response.json) == 2
+
+    stages = dict(part.split(';', 1) for part in response.headers['Server-Timing'].split(', '))
+    assert {'download', 'cache_lookup', 'json_parse', 'total'} <= set(stages)
+    assert stages['download'].endswith('desc="2x"')
+
+    metrics = client.get(url_for('api.metrics'))
+    assert metrics.mimetype == 'text/plain'
+    text = metrics.get_data(as_text=True)
+    assert 'll_stage_seconds_bucket{stage="download",le="+Inf"}' in text
+    assert 'll_request_seconds_count{endpoint="api.metadata_endpoint"}' in text
+    assert 'll_cache_misses_total{cache="metadata",layer="store"}' in text
@@ -0,0 +1,46 @@
+import pytest
+
+from ll.cache import WebPageCache
+from ll.pack import build_pack, open_pack
+from ll.store import hash
+
+PAGES = {
+    'https://example.org/ohm': 'Das Ohmsche Gesetz: U = R · I',
+    'https://example.org/leer': '',
+    'https://example.org/html': '<html><body><article><p>Ein Kondensator speichert elektrische Ladung '
+                                'und damit Energie im elektrischen Feld.</p></article></body></html>',
+}
+
+
+@pytest.fixture
+def pack(tmp_path):
+    source = tmp_path / 'webpage_cache'
+    for url, text in PAGES.items():
+        (source / hash(url)).mkdir(parents=True)
+        (source / hash(url) / 'playwright.txt').write_text(text, encoding='utf-8')
+    (source / hash('https://example.org/lfs')).mkdir()
+    (source / hash('https://example.org/lfs') / 'playwright.txt').write_text(
+        'version https://git-lfs.github.com/spec/v1\noid sha256:1234\nsize 10\n')
+    assert build_pack(source, tmp_path / 'pages.pack') == 2
+    return open_pack(tmp_path / 'pages.pack')
+
+
+def test_pack_lookup(pack):
+    assert pack.get('https://example.org/ohm') == 'Das Ohmsche Gesetz: U = R · I'
+    assert pack.get('https://example.org/leer') is None
+    assert 'Kondensator speichert' in pack.get('https://example.org/html')
+    assert '<p>' not in pack.get('https://example.org/html')
+    assert pack.get('https://example.org/lfs') is None
+    assert 'https://example.org/missing' not in pack
+
+
+def test_fetch_text_reads_pack_before_network(pack, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    pages = WebPageCache(pack=pack)
+    monkeypatch.setattr(pages.http, 'stream', None)
+    assert pages.fetch_text('https://example.org/ohm') == 'Das Ohmsche Gesetz: U = R · I'
+    assert pages.stats()['pack'] == {'pages': 2, 'hits': 1}
+
+
+def test_missing_pack(tmp_path):
+    assert open_pack(tmp_path / 'missing.pack') is None
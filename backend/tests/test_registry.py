@@ -0,0 +1,52 @@
+import os
+import pickle
+
+from ll.registry import ModelRegistry
+
+
+def write_model(path, value, mtime):
+    with open(path, 'wb') as f:
+        pickle.dump(value, f)
+    os.utime(path, (mtime, mtime))
+
+
+def test_loads_once_and_reloads_on_change(tmp_path):
+    """Models are cached across calls and swapped when the file changes."""
+    write_model(tmp_path / 'm.pkl', {'version': 1}, 1000)
+    registry = ModelRegistry(tmp_path, check_interval=0)
+    registry.register('m', 'm.pkl')
+
+    first = registry.get('m')
+    assert registry.get('m') is first
+    assert set(registry.stats()['m'].keys()) >= {'load_seconds', 'memory_bytes'}
+
+    write_model(tmp_path / 'm.pkl', {'version': 2}, 2000)
+    assert registry.get('m') == {'version': 2}
+
+
+def test_broken_reload_keeps_previous_model(tmp_path):
+    write_model(tmp_path / 'm.pkl', {'version': 1}, 1000)
+    registry = ModelRegistry(tmp_path, check_interval=0)
+    registry.register('m', 'm.pkl')
+    registry.warm()
+
+    (tmp_path / 'm.pkl').write_bytes(b'not a pickle')
+    os.utime(tmp_path / 'm.pkl', (2000, 2000))
+    assert registry.get('m') == {'version': 1}
+
+
+def test_memory_is_measured_only_when_asked(tmp_path):
+    import tracemalloc
+    write_model(tmp_path / 'm.pkl', list(range(1000)), 1000)
+    registry = ModelRegistry(tmp_path, measure_memory=False)
+    registry.register('m', 'm.pkl')
+    registry.get('m')
+    assert not tracemalloc.is_tracing() and registry.stats()['m']['memory_bytes'] is None
+
+    measured = ModelRegistry(tmp_path, measure_memory=True)
+    measured.register('m', 'm.pkl')
+    try:
+        measured.get('m')
+        assert measured.stats()['m']['memory_bytes'] > 0
+    finally:
+        tracemalloc.stop()
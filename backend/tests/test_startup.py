@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).parent.parent
+
+# Imported on first use, not by importing the app
+DEFERRED = ['spacy', 'trafilatura', 'pypdf', 'docx', 'PIL', 'pandas', 'sklearn', 'openai', 'anthropic']
+
+# Seconds importing the app may take, generous for slow CI machines
+IMPORT_BUDGET = float(os.getenv('LL_IMPORT_BUDGET', 2.0))
+
+
+def import_times(module):
+    """Cumulative import time in seconds per module, as reported by -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=BACKEND, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_app_import_defers_heavy_modules():
+    times = import_times('ll.api')
+    assert sorted(set(DEFERRED) & set(times)) == []
+    assert times['ll.api'] < IMPORT_BUDGET, sorted(times.items(), key=lambda item: -item[1])[:10]
+
+
+def test_extraction_workers_do_not_import_the_app():
+    # What a spawned extraction process imports to unpickle _extract_in_worker
+    times = import_times('ll.extract')
+    assert sorted({'flask', 'flask_sqlalchemy', 'll.api', 'll.llm'} & set(times)) == []
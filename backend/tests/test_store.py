@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from ll.store import JSONFileStore, SQLiteStore, hash, migrate_file_caches, open_store
+
+
+@pytest.fixture(params=['sqlite', 'file'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStore(tmp_path / 'cache.db', 'test')
+    return JSONFileStore(tmp_path / 'test')
+
+
+def test_roundtrip(store):
+    store.set(('https://example.org', 'content', ('q1',)), [{'question': 'q1', 'answer': 'a1'}])
+    store.set('https://example.org/page', 'text', {'content_type': 'text/html'})
+    store.set('failed', None)
+
+    assert store.get(('https://example.org', 'content', ('q1',))) == [{'question': 'q1', 'answer': 'a1'}]
+    assert store.get_entry('https://example.org/page') == ('text', {'content_type': 'text/html'})
+    # A cached None is still an entry, unlike a missing key
+    assert store.get_entry('failed') == (None, None)
+    assert store.get_entry('missing') is None
+
+
+def test_batches(store):
+    store.set_many({f'key{i}': {'i': i} for i in range(1200)})
+    found = store.get_many([f'key{i}' for i in range(0, 1300, 100)])
+    assert found == {f'key{i}': {'i': i} for i in range(0, 1200, 100)}
+    store.delete('key0')
+    assert 'key0' not in store
+
+
+def test_namespaces_are_separate(tmp_path):
+    SQLiteStore(tmp_path / 'cache.db', 'pages').set('k', 'page')
+    assert SQLiteStore(tmp_path / 'cache.db', 'url_cache').get('k') is None
+
+
+def test_migrate_file_caches(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    root = tmp_path / '.cache' / 'LessonLens'
+    (root / 'url_cache').mkdir(parents=True)
+    (root / 'url_cache' / f"{hash('https://example.org')}.json").write_text(json.dumps({'teaches': 'Optik'}))
+    page_dir = root / 'web_page_cache' / hash('https://example.org/page')
+    page_dir.mkdir(parents=True)
+    (page_dir / 'content.pdf').write_bytes(b'%PDF')
+    (page_dir / 'extracted_text.txt').write_text('Linsen', encoding='utf-8')
+
+    assert migrate_file_caches('sqlite') == {'url_cache': 1, 'pages': 1}
+    assert open_store('url_cache', 'sqlite').get('https://example.org') == {'teaches': 'Optik'}
+    text, manifest = open_store('pages', 'sqlite').get_entry('https://example.org/page')
+    assert (text, manifest['content_type']) == ('Linsen', 'application/pdf')
+
+
+def test_evict_least_recently_accessed(tmp_path, monkeypatch):
+    pages = SQLiteStore(tmp_path / 'cache.db', 'pages')
+    answers = SQLiteStore(tmp_path / 'cache.db', 'url_cache')
+    clock = [1000.0]
+    monkeypatch.setattr('ll.store.time.time', lambda: clock[0])
+    for i in range(4):
+        pages.set(f'page{i}', 'text', {'body_size': 1000})
+        clock[0] += 100
+    answers.set('answer', {'label': 'x'})
+    clock[0] += 100
+    # Reading page0 makes page1 the least recently used entry
+    assert pages.get('page0') == 'text'
+
+    assert pages.usage()['pages']['entries'] == 4
+    total = sum(usage['bytes'] for usage in pages.usage().values())
+    evicted = pages.evict(total - 500)
+    assert evicted == [('pages', hash('page1'))]
+    assert 'page1' not in pages and 'page0' in pages and 'answer' in answers
+    assert pages.evict(10 ** 9) == []
+
+
+def test_large_values_are_compressed(tmp_path):
+    from ll.compression import is_compressed
+    store = SQLiteStore(tmp_path / 'cache.db', 'pages')
+    store.dictionaries.save('pages', b'"Der elektrische Strom ist die gerichtete Bewegung')
+    text = 'Der elektrische Strom ist die gerichtete Bewegung von Ladungsträgern. ' * 50
+    store.set('page', text, {'content_type': 'text/html'})
+    store.set('small', 'kurz')
+    blobs = dict(store._conn().execute("SELECT key, value FROM entries"))
+    assert is_compressed(blobs[hash('page')]) and not is_compressed(blobs[hash('small')])
+    assert store.get('page') == text and store.get('small') == 'kurz'
+    assert list(store.scan())[0][1] in (text, 'kurz')